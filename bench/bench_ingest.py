@@ -0,0 +1,98 @@
+"""
+Compare CSV → Delta ingest engines on a scaled-up copy of sample.csv.
+
+    python bench/bench_ingest.py --rows 2000000
+
+Runs the pandas path, the multithreaded Arrow reader and the streaming
+reader from lambda-image/convert.py against local files (no AWS needed)
+and prints rows/sec for parse-only and parse + Delta write.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "lambda-image"))
+
+# common reads these at import time; nothing here talks to AWS
+for name in ("BUCKET_NAME", "DDB_TABLE_NAME", "DELTA_INSTANCE_ID", "DELTA_SERVER_URL"):
+    os.environ.setdefault(name, "bench")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import convert  # noqa: E402
+
+
+def scale_sample(path: str, rows: int) -> None:
+    """Write `rows` data rows by repeating sample.csv with fresh ids."""
+    with open(os.path.join(ROOT, "sample.csv")) as f:
+        header, *lines = f.read().splitlines()
+    tails = [line.split(",", 1)[1] for line in lines]
+    with open(path, "w") as out:
+        out.write(header + "\n")
+        for start in range(0, rows, len(tails)):
+            chunk = tails[: min(len(tails), rows - start)]
+            out.write("".join(f"{start + i + 1},{t}\n" for i, t in enumerate(chunk)))
+
+
+def engines(path: str):
+    with open(path, "rb") as f:
+        sample = f.read(convert.SCHEMA_SAMPLE_BYTES)
+    schema = convert.infer_csv_schema(sample[: sample.rfind(b"\n") + 1])
+    return {
+        "pandas": lambda: convert.read_csv_pandas(path),
+        "arrow": lambda: convert.read_csv_table(path, schema),
+        "streaming": lambda: convert.open_csv_stream(path, schema),
+    }
+
+
+def consume(data):
+    # the streaming reader is lazy; drain it so parse time is counted
+    if hasattr(data, "read_next_batch"):
+        for _ in data:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-ingest-")
+    try:
+        csv_path = os.path.join(workdir, "scaled.csv")
+        scale_sample(csv_path, args.rows)
+        size_mb = os.path.getsize(csv_path) / 1e6
+        print(f"{args.rows:,} rows, {size_mb:.1f} MB\n")
+        print(f"{'engine':<10} {'parse rows/s':>14} {'parse+write rows/s':>20}")
+
+        results = {}
+        for name, make in engines(csv_path).items():
+            parse, total = [], []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                consume(make())
+                parse.append(time.perf_counter() - t0)
+
+                delta_dir = os.path.join(workdir, f"delta-{name}")
+                t0 = time.perf_counter()
+                convert.write_delta(delta_dir, make())
+                total.append(time.perf_counter() - t0)
+                shutil.rmtree(delta_dir)
+            results[name] = (args.rows / min(parse), args.rows / min(total))
+            print(f"{name:<10} {results[name][0]:>14,.0f} {results[name][1]:>20,.0f}")
+
+        base = results["pandas"][1]
+        print()
+        for name in ("arrow", "streaming"):
+            print(f"{name} vs pandas (parse+write): {results[name][1] / base:.2f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Compare Parquet layouts for converted tables: bytes stored and consumer load
+time.
+
+    python bench/bench_layout.py --rows 2000000
+
+Writes the same synthetic dataset once per write-option set through
+convert.write_delta (local files, no AWS needed), then reads it back the
+way a sharing consumer would: the whole table, and one region only (a
+filtered read that can skip partitions/row groups). Prints bytes on disk,
+file count, write time and both read times.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "lambda-image"))
+
+# common reads these at import time; nothing here talks to AWS
+for name in ("BUCKET_NAME", "DDB_TABLE_NAME", "DELTA_INSTANCE_ID", "DELTA_SERVER_URL"):
+    os.environ.setdefault(name, "bench")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import convert  # noqa: E402
+
+LAYOUTS = {
+    "delta-rs defaults": None,
+    "snappy": {"compression": "snappy"},
+    "zstd": {"compression": "zstd"},
+    "zstd level 9": {"compression": "zstd", "compressionLevel": 9},
+    "gzip": {"compression": "gzip"},
+    "zstd, no dictionary": {"compression": "zstd", "dictionary": False},
+    "zstd, 100k-row groups": {"compression": "zstd", "rowGroupRows": 100_000},
+    "zstd, 8 MB files": {"compression": "zstd", "targetFileMb": 8},
+    "zstd, by region": {"compression": "zstd", "partitionBy": ["region"]},
+    "auto": {},
+}
+
+REGIONS = ["us-east", "us-west", "eu-west", "eu-central", "ap-south", "ap-east"]
+CATEGORIES = [f"category-{i:02d}" for i in range(40)]
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do".split()
+
+
+def make_table(rows: int):
+    import numpy as np
+    import pyarrow as pa
+
+    rng = np.random.default_rng(42)
+    return pa.table(
+        {
+            "id": pa.array(np.arange(rows, dtype=np.int64)),
+            "event_date": pa.array(
+                np.datetime64("2024-01-01") + rng.integers(0, 365, rows)
+            ).cast(pa.date32()),
+            "region": pa.array(np.array(REGIONS)[rng.integers(0, len(REGIONS), rows)]),
+            "category": pa.array(
+                np.array(CATEGORIES)[rng.integers(0, len(CATEGORIES), rows)]
+            ),
+            "amount": pa.array(np.round(rng.gamma(2.0, 50.0, rows), 2)),
+            "note": pa.array([" ".join(WORDS[i % 7 : i % 7 + 3]) for i in range(rows)]),
+        }
+    )
+
+
+def directory_size(path: str):
+    files, total = 0, 0
+    for root, _, names in os.walk(path):
+        if "_delta_log" in root:
+            continue
+        for name in names:
+            files += 1
+            total += os.path.getsize(os.path.join(root, name))
+    return files, total
+
+
+def write(path: str, table, options):
+    if options is None:
+        from deltalake import write_deltalake
+
+        write_deltalake(path, table, mode="overwrite")
+    else:
+        # pretend the CSV is ~8x the Arrow size for the size-based defaults
+        resolved = convert.resolve_write_options(options, table.nbytes * 8)
+        convert.write_delta(path, table, write_options=resolved)
+
+
+def read_all(path: str):
+    from deltalake import DeltaTable
+
+    return DeltaTable(path).to_pyarrow_table().num_rows
+
+
+def read_region(path: str):
+    import pyarrow.compute as pc
+    from deltalake import DeltaTable
+
+    dataset = DeltaTable(path).to_pyarrow_dataset()
+    return dataset.to_table(filter=pc.field("region") == "eu-west").num_rows
+
+
+def timed(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    table = make_table(args.rows)
+    print(f"{args.rows:,} rows, {table.nbytes / 1e6:.0f} MB in Arrow\n")
+    print(
+        f"{'layout':<24} {'MB':>7} {'files':>6} {'write s':>8} "
+        f"{'read all s':>11} {'read region s':>14}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (name, options) in enumerate(LAYOUTS.items()):
+            path = os.path.join(tmp, str(i))
+            start = time.perf_counter()
+            write(path, table, options)
+            write_s = time.perf_counter() - start
+            files, total = directory_size(path)
+            print(
+                f"{name:<24} {total / 1e6:>7.1f} {files:>6} {write_s:>8.2f} "
+                f"{timed(read_all, path):>11.3f} {timed(read_region, path):>14.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Cold-start benchmark for the API and conversion functions.
+
+    python bench/bench_startup.py --runs 5
+
+Each run starts a fresh interpreter (as a Lambda cold start would), imports
+the function's entry module and sends it a first and a second request
+against local AWS stand-ins. Reports import time, first-request latency
+and warm latency per function.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import local_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda-image")
+
+# Runs inside the fresh interpreter; prints one JSON line of timings.
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+module = __import__(sys.argv[1])
+t1 = time.perf_counter()
+event = json.loads(sys.argv[2])
+module.main(event, None)
+t2 = time.perf_counter()
+module.main(event, None)
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first": t2 - t1, "warm": t3 - t2}))
+"""
+
+
+def http_event(method, path, query=None):
+    return {
+        "requestContext": {"http": {"method": method, "path": path}},
+        "queryStringParameters": query,
+    }
+
+
+def s3_event(key):
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:s3",
+                "s3": {"bucket": {"name": local_aws.BUCKET}, "object": {"key": key}},
+            }
+        ]
+    }
+
+
+def seed_upload(env) -> str:
+    """Register and upload sample.csv the way /presign + the browser do."""
+    sys.path.insert(0, LAMBDA_DIR)
+    import api_handler
+    from common import s3
+
+    body = json.dumps({"userId": "bench-user", "filename": "sample.csv"})
+    resp = api_handler.main(
+        {
+            "requestContext": {"http": {"method": "POST", "path": "/presign"}},
+            "body": body,
+        },
+        None,
+    )
+    key = json.loads(resp["body"])["s3Key"]
+    s3.upload_file(os.path.join(ROOT, "sample.csv"), local_aws.BUCKET, key)
+    return key
+
+
+def measure(module, event, env, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", CHILD, module, json.dumps(event)],
+            cwd=LAMBDA_DIR,
+            env={**os.environ, **env},
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {k: statistics.median(s[k] for s in samples) for k in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    server, env = local_aws.start()
+    try:
+        key = seed_upload(env)
+        functions = {
+            "api (api_handler)": (
+                "api_handler",
+                http_event("GET", "/datasets", {"userId": "bench-user"}),
+            ),
+            "conversion (handler)": ("handler", s3_event(key)),
+        }
+        print(f"median of {args.runs} cold starts, milliseconds\n")
+        print(f"{'function':<22} {'import':>8} {'first req':>10} {'warm req':>9}")
+        for name, (module, event) in functions.items():
+            t = measure(module, event, env, args.runs)
+            print(
+                f"{name:<22} {t['import'] * 1e3:>8.0f} "
+                f"{t['first'] * 1e3:>10.0f} {t['warm'] * 1e3:>9.0f}"
+            )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Benchmark suite: conversion throughput and route latency, saved as JSON.
+
+    python bench/bench_suite.py --sizes-mb 1 16 128 --profiles narrow wide text
+    python bench/bench_suite.py --baseline bench/results/<earlier>.json
+
+Runs against local AWS stand-ins (local_aws.py). For every size and column
+profile it generates a synthetic CSV, registers and uploads it the way
+/presign and the browser do, and converts it through handler.main in a
+fresh interpreter, as one S3 event. The fresh interpreter keeps peak RSS
+per conversion and gives the stage breakdown from metrics.py. Then it
+sends --requests requests to each API route through handler.main and
+records p50/p99 latency.
+
+Results go to bench/results/<UTC time>.json (or --out). With --baseline,
+each figure is compared with the earlier run and the script exits non-zero
+if any regressed by more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import local_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda-image")
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+# Runs inside the fresh interpreter; prints one JSON line with the timing,
+# peak RSS and the "convert" trace metrics.py logged. Clients and the lazy
+# pyarrow/deltalake imports are warmed first, as in a warm container.
+CHILD = """
+import contextlib, io, json, resource, sys, time
+import deltalake, pyarrow.csv
+import handler
+from common import dynamodb, s3
+s3.meta, dynamodb.meta
+event = json.loads(sys.argv[1])
+out = io.StringIO()
+t0 = time.perf_counter()
+with contextlib.redirect_stdout(out):
+    resp = handler.main(event, None)
+seconds = time.perf_counter() - t0
+trace = {}
+for line in out.getvalue().splitlines():
+    if line.startswith("{") and '"Operation": "convert"' in line:
+        trace = json.loads(line)
+# VmHWM starts afresh at exec; ru_maxrss would carry the parent's peak over
+try:
+    with open("/proc/self/status") as f:
+        hwm = [l for l in f if l.startswith("VmHWM:")][0].split()[1]
+    peak_kb = int(hwm)
+except OSError:
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "seconds": seconds,
+    "peakRssMb": peak_kb / 1024,
+    "status": resp["records"][0]["status"],
+    "error": resp["records"][0].get("error"),
+    "stages": {s["stage"]: s["ms"] for s in trace.get("stages", [])},
+}))
+"""
+
+# ---------------------------------------------------------------------------
+# Synthetic CSVs
+#
+# Generated in chunks of up to 50k rows (fresh random values each) until
+# the file reaches its size, so multi-GB inputs take seconds, not minutes.
+# ---------------------------------------------------------------------------
+CHUNK_ROWS = 50_000
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua"
+).split()
+
+
+def _words(rng, rows: int, count: int):
+    import numpy as np
+
+    picks = np.array(WORDS)[rng.integers(0, len(WORDS), (rows, count))]
+    return [" ".join(row) for row in picks]
+
+
+def _dates(rng, rows: int):
+    import numpy as np
+    import pyarrow as pa
+
+    days = np.datetime64("2020-01-01") + rng.integers(0, 2000, rows)
+    return pa.array(days).cast(pa.date32())
+
+
+def narrow_chunk(rng, start: int, rows: int):
+    """6 columns: ids, dates, floats, a low-cardinality string, a bool."""
+    import numpy as np
+    import pyarrow as pa
+
+    return pa.table(
+        {
+            "id": pa.array(np.arange(start, start + rows, dtype=np.int64)),
+            "event_date": _dates(rng, rows),
+            "amount": pa.array(np.round(rng.gamma(2.0, 50.0, rows), 2)),
+            "quantity": pa.array(rng.integers(1, 100, rows)),
+            "region": pa.array(
+                np.array(["us", "eu", "ap", "sa", "af"])[rng.integers(0, 5, rows)]
+            ),
+            "active": pa.array(rng.random(rows) < 0.5),
+        }
+    )
+
+
+def wide_chunk(rng, start: int, rows: int):
+    """61 columns: 30 floats, 20 ints, 10 short strings after the id."""
+    import numpy as np
+    import pyarrow as pa
+
+    columns = {"id": pa.array(np.arange(start, start + rows, dtype=np.int64))}
+    for i in range(30):
+        columns[f"f{i:02d}"] = pa.array(np.round(rng.normal(0, 1000, rows), 3))
+    for i in range(20):
+        columns[f"i{i:02d}"] = pa.array(rng.integers(-(10**6), 10**6, rows))
+    codes = np.array([f"code-{i:03d}" for i in range(500)])
+    for i in range(10):
+        columns[f"s{i:02d}"] = pa.array(codes[rng.integers(0, len(codes), rows)])
+    return pa.table(columns)
+
+
+def text_chunk(rng, start: int, rows: int):
+    """Long free-text fields (~400 bytes a row), some of them quoted."""
+    import numpy as np
+    import pyarrow as pa
+
+    return pa.table(
+        {
+            "id": pa.array(np.arange(start, start + rows, dtype=np.int64)),
+            "title": pa.array(_words(rng, rows, 6)),
+            # commas make the writer quote the field
+            "body": pa.array(
+                [t.replace(" sed ", ", sed ") for t in _words(rng, rows, 60)]
+            ),
+            "created": _dates(rng, rows),
+        }
+    )
+
+
+PROFILES = {"narrow": narrow_chunk, "wide": wide_chunk, "text": text_chunk}
+
+
+def generate_csv(path: str, profile: str, size_bytes: int) -> int:
+    """Write a CSV of at least `size_bytes`; returns the data row count."""
+    import numpy as np
+    from pyarrow import csv
+
+    rng = np.random.default_rng(7)
+    rows, writer, next_rows = 0, None, 1000
+    with open(path, "wb") as sink:
+        while sink.tell() < size_bytes:
+            chunk = PROFILES[profile](rng, rows, next_rows)
+            if writer is None:
+                writer = csv.CSVWriter(sink, chunk.schema)
+            writer.write_table(chunk)
+            rows += chunk.num_rows
+            # size the next chunk from the bytes per row so far, so small
+            # targets aren't overshot by a whole chunk
+            remaining = (size_bytes - sink.tell()) * rows / sink.tell()
+            next_rows = int(min(CHUNK_ROWS, max(1000, remaining + 1)))
+        writer.close()
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# Conversion throughput
+# ---------------------------------------------------------------------------
+def http_event(method: str, path: str, query=None, body=None) -> dict:
+    return {
+        "requestContext": {"http": {"method": method, "path": path}},
+        "queryStringParameters": query,
+        "body": json.dumps(body) if body is not None else None,
+    }
+
+
+def s3_event(key: str) -> dict:
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:s3",
+                "s3": {"bucket": {"name": local_aws.BUCKET}, "object": {"key": key}},
+            }
+        ]
+    }
+
+
+def call(handler, method: str, path: str, query=None, body=None):
+    resp = handler.main(http_event(method, path, query, body), None)
+    return resp["statusCode"], json.loads(resp["body"])
+
+
+def run_conversion(handler, s3, env, csv_path: str, filename: str) -> dict:
+    _, upload = call(
+        handler, "POST", "/presign", body={"userId": "bench", "filename": filename}
+    )
+    s3.upload_file(csv_path, local_aws.BUCKET, upload["s3Key"])
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, json.dumps(s3_event(upload["s3Key"]))],
+        cwd=LAMBDA_DIR,
+        env={**os.environ, **env, "METRICS_ENABLED": "true"},
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["tableId"] = upload["tableId"]
+    return result
+
+
+def bench_conversions(handler, env, sizes_mb, profiles, workdir: str) -> list:
+    s3 = local_aws.client("s3", env["AWS_ENDPOINT_URL"])
+    results = []
+    print(
+        f"{'profile':<8} {'MB':>8} {'rows':>11} {'seconds':>8} {'MB/s':>7} "
+        f"{'rows/s':>11} {'peak MB':>8}  stages (ms)"
+    )
+    for profile in profiles:
+        for size_mb in sizes_mb:
+            path = os.path.join(workdir, f"{profile}-{size_mb}.csv")
+            rows = generate_csv(path, profile, int(size_mb * 1024**2))
+            size = os.path.getsize(path)
+            run = run_conversion(handler, s3, env, path, os.path.basename(path))
+            os.remove(path)
+            if run["status"] != "converted":
+                print(f"{profile:<8} {size / 1e6:>8.1f} failed: {run['error']}")
+                continue
+            entry = {
+                "tableId": run["tableId"],
+                "profile": profile,
+                "sizeMb": round(size / 1024**2, 1),
+                "rows": rows,
+                "seconds": round(run["seconds"], 3),
+                "mbPerSec": round(size / 1024**2 / run["seconds"], 2),
+                "rowsPerSec": round(rows / run["seconds"]),
+                "peakRssMb": round(run["peakRssMb"], 1),
+                "stagesMs": run["stages"],
+            }
+            results.append(entry)
+            stages = " ".join(f"{k}={v:.0f}" for k, v in run["stages"].items())
+            print(
+                f"{profile:<8} {entry['sizeMb']:>8.1f} {rows:>11,} "
+                f"{entry['seconds']:>8.2f} {entry['mbPerSec']:>7.1f} "
+                f"{entry['rowsPerSec']:>11,} {entry['peakRssMb']:>8.0f}  {stages}"
+            )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Route latency
+# ---------------------------------------------------------------------------
+def route_requests(table_id: str) -> dict:
+    user = {"userId": "bench"}
+    table = {"tableId": table_id}
+    return {
+        "POST /presign": ("POST", "/presign", None, {**user, "filename": "r.csv"}),
+        "GET /datasets": ("GET", "/datasets", user, None),
+        "POST /share": ("POST", "/share", None, table),
+        "GET /share/status": ("GET", "/share/status", table, None),
+        "GET /snippet": ("GET", "/snippet", table, None),
+        "GET /snippet?fromVersion": (
+            "GET",
+            "/snippet",
+            {**table, "fromVersion": "0"},
+            None,
+        ),
+        "GET /updates": ("GET", "/updates", table, None),
+        "GET /maintain": ("GET", "/maintain", table, None),
+    }
+
+
+def bench_routes(handler, table_id: str, requests: int) -> dict:
+    results = {}
+    print(f"\n{'route':<26} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+    for name, (method, path, query, body) in route_requests(table_id).items():
+        status, _ = call(handler, method, path, query, body)  # warm up
+        samples = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            call(handler, method, path, query, body)
+            samples.append((time.perf_counter() - start) * 1000)
+        cuts = statistics.quantiles(samples, n=100)
+        results[name] = {
+            "status": status,
+            "p50Ms": round(cuts[49], 2),
+            "p99Ms": round(cuts[98], 2),
+            "meanMs": round(statistics.fmean(samples), 2),
+            "requests": requests,
+        }
+        r = results[name]
+        print(f"{name:<26} {r['p50Ms']:>8.2f} {r['p99Ms']:>8.2f} {r['meanMs']:>8.2f}")
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Baseline comparison
+# ---------------------------------------------------------------------------
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Figures that got worse than the baseline by more than `tolerance`."""
+    regressions = []
+
+    def check(name, new, old, higher_is_better):
+        if not old:
+            return
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        if worse > tolerance:
+            regressions.append(f"{name}: {old} -> {new} ({change:+.0%})")
+
+    old_runs = {(r["profile"], r["sizeMb"]): r for r in baseline.get("conversion", [])}
+    for run in results["conversion"]:
+        old = old_runs.get((run["profile"], run["sizeMb"]))
+        if old:
+            label = f"{run['profile']} {run['sizeMb']} MB"
+            check(f"{label} MB/s", run["mbPerSec"], old["mbPerSec"], True)
+            check(f"{label} peak RSS", run["peakRssMb"], old["peakRssMb"], False)
+    for route, stats in results["routes"].items():
+        old = baseline.get("routes", {}).get(route)
+        if old:
+            check(f"{route} p50", stats["p50Ms"], old["p50Ms"], False)
+            check(f"{route} p99", stats["p99Ms"], old["p99Ms"], False)
+    return regressions
+
+
+def git_commit() -> str:
+    out = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    return out.stdout.strip() or "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 16, 128])
+    parser.add_argument(
+        "--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES)
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--out", help="results file; default bench/results/")
+    parser.add_argument("--baseline", help="earlier results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    server, env = local_aws.start()
+    workdir = tempfile.mkdtemp(prefix="bench-suite-")
+    try:
+        sys.path.insert(0, LAMBDA_DIR)
+        import handler
+
+        conversion = bench_conversions(
+            handler, env, args.sizes_mb, args.profiles, workdir
+        )
+        if not conversion:
+            sys.exit("every conversion failed; nothing to benchmark routes against")
+        routes = bench_routes(handler, conversion[0]["tableId"], args.requests)
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "conversionMode": os.environ.get("CONVERSION_MODE", "auto"),
+            "deltaWriteMode": os.environ.get("DELTA_WRITE_MODE", "direct"),
+        },
+        "conversion": conversion,
+        "routes": routes,
+    }
+    out = args.out or os.path.join(
+        RESULTS_DIR, time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()) + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {os.path.relpath(out)}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"no regressions over {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Upload throughput of multipart presigned uploads by connection count.
+
+    python bench/bench_upload.py --size-mb 512 --connections 1 2 4 8
+    python bench/bench_upload.py --api-url https://<api-id>.execute-api...
+
+Asks /presign for a multipart upload of a generated CSV, PUTs the parts
+over N parallel connections (retrying failed parts) and completes it
+through /presign/complete, the same way web/utils/upload.ts does. Without
+--api-url the API runs in-process against local stand-ins, which checks
+the flow but says little about throughput; point it at a deployed stack
+for real numbers.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import local_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda-image")
+PART_RETRIES = 3
+
+
+def make_csv(path: str, size: int):
+    row = b"12345,2024-01-01,some text value,3.14159,true\n"
+    with open(path, "wb") as f:
+        f.write(b"id,date,text,value,flag\n")
+        for _ in range(size // len(row)):
+            f.write(row)
+
+
+def remote_api(api_url: str):
+    def call(path: str, body: dict) -> dict:
+        req = urllib.request.Request(
+            api_url.rstrip("/") + path,
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(req) as resp:
+            return json.loads(resp.read())
+
+    return call
+
+
+def local_api():
+    sys.path.insert(0, LAMBDA_DIR)
+    import api_handler
+
+    def call(path: str, body: dict) -> dict:
+        resp = api_handler.main(
+            {
+                "requestContext": {"http": {"method": "POST", "path": path}},
+                "body": json.dumps(body),
+            },
+            None,
+        )
+        return json.loads(resp["body"])
+
+    return call
+
+
+def put_part(path: str, part: dict, part_size: int) -> dict:
+    with open(path, "rb") as f:
+        f.seek((part["partNumber"] - 1) * part_size)
+        data = f.read(part_size)
+    for attempt in range(1, PART_RETRIES + 1):
+        try:
+            # urllib would default to a form content type for a request body
+            req = urllib.request.Request(
+                part["url"],
+                data=data,
+                method="PUT",
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            with urllib.request.urlopen(req) as resp:
+                return {"partNumber": part["partNumber"], "etag": resp.headers["ETag"]}
+        except OSError:
+            if attempt == PART_RETRIES:
+                raise
+            time.sleep(2**attempt)
+
+
+def upload(call, path: str, connections: int) -> float:
+    size = os.path.getsize(path)
+    presign = call(
+        "/presign",
+        {"userId": "bench-user", "filename": "upload.csv", "size": size},
+    )
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        parts = list(
+            pool.map(lambda p: put_part(path, p, presign["partSize"]), presign["parts"])
+        )
+    done = call(
+        "/presign/complete",
+        {
+            "tableId": presign["tableId"],
+            "uploadId": presign["uploadId"],
+            "parts": parts,
+        },
+    )
+    if "error" in done:
+        raise RuntimeError(done["error"])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--api-url", help="deployed API; default: local stand-ins")
+    args = parser.parse_args()
+
+    server = None
+    if args.api_url:
+        call = remote_api(args.api_url)
+    else:
+        server, _ = local_aws.start()
+        call = local_api()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "upload.csv")
+            make_csv(path, args.size_mb * 1024**2)
+            print(f"{'connections':>11} {'seconds':>8} {'MB/s':>8}")
+            for connections in args.connections:
+                elapsed = upload(call, path, connections)
+                print(
+                    f"{connections:>11} {elapsed:>8.2f} "
+                    f"{args.size_mb / elapsed:>8.1f}"
+                )
+    finally:
+        if server:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
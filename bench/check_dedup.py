@@ -0,0 +1,161 @@
+"""
+Check that duplicate S3 events don't convert the same bytes twice.
+
+    python bench/check_dedup.py --duplicates 6
+
+Uploads sample.csv and converts it from several threads at once, the way
+concurrent redeliveries of one event would race, then redelivers it again
+and re-uploads the identical file. Does the same for an append update. The
+table must get exactly one Delta commit per distinct upload and the repeats
+must short-circuit; prints how long a duplicate takes. Then re-uploads
+changed files to one key through each write path in turn: every one must
+replace the table with a new version that reads back whole. Exits non-zero
+on an unexpected outcome.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import local_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda-image")
+
+
+def presign(api_handler, body: dict) -> dict:
+    resp = api_handler.main(
+        {
+            "requestContext": {"http": {"method": "POST", "path": "/presign"}},
+            "body": json.dumps({"userId": "check-user", **body}),
+        },
+        None,
+    )
+    return json.loads(resp["body"])
+
+
+def commits(s3, table_id: str) -> int:
+    prefix = f"datasets/{table_id}/delta/_delta_log/"
+    resp = s3.list_objects_v2(Bucket=local_aws.BUCKET, Prefix=prefix)
+    return sum(o["Key"].endswith(".json") for o in resp.get("Contents", []))
+
+
+def read_rows(table_id: str):
+    """Rows of the table's current version, or the error reading it."""
+    from convert import existing_table
+
+    try:
+        return existing_table(table_id).to_pyarrow_table().num_rows
+    except Exception as exc:
+        return f"{type(exc).__name__}: {exc}"
+
+
+def parquet_bytes(rows: int) -> bytes:
+    import io
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    body = io.BytesIO()
+    pq.write_table(pa.table({"id": range(rows)}), body)
+    return body.getvalue()
+
+
+def race(convert, key: str, duplicates: int) -> list:
+    with ThreadPoolExecutor(max_workers=duplicates) as pool:
+        return list(
+            pool.map(lambda _: convert(local_aws.BUCKET, key), range(duplicates))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--duplicates", type=int, default=6)
+    args = parser.parse_args()
+
+    server, env = local_aws.start()
+    problems = []
+    try:
+        endpoint = env["AWS_ENDPOINT_URL"]
+        sys.path.insert(0, LAMBDA_DIR)
+        import api_handler
+        import convert
+        from convert import process_s3_object
+
+        s3 = local_aws.client("s3", endpoint)
+        with open(os.path.join(ROOT, "sample.csv"), "rb") as f:
+            sample = f.read()
+
+        def expect(what: str, ok: bool):
+            print(f"{'ok' if ok else 'FAILED':<7} {what}")
+            if not ok:
+                problems.append(what)
+
+        # initial upload, converted by racing duplicates
+        upload = presign(api_handler, {"filename": "sample.csv"})
+        table_id, key = upload["tableId"], upload["s3Key"]
+        s3.put_object(Bucket=local_aws.BUCKET, Key=key, Body=sample)
+        results = race(process_s3_object, key, args.duplicates)
+        fresh = [r for r in results if "duplicate" not in r]
+        expect(f"{args.duplicates} racing deliveries, 1 converts", len(fresh) == 1)
+        expect("1 Delta commit", commits(s3, table_id) == 1)
+
+        start = time.perf_counter()
+        result = process_s3_object(local_aws.BUCKET, key)
+        elapsed = (time.perf_counter() - start) * 1000
+        expect(f"redelivery skipped in {elapsed:.0f} ms", "duplicate" in result)
+
+        s3.put_object(Bucket=local_aws.BUCKET, Key=key, Body=sample)
+        result = process_s3_object(local_aws.BUCKET, key)
+        expect("identical re-upload skipped", "duplicate" in result)
+        expect("still 1 Delta commit", commits(s3, table_id) == 1)
+
+        # append update, same treatment
+        update = presign(api_handler, {"filename": "more.csv", "tableId": table_id})
+        s3.put_object(Bucket=local_aws.BUCKET, Key=update["s3Key"], Body=sample)
+        results = race(process_s3_object, update["s3Key"], args.duplicates)
+        fresh = [r for r in results if "duplicate" not in r]
+        expect("racing update deliveries, 1 applies", len(fresh) == 1)
+        process_s3_object(local_aws.BUCKET, update["s3Key"])
+        expect("2 Delta commits", commits(s3, table_id) == 2)
+
+        # changed re-uploads of one key, alternating write paths; parallel
+        # mode gets ranges small enough to write several files
+        upload = presign(api_handler, {"filename": "reupload.csv"})
+        table_id, key = upload["tableId"], upload["s3Key"]
+        lines = sample.splitlines(keepends=True)
+        convert.PARALLEL_RANGE_BYTES = 4096
+        for version, (mode, rows) in enumerate(
+            [("arrow", 1000), ("parallel", 600), ("parallel", 800), ("arrow", 300)]
+        ):
+            convert.CONVERSION_MODE = mode
+            body = b"".join(lines[: rows + 1])
+            s3.put_object(Bucket=local_aws.BUCKET, Key=key, Body=body)
+            process_s3_object(local_aws.BUCKET, key)
+            got = read_rows(table_id)
+            expect(f"{mode} re-upload reads back {rows} rows ({got})", got == rows)
+            expect(f"  as commit {version + 1}", commits(s3, table_id) == version + 1)
+
+        # the same for Parquet, committed as uploaded
+        upload = presign(api_handler, {"filename": "reupload.parquet"})
+        table_id, key = upload["tableId"], upload["s3Key"]
+        for version, rows in enumerate([1000, 7]):
+            s3.put_object(Bucket=local_aws.BUCKET, Key=key, Body=parquet_bytes(rows))
+            process_s3_object(local_aws.BUCKET, key)
+            got = read_rows(table_id)
+            expect(f"parquet re-upload reads back {rows} rows ({got})", got == rows)
+            expect(f"  as commit {version + 1}", commits(s3, table_id) == version + 1)
+    finally:
+        server.stop()
+
+    if problems:
+        print(f"FAILED: {len(problems)} unexpected outcome(s)")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
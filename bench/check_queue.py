@@ -0,0 +1,100 @@
+"""
+Check the queued conversion pipeline end to end against local stand-ins.
+
+    python bench/check_queue.py --uploads 8
+
+Registers and uploads several copies of sample.csv plus one malformed CSV,
+lets S3 notifications fill the conversion queue and drains it through the
+conversion handler the way the SQS event source mapping would. Good
+uploads must end up "converted"; the malformed one must be retried until
+it is "failed" and its message sits in the DLQ. Exits non-zero otherwise.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import local_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda-image")
+
+MALFORMED_CSV = b"id,name\n1,alice\n2\n3,carol,extra\n"
+
+
+def register(api_handler, filename: str) -> str:
+    resp = api_handler.main(
+        {
+            "requestContext": {"http": {"method": "POST", "path": "/presign"}},
+            "body": json.dumps({"userId": "check-user", "filename": filename}),
+        },
+        None,
+    )
+    return json.loads(resp["body"])["s3Key"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    args = parser.parse_args()
+
+    server, env = local_aws.start()
+    try:
+        endpoint = env["AWS_ENDPOINT_URL"]
+        os.environ["CONVERSION_MAX_ATTEMPTS"] = str(args.max_attempts)
+        queue_url, dlq_url = local_aws.create_conversion_queue(
+            endpoint, args.max_attempts
+        )
+
+        sys.path.insert(0, LAMBDA_DIR)
+        import api_handler
+        import handler
+        from records import find_dataset_key_by_file, get_dataset
+
+        s3 = local_aws.client("s3", endpoint)
+        with open(os.path.join(ROOT, "sample.csv"), "rb") as f:
+            sample = f.read()
+        expected = {}
+        for i in range(args.uploads):
+            key = register(api_handler, f"sample {i}.csv")
+            s3.put_object(Bucket=local_aws.BUCKET, Key=key, Body=sample)
+            expected[key] = ("converted", None)
+        key = register(api_handler, "malformed.csv")
+        s3.put_object(Bucket=local_aws.BUCKET, Key=key, Body=MALFORMED_CSV)
+        expected[key] = ("failed", args.max_attempts)
+
+        consumer = local_aws.QueueConsumer(
+            endpoint, queue_url, handler.main, args.batch_size
+        )
+        batches = consumer.drain()
+
+        problems = []
+        for key, (status, attempts) in expected.items():
+            item = get_dataset(find_dataset_key_by_file(key))
+            got = item["status"]["S"]
+            got_attempts = int(item["attempts"]["N"]) if "attempts" in item else None
+            print(f"{got:<10} attempts={got_attempts} {key}")
+            if got != status or got_attempts != attempts:
+                problems.append(key)
+
+        sqs = local_aws.client("sqs", endpoint)
+        dead = sqs.get_queue_attributes(
+            QueueUrl=dlq_url, AttributeNames=["ApproximateNumberOfMessages"]
+        )["Attributes"]["ApproximateNumberOfMessages"]
+        print(f"\n{batches} batches delivered, {dead} message(s) in the DLQ")
+        if int(dead) != 1:
+            problems.append("dlq")
+    finally:
+        server.stop()
+
+    if problems:
+        print(f"FAILED: {len(problems)} unexpected outcome(s)")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Check locally that a blue/green share reload drops no requests.
+
+    python bench/check_share_reload.py --reloads 3
+
+Runs infra/delta-sharing/reload.sh as it is, with systemctl, nginx and
+chown swapped on PATH for stand-ins. Each delta-sharing@<port> unit is a
+small HTTP server that takes a moment to come up, as the JVM server does.
+nginx is a proxy in this process that moves to the upstream in
+UPSTREAM_CONF on `nginx -s reload` (SIGHUP); requests already under way
+finish where they started. Clients keep requesting through the proxy
+(check_reload.client, the loop the on-box smoke check runs) across the
+reloads. Every request must succeed and each reload must move the traffic
+to the other colour. A final reload whose new server never comes up must
+fail and leave the traffic where it was. Exits non-zero otherwise.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARING_DIR = os.path.join(ROOT, "infra", "delta-sharing")
+STARTUP_SECONDS = 1.5
+REQUEST_SECONDS = 0.02
+
+SYSTEMCTL = """#!/bin/sh
+# systemctl stand-in: a delta-sharing@<port> unit is a local server
+cmd=$1
+if [ "$cmd" = disable ] && [ "$2" = --now ]; then cmd=stop; shift; fi
+port=${2#delta-sharing@}
+pidfile="$STATE_DIR/$port.pid"
+case $cmd in
+  restart|stop)
+    [ -f "$pidfile" ] && kill "$(cat "$pidfile")" 2>/dev/null
+    rm -f "$pidfile"
+    if [ "$cmd" = restart ]; then
+      "$PYTHON" "$HARNESS" --serve "$port" &
+      echo $! > "$pidfile"
+    fi
+    ;;
+esac
+exit 0
+"""
+
+NGINX = """#!/bin/sh
+# nginx stand-in: `nginx -s reload` has the proxy re-read UPSTREAM_CONF
+kill -HUP "$(cat "$STATE_DIR/proxy.pid")"
+"""
+
+CHOWN = """#!/bin/sh
+exit 0
+"""
+
+
+# ---------------------------------------------------------------------------
+# Stand-in sharing server (one process per colour)
+# ---------------------------------------------------------------------------
+def serve(port: int):
+    if os.environ.get("SERVE_BROKEN"):
+        sys.exit(1)  # a server that never comes up
+    time.sleep(STARTUP_SECONDS)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(REQUEST_SECONDS)
+            body = json.dumps({"items": [], "port": port}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+# ---------------------------------------------------------------------------
+# Stand-in nginx
+# ---------------------------------------------------------------------------
+class Proxy(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, upstream_conf: str):
+        self.upstream_conf = upstream_conf
+        self.reload()
+        super().__init__(("127.0.0.1", 0), ProxyHandler)
+
+    def reload(self, *_):
+        with open(self.upstream_conf) as f:
+            self.upstream = re.search(r"server ([\d.]+):(\d+);", f.read()).groups()
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        host, port = self.server.upstream  # fixed for the whole request
+        try:
+            conn = http.client.HTTPConnection(host, int(port), timeout=10)
+            conn.request("GET", self.path)
+            resp = conn.getresponse()
+            status, body = resp.status, resp.read()
+        except OSError as exc:
+            status, body = 502, str(exc).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serving_port(url: str) -> int:
+    import urllib.request
+
+    with urllib.request.urlopen(url, timeout=10) as resp:
+        return json.loads(resp.read())["port"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--reloads", type=int, default=3)
+    parser.add_argument("--settle", type=float, default=2.0)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve)
+
+    sys.path.insert(0, SHARING_DIR)
+    from check_reload import client
+
+    state = tempfile.mkdtemp(prefix="share-reload-")
+    shims = os.path.join(state, "bin")
+    os.makedirs(shims)
+    for name, script in (("systemctl", SYSTEMCTL), ("nginx", NGINX), ("chown", CHOWN)):
+        path = os.path.join(shims, name)
+        with open(path, "w") as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+    with open(os.path.join(state, "share.yaml"), "w") as f:
+        f.write('version: 1\nhost: "0.0.0.0"\nport: 8080\nshares: []\n')
+    with open(os.path.join(state, "proxy.pid"), "w") as f:
+        f.write(str(os.getpid()))
+    upstream_conf = os.path.join(state, "upstream.conf")
+    env = {
+        **os.environ,
+        "PATH": f"{shims}:{os.environ['PATH']}",
+        "STATE_DIR": state,
+        "PYTHON": sys.executable,
+        "HARNESS": os.path.abspath(__file__),
+        "SHARES_DIR": state,
+        "UPSTREAM_CONF": upstream_conf,
+        "DRAIN_SECONDS": "1",
+    }
+
+    def run_reload(**extra) -> int:
+        return subprocess.run(
+            ["bash", os.path.join(SHARING_DIR, "reload.sh")],
+            env={**env, **extra},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode
+
+    problems = []
+
+    def expect(what: str, ok: bool):
+        print(f"{'ok' if ok else 'FAILED':<7} {what}")
+        if not ok:
+            problems.append(what)
+
+    # what user-data.sh leaves behind: the first colour up behind nginx
+    with open(upstream_conf, "w") as f:
+        f.write("server 127.0.0.1:8081;\n")
+    proxy = Proxy(upstream_conf)
+    signal.signal(signal.SIGHUP, proxy.reload)
+    threading.Thread(target=proxy.serve_forever, daemon=True).start()
+    url = (
+        f"http://127.0.0.1:{proxy.server_address[1]}"
+        "/shares/my_share/schemas/default/tables"
+    )
+
+    results = {"ok": 0, "failed": []}
+    lock, stop = threading.Lock(), threading.Event()
+    threads = [
+        threading.Thread(target=client, args=(url, stop, results, lock))
+        for _ in range(args.clients)
+    ]
+    try:
+        expect("first server comes up", run_reload() == 0)
+        expect("  and serves", serving_port(url) == 8081)
+        for t in threads:
+            t.start()
+        time.sleep(args.settle)
+
+        for i in range(args.reloads):
+            before = serving_port(url)
+            started = time.time()
+            code = run_reload()
+            took = time.time() - started
+            expect(f"reload {i + 1} in {took:.1f}s", code == 0)
+            expect(f"  moves traffic off {before}", serving_port(url) != before)
+            time.sleep(args.settle)
+
+        before = serving_port(url)
+        code = run_reload(SERVE_BROKEN="1", HEALTH_TIMEOUT="3")
+        expect("reload to a server that never comes up fails", code != 0)
+        expect(f"  and {before} keeps serving", serving_port(url) == before)
+        time.sleep(args.settle)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        for port in (8081, 8082):
+            subprocess.run(["systemctl", "stop", f"delta-sharing@{port}"], env=env)
+        proxy.shutdown()
+
+    expect(
+        f"{results['ok']} requests ok, {len(results['failed'])} failed",
+        results["ok"] and not results["failed"],
+    )
+    for error in results["failed"][:20]:
+        print("  " + error)
+    if problems:
+        print(f"FAILED: {len(problems)} unexpected outcome(s)")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Concurrent load test of the HTTP routes at growing tracking-table sizes.
+
+    python bench/load_test.py --table-sizes 1000 10000 50000 --concurrency 16
+    python bench/load_test.py --url http://127.0.0.1:3001 --duration 60
+
+By default starts local_api.py in-process and, for each --table-sizes
+entry, grows the tracking table to that many dataset records (spread over
+--users users, --shared-fraction of them shared) before replaying a mix of
+/presign, /datasets, /share and /snippet requests over HTTP from
+--concurrency threads for --duration seconds. After each load phase it
+also times the two full-table scans, the share rebuild (share_table) and
+the maintenance sweep (maintainable_tables), which is where the cost of a
+large table shows up first.
+
+Reports requests/s and p50/p95/p99 per route and the scan times, and
+saves them to bench/results/load-<UTC time>.json (or --out). With --url
+the mix runs once against that server and nothing is seeded.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+
+import local_api
+import local_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+DEFAULT_MIX = "presign=20,datasets=40,share=10,snippet=30"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("presign", "datasets", "share", "snippet"):
+            raise SystemExit(f"unknown route in --mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+# ---------------------------------------------------------------------------
+# Seeding: dataset records written straight to the stand-in table
+# ---------------------------------------------------------------------------
+def seed_records(ddb, count: int, users: int, shared_fraction: float, rng) -> list:
+    """Add `count` records shaped like /presign + /share's; returns tableIds."""
+    table_ids, batch = [], []
+    for _ in range(count):
+        table_id = uuid.uuid4().hex
+        shared = rng.random() < shared_fraction
+        item = {
+            "userId": {"S": f"load-user-{rng.randrange(users)}"},
+            "fileKey": {"S": f"uploads/{table_id}/raw/data.csv"},
+            "tableId": {"S": table_id},
+            "filename": {"S": "data.csv"},
+            "status": {"S": "shared" if shared else "converted"},
+            "createdAt": {"S": datetime.utcnow().isoformat()},
+        }
+        if shared:
+            item["notebookSnippet"] = {"S": f"# snippet for {table_id}\n" * 12}
+        batch.append({"PutRequest": {"Item": item}})
+        table_ids.append((table_id, shared))
+        if len(batch) == 25:
+            ddb.batch_write_item(RequestItems={local_aws.DDB_TABLE: batch})
+            batch = []
+    if batch:
+        ddb.batch_write_item(RequestItems={local_aws.DDB_TABLE: batch})
+    return table_ids
+
+
+# ---------------------------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------------------------
+def request(base_url: str, method: str, path: str, query=None, body=None) -> int:
+    url = base_url + path
+    if query:
+        url += "?" + urllib.parse.urlencode(query)
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(
+        url, data=data, method=method, headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+
+
+def make_ops(base_url: str, tables: list, users: int) -> dict:
+    shared = [t for t, s in tables if s] or [t for t, _ in tables]
+    all_ids = [t for t, _ in tables]
+
+    def user(rng):
+        return f"load-user-{rng.randrange(users)}"
+
+    return {
+        "presign": lambda rng: request(
+            base_url,
+            "POST",
+            "/presign",
+            body={"userId": user(rng), "filename": "upload.csv"},
+        ),
+        "datasets": lambda rng: request(
+            base_url, "GET", "/datasets", {"userId": user(rng)}
+        ),
+        "share": lambda rng: request(
+            base_url, "POST", "/share", body={"tableId": rng.choice(all_ids)}
+        ),
+        "snippet": lambda rng: request(
+            base_url, "GET", "/snippet", {"tableId": rng.choice(shared)}
+        ),
+    }
+
+
+def run_load(ops: dict, mix: dict, concurrency: int, duration: float) -> dict:
+    samples = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    names, weights = list(mix), list(mix.values())
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = ops[name](rng)
+            except OSError:
+                status = 0
+            ms = (time.perf_counter() - start) * 1000
+            with lock:
+                samples[name].append(ms)
+                if status >= 400 or status == 0:
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name, values in samples.items():
+        if len(values) < 2:
+            continue
+        cuts = statistics.quantiles(values, n=100)
+        results[name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "rps": round(len(values) / elapsed, 1),
+            "p50Ms": round(cuts[49], 1),
+            "p95Ms": round(cuts[94], 1),
+            "p99Ms": round(cuts[98], 1),
+        }
+    return results
+
+
+def time_scans() -> dict:
+    """Wall time of the full-table scans: share rebuild and maintenance sweep."""
+    import api_handler
+    from maintenance import maintainable_tables
+
+    start = time.perf_counter()
+    api_handler.main({"action": "rebuild-share"}, None)
+    rebuild = time.perf_counter() - start
+    start = time.perf_counter()
+    tables = maintainable_tables()
+    sweep = time.perf_counter() - start
+    return {
+        "rebuildShareMs": round(rebuild * 1000, 1),
+        "maintenanceScanMs": round(sweep * 1000, 1),
+        "maintainableTables": len(tables),
+    }
+
+
+def print_results(label: str, routes: dict, scans: dict = None):
+    print(f"\n{label}")
+    print(
+        f"{'route':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    )
+    for name, r in routes.items():
+        print(
+            f"{name:<10} {r['rps']:>8.1f} {r['p50Ms']:>8.1f} {r['p95Ms']:>8.1f} "
+            f"{r['p99Ms']:>8.1f} {r['errors']:>7}"
+        )
+    if scans:
+        print(
+            f"share rebuild {scans['rebuildShareMs']:.0f} ms, maintenance scan "
+            f"{scans['maintenanceScanMs']:.0f} ms ({scans['maintainableTables']} tables)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--url", help="running API to target; default: local_api")
+    parser.add_argument("--table-sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--shared-fraction", type=float, default=0.3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--out", help="results file; default bench/results/")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    runs = []
+    if args.url:
+        # someone else's server: needs tableIds to share/snippet, so only
+        # the routes that don't
+        mix = {k: v for k, v in mix.items() if k in ("presign", "datasets")}
+        routes = run_load(
+            make_ops(args.url.rstrip("/"), [], args.users),
+            mix,
+            args.concurrency,
+            args.duration,
+        )
+        print_results(args.url, routes)
+        runs.append({"url": args.url, "routes": routes})
+    else:
+        httpd, aws_server, env = local_api.serve()
+        try:
+            ddb = local_aws.client("dynamodb", env["AWS_ENDPOINT_URL"])
+            base_url = f"http://127.0.0.1:{httpd.server_port}"
+            rng = random.Random(1)
+            tables = []
+            for size in sorted(args.table_sizes):
+                start = time.perf_counter()
+                tables += seed_records(
+                    ddb, size - len(tables), args.users, args.shared_fraction, rng
+                )
+                print(
+                    f"\nseeded {len(tables)} records in {time.perf_counter() - start:.1f}s"
+                )
+                routes = run_load(
+                    make_ops(base_url, tables, args.users),
+                    mix,
+                    args.concurrency,
+                    args.duration,
+                )
+                scans = time_scans()
+                print_results(
+                    f"{size} records, {args.concurrency} clients", routes, scans
+                )
+                runs.append({"tableSize": size, "routes": routes, "scans": scans})
+        finally:
+            httpd.shutdown()
+            aws_server.stop()
+
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "concurrency": args.concurrency,
+            "durationSeconds": args.duration,
+            "mix": mix,
+            "users": args.users,
+            "sharedFraction": args.shared_fraction,
+        },
+        "runs": runs,
+    }
+    out = args.out or os.path.join(
+        RESULTS_DIR, time.strftime("load-%Y%m%dT%H%M%SZ", time.gmtime()) + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {os.path.relpath(out)}")
+
+
+if __name__ == "__main__":
+    main()
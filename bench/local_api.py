@@ -0,0 +1,199 @@
+"""
+Serve the HTTP API locally, shaped like the API Gateway v2 deployment.
+
+    python bench/local_api.py --port 3001 --queue
+
+Starts the local AWS stand-ins (local_aws.py) and an HTTP server that turns
+each request into an API Gateway v2 (payload 2.0) proxy event for the
+function infra/api.py routes it to: /process to the conversion function
+(handler.main), everything else to the API function (api_handler.main).
+Unknown routes get API Gateway's own 404. Requests are served on threads,
+like concurrent Lambda invocations (which here share one process).
+
+With --queue, uploads notify the conversion queue and a background
+consumer converts them the way the SQS event source mapping does, so the
+frontend works end to end with NEXT_PUBLIC_API_URL=http://127.0.0.1:3001.
+Presigned URLs point at the stand-ins too.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import local_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda-image")
+
+# mirrors the route table in infra/api.py
+ROUTES = {
+    ("POST", "/presign"): "api",
+    ("POST", "/presign/parts"): "api",
+    ("POST", "/presign/complete"): "api",
+    ("POST", "/presign/abort"): "api",
+    ("POST", "/process"): "conversion",
+    ("POST", "/share"): "api",
+    ("POST", "/unshare"): "api",
+    ("GET", "/datasets"): "api",
+    ("GET", "/snippet"): "api",
+    ("GET", "/preview"): "api",
+    ("GET", "/profile"): "api",
+    ("GET", "/share/status"): "api",
+    ("GET", "/updates"): "api",
+    ("POST", "/maintain"): "api",
+    ("GET", "/maintain"): "api",
+}
+
+
+def apigw_event(method: str, raw_path: str, headers: dict, body: bytes) -> dict:
+    """An API Gateway v2 HTTP API proxy event (payload format 2.0)."""
+    url = urlsplit(raw_path)
+    query = dict(parse_qsl(url.query, keep_blank_values=True))
+    return {
+        "version": "2.0",
+        "routeKey": f"{method} {url.path}",
+        "rawPath": url.path,
+        "rawQueryString": url.query,
+        "headers": {k.lower(): v for k, v in headers.items()},
+        "queryStringParameters": query or None,
+        "requestContext": {
+            "http": {
+                "method": method,
+                "path": url.path,
+                "protocol": "HTTP/1.1",
+                "sourceIp": "127.0.0.1",
+            },
+            "routeKey": f"{method} {url.path}",
+            "stage": "$default",
+            "timeEpoch": int(time.time() * 1000),
+        },
+        "body": body.decode() if body else None,
+        "isBase64Encoded": False,
+    }
+
+
+def make_handler(functions: dict):
+    """Request handler class dispatching to `functions` {"api": main, ...}."""
+
+    class ApiGatewayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, headers: dict, body: str):
+            data = body.encode()
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _proxy(self, method: str):
+            path = urlsplit(self.path).path
+            target = ROUTES.get((method, path))
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            if target is None:
+                self._send(
+                    404,
+                    {"Content-Type": "application/json"},
+                    json.dumps({"message": "Not Found"}),
+                )
+                return
+            event = apigw_event(method, self.path, dict(self.headers), body)
+            try:
+                resp = functions[target](event, None)
+            except Exception as exc:
+                # what API Gateway returns when the function errors
+                print(f"{method} {path} raised {exc!r}", file=sys.stderr)
+                self._send(
+                    500,
+                    {"Content-Type": "application/json"},
+                    json.dumps({"message": "Internal Server Error"}),
+                )
+                return
+            self._send(resp["statusCode"], resp.get("headers", {}), resp["body"])
+
+        def do_GET(self):
+            self._proxy("GET")
+
+        def do_POST(self):
+            self._proxy("POST")
+
+        def do_OPTIONS(self):
+            # CORS preflight, as configured on the HTTP API
+            self._send(
+                204,
+                {
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+                    "Access-Control-Allow-Headers": "Content-Type",
+                },
+                "",
+            )
+
+    return ApiGatewayHandler
+
+
+def serve(port: int = 0, queue: bool = False):
+    """
+    Start the stand-ins and the HTTP adapter on a background thread.
+
+    Returns (httpd, aws_server, env); the API is at
+    http://127.0.0.1:<httpd.server_port>. With `queue`, a consumer thread
+    converts uploads as they land.
+    """
+    aws_server, env = local_aws.start()
+    sys.path.insert(0, LAMBDA_DIR)
+    import api_handler
+    import handler
+
+    httpd = ThreadingHTTPServer(
+        ("127.0.0.1", port),
+        make_handler({"api": api_handler.main, "conversion": handler.main}),
+    )
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    if queue:
+        queue_url, _ = local_aws.create_conversion_queue(env["AWS_ENDPOINT_URL"])
+        consumer = local_aws.QueueConsumer(
+            env["AWS_ENDPOINT_URL"], queue_url, handler.main
+        )
+
+        def consume():
+            while True:
+                consumer.poll()
+
+        threading.Thread(target=consume, daemon=True).start()
+    return httpd, aws_server, env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--queue", action="store_true", help="convert uploads")
+    args = parser.parse_args()
+
+    httpd, aws_server, env = serve(args.port, args.queue)
+    print(f"API:          http://127.0.0.1:{httpd.server_port}")
+    print(f"AWS endpoint: {env['AWS_ENDPOINT_URL']}  (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.shutdown()
+        aws_server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Local AWS stand-ins for benchmarks and load tests.
+
+Starts a moto server (S3, DynamoDB, SSM, SQS over real HTTP) and creates
+the bucket and tracking table the way infra/storage.py does, so handler
+code, boto3 and deltalake's S3 writer all run unmodified against it through
+AWS_ENDPOINT_URL. The conversion queue and its event source mapping can be
+stood up too (create_conversion_queue / QueueConsumer).
+"""
+
+import json
+import logging
+import os
+import socket
+import sys
+
+BUCKET = "delta-bridge-local"
+DDB_TABLE = "dataset-tracking-local"
+INSTANCE_ID = "i-0123456789abcdef0"
+LAMBDA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambda-image"
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def lambda_env(endpoint: str) -> dict:
+    """Environment the handler modules expect, pointed at the stand-ins."""
+    return {
+        "BUCKET_NAME": BUCKET,
+        "DDB_TABLE_NAME": DDB_TABLE,
+        "DELTA_INSTANCE_ID": INSTANCE_ID,
+        "DELTA_SERVER_URL": "http://127.0.0.1:8080",
+        "AWS_ENDPOINT_URL": endpoint,
+        "AWS_ACCESS_KEY_ID": "local",
+        "AWS_SECRET_ACCESS_KEY": "local",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_REGION": "us-east-1",
+        # a metrics line per request would drown the results; opt in with
+        # METRICS_ENABLED=true to see the stage breakdown
+        "METRICS_ENABLED": os.environ.get("METRICS_ENABLED", "false"),
+    }
+
+
+def client(service: str, endpoint: str):
+    import boto3
+
+    return boto3.client(
+        service,
+        endpoint_url=endpoint,
+        region_name="us-east-1",
+        aws_access_key_id="local",
+        aws_secret_access_key="local",
+    )
+
+
+def create_resources(endpoint: str):
+    client("s3", endpoint).create_bucket(Bucket=BUCKET)
+    client("dynamodb", endpoint).create_table(
+        TableName=DDB_TABLE,
+        AttributeDefinitions=[
+            {"AttributeName": name, "AttributeType": "S"}
+            for name in ("userId", "fileKey", "tableId")
+        ],
+        KeySchema=[
+            {"AttributeName": "userId", "KeyType": "HASH"},
+            {"AttributeName": "fileKey", "KeyType": "RANGE"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": f"{name}-index",
+                "KeySchema": [{"AttributeName": name, "KeyType": "HASH"}],
+                "Projection": {"ProjectionType": "KEYS_ONLY"},
+            }
+            for name in ("tableId", "fileKey")
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+def create_conversion_queue(endpoint: str, max_attempts: int = 3):
+    """
+    Conversion queue + DLQ with S3 notifications wired to it, as in
+    infra/storage.py. Returns (queue_url, dlq_url).
+    """
+    # fire on exactly the suffixes the handlers accept; common.py reads the
+    # environment start() sets up, so it's only imported now
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+    from settings import UPLOAD_FORMATS, UPLOAD_PREFIX
+
+    sqs = client("sqs", endpoint)
+    dlq_url = sqs.create_queue(QueueName="conversion-dlq-local")["QueueUrl"]
+    dlq_arn = sqs.get_queue_attributes(QueueUrl=dlq_url, AttributeNames=["QueueArn"])[
+        "Attributes"
+    ]["QueueArn"]
+    queue_url = sqs.create_queue(
+        QueueName="conversion-queue-local",
+        Attributes={
+            "VisibilityTimeout": "30",
+            "RedrivePolicy": json.dumps(
+                {"deadLetterTargetArn": dlq_arn, "maxReceiveCount": max_attempts}
+            ),
+        },
+    )["QueueUrl"]
+    queue_arn = sqs.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=["QueueArn"]
+    )["Attributes"]["QueueArn"]
+    client("s3", endpoint).put_bucket_notification_configuration(
+        Bucket=BUCKET,
+        NotificationConfiguration={
+            "QueueConfigurations": [
+                {
+                    "QueueArn": queue_arn,
+                    "Events": [
+                        "s3:ObjectCreated:Put",
+                        "s3:ObjectCreated:CompleteMultipartUpload",
+                    ],
+                    "Filter": {
+                        "Key": {
+                            "FilterRules": [
+                                {"Name": "prefix", "Value": UPLOAD_PREFIX},
+                                {"Name": "suffix", "Value": suffix},
+                            ]
+                        }
+                    },
+                }
+                for suffix in UPLOAD_FORMATS
+            ]
+        },
+    )
+    return queue_url, dlq_url
+
+
+class QueueConsumer:
+    """
+    Stand-in for the Lambda SQS event source mapping.
+
+    Receives up to `batch_size` messages, hands them to `handler` as an
+    aws:sqs event and deletes everything not listed in batchItemFailures.
+    Failed messages are made visible again straight away rather than after
+    the visibility timeout, so retries run back to back.
+    """
+
+    def __init__(self, endpoint: str, queue_url: str, handler, batch_size: int = 5):
+        self.sqs = client("sqs", endpoint)
+        self.queue_url = queue_url
+        self.handler = handler
+        self.batch_size = batch_size
+
+    def poll(self) -> int:
+        """Deliver one batch; returns the number of messages received."""
+        messages = self.sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=self.batch_size,
+            AttributeNames=["ApproximateReceiveCount"],
+            WaitTimeSeconds=1,
+        ).get("Messages", [])
+        if not messages:
+            return 0
+        event = {
+            "Records": [
+                {
+                    "eventSource": "aws:sqs",
+                    "messageId": m["MessageId"],
+                    "receiptHandle": m["ReceiptHandle"],
+                    "body": m["Body"],
+                    "attributes": m["Attributes"],
+                }
+                for m in messages
+            ]
+        }
+        result = self.handler(event, None) or {}
+        failed = {f["itemIdentifier"] for f in result.get("batchItemFailures", [])}
+        for m in messages:
+            if m["MessageId"] in failed:
+                self.sqs.change_message_visibility(
+                    QueueUrl=self.queue_url,
+                    ReceiptHandle=m["ReceiptHandle"],
+                    VisibilityTimeout=0,
+                )
+            else:
+                self.sqs.delete_message(
+                    QueueUrl=self.queue_url, ReceiptHandle=m["ReceiptHandle"]
+                )
+        return len(messages)
+
+    def drain(self, idle_polls: int = 2) -> int:
+        """Poll until the queue stays empty; returns batches delivered."""
+        batches, idle = 0, 0
+        while idle < idle_polls:
+            if self.poll():
+                batches, idle = batches + 1, 0
+            else:
+                idle += 1
+        return batches
+
+
+def start(port: int = None):
+    """
+    Start the stand-ins and return (server, env).
+
+    `env` is also applied to os.environ so in-process imports of the
+    handler modules pick it up; pass it to subprocesses as-is.
+    """
+    from moto.server import ThreadedMotoServer
+
+    # one access-log line per request would drown the results
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = port or _free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    create_resources(endpoint)
+    env = lambda_env(endpoint)
+    os.environ.update(env)
+    return server, env
@@ -1,9 +1,19 @@
 # infra/__main__.py
 
+import os
+import sys
+
+# settings shared with the functions (lambda-image/settings.py)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda-image"))
+
 import pulumi
 import web  # ← pull in infra/web.py to provision your static site
-from storage import create_storage, configure_bucket_notification
-from iam import create_lambda_role, create_ec2_role
+from storage import (
+    create_storage,
+    create_conversion_queue,
+    configure_bucket_notification,
+)
+from iam import create_lambda_role, create_ec2_role, allow_conversion_invoke
 from compute import create_lambda
 from ec2 import create_ec2
 from api import create_api
@@ -14,35 +24,45 @@ from network import setup_network
 # ---------------------------------------------------------------------------
 bucket, ddb_table = create_storage()
 
+# Conversion attempts per upload before its message goes to the DLQ
+CONVERSION_MAX_ATTEMPTS = 3
+conversion_queue, conversion_dlq, conversion_queue_policy = create_conversion_queue(
+    bucket, CONVERSION_MAX_ATTEMPTS
+)
+
 # ---------------------------------------------------------------------------
 # 2) IAM
 # ---------------------------------------------------------------------------
-(lambda_role,) = (create_lambda_role(bucket, ddb_table),)
+(lambda_role,) = (create_lambda_role(bucket, ddb_table, conversion_queue),)
 ec2_role, ec2_profile = create_ec2_role(bucket)
 
 # ---------------------------------------------------------------------------
 # 3) COMPUTE
 #    a) Spin up your EC2 first
-ec2_sg, ubuntu_ami, ec2_instance = create_ec2(ec2_profile)
+ec2_sg, ubuntu_ami, ec2_instance, ec2_eip = create_ec2(ec2_profile)
 
-#    b) Then build the Lambda, passing in the EC2 instance ID
-repo, image, lambda_func, allow_s3_invoker = create_lambda(
+#    b) Then build the Lambdas (conversion image + slim API), passing in the
+#       EC2 instance ID and its Elastic IP
+repo, image, lambda_func, api_func, queue_mapping = create_lambda(
     lambda_role,
     bucket,
     ddb_table,
+    conversion_queue,
+    CONVERSION_MAX_ATTEMPTS,
     ec2_instance.id,
-    ec2_instance.public_ip,
+    ec2_eip.public_ip,
 )
+allow_conversion_invoke(lambda_role, lambda_func)
 
 # ---------------------------------------------------------------------------
 # 4) API
 # ---------------------------------------------------------------------------
-api = create_api(lambda_func)
+api = create_api(api_func, lambda_func)
 
 # ---------------------------------------------------------------------------
 # 5) BUCKET NOTIFICATIONS
 # ---------------------------------------------------------------------------
-configure_bucket_notification(bucket, lambda_func, allow_s3_invoker)
+configure_bucket_notification(bucket, conversion_queue, conversion_queue_policy)
 
 # ---------------------------------------------------------------------------
 # 6) NETWORK
@@ -55,7 +75,9 @@ vpc, rt, s3_endpoint = setup_network()
 pulumi.export("api_url", api.api_endpoint)
 pulumi.export("bucket_name", bucket.id)
 pulumi.export("ddb_table_name", ddb_table.name)
-pulumi.export("delta_instance_ip", ec2_instance.public_ip)
+pulumi.export("conversion_queue_url", conversion_queue.id)
+pulumi.export("conversion_dlq_url", conversion_dlq.id)
+pulumi.export("delta_instance_ip", ec2_eip.public_ip)
 pulumi.export("delta_instance_id", ec2_instance.id)
 pulumi.export("s3_gateway_endpoint_id", s3_endpoint.id)
 pulumi.export("delta_sg_id", ec2_sg.id)
@@ -3,7 +3,9 @@ import pulumi_aws as aws
 import pulumi_aws.apigatewayv2 as apigw
 
 
-def create_api(lambda_func: aws.lambda_.Function) -> apigw.Api:
+def create_api(
+    api_func: aws.lambda_.Function, convert_func: aws.lambda_.Function
+) -> apigw.Api:
     # 1) Define the HTTP API with CORS enabled for localhost and your Cloudflare domain
     api = apigw.Api(
         "ingest-api",
@@ -19,30 +21,48 @@ def create_api(lambda_func: aws.lambda_.Function) -> apigw.Api:
         ),
     )
 
-    # 2) Wire up a Lambda proxy integration
+    # 2) Wire up a Lambda proxy integration per function: the slim API
+    #    function serves the light routes, the conversion function /process
     integration = apigw.Integration(
         "lambda-integration",
         api_id=api.id,
         integration_type="AWS_PROXY",
-        integration_uri=lambda_func.invoke_arn,
+        integration_uri=api_func.invoke_arn,
+        integration_method="POST",
+        payload_format_version="2.0",
+    )
+    convert_integration = apigw.Integration(
+        "convert-integration",
+        api_id=api.id,
+        integration_type="AWS_PROXY",
+        integration_uri=convert_func.invoke_arn,
         integration_method="POST",
         payload_format_version="2.0",
     )
 
     # 3) Create one route per endpoint
-    for method, route in [
-        ("POST", "/presign"),
-        ("POST", "/process"),
-        ("POST", "/share"),
-        ("POST", "/unshare"),
-        ("GET", "/datasets"),
-        ("GET", "/snippet"),
+    for method, route, target in [
+        ("POST", "/presign", integration),
+        ("POST", "/presign/parts", integration),
+        ("POST", "/presign/complete", integration),
+        ("POST", "/presign/abort", integration),
+        ("POST", "/process", convert_integration),
+        ("POST", "/share", integration),
+        ("POST", "/unshare", integration),
+        ("GET", "/datasets", integration),
+        ("GET", "/snippet", integration),
+        ("GET", "/preview", integration),
+        ("GET", "/profile", integration),
+        ("GET", "/share/status", integration),
+        ("GET", "/updates", integration),
+        ("POST", "/maintain", integration),
+        ("GET", "/maintain", integration),
     ]:
         apigw.Route(
-            f"route-{method.lower()}-{route.strip('/')}",
+            f"route-{method.lower()}-{route.strip('/').replace('/', '-')}",
             api_id=api.id,
             route_key=f"{method} {route}",
-            target=integration.id.apply(lambda iid: f"integrations/{iid}"),
+            target=target.id.apply(lambda iid: f"integrations/{iid}"),
         )
 
     # 4) Deploy the default stage with auto-deploy on each change
@@ -53,14 +73,18 @@ def create_api(lambda_func: aws.lambda_.Function) -> apigw.Api:
         auto_deploy=True,
     )
 
-    # 5) Give API Gateway permission to invoke your Lambda
-    aws.lambda_.Permission(
-        "api-lambda-permission",
-        action="lambda:InvokeFunction",
-        function=lambda_func.name,
-        principal="apigateway.amazonaws.com",
-        source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*"),
-    )
+    # 5) Give API Gateway permission to invoke both Lambdas
+    for name, func in [
+        ("api-lambda-permission", api_func),
+        ("convert-lambda-permission", convert_func),
+    ]:
+        aws.lambda_.Permission(
+            name,
+            action="lambda:InvokeFunction",
+            function=func.name,
+            principal="apigateway.amazonaws.com",
+            source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*"),
+        )
 
     # 6) Export the URL so you can reference it elsewhere
     pulumi.export("api_url", api.api_endpoint)
@@ -1,28 +1,78 @@
+import json
 import os
 
+import pulumi
 import pulumi_aws as aws
 import pulumi_awsx as awsx
 
+from settings import CONVERSION_TIMEOUT_SECONDS
 
-def create_lambda(lambda_role, bucket, ddb_table, delta_instance_id, delta_server_url):
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "..", "lambda-image")
+
+# Modules the slim API function needs; everything else (convert.py and the
+# pandas/pyarrow/deltalake stack) only ships in the conversion image.
+API_MODULES = [
+    "api_handler.py",
+    "common.py",
+    "metrics.py",
+    "records.py",
+    "settings.py",
+    "sharing.py",
+]
+
+
+# Conversion queue consumption: messages per invocation, how long to wait to
+# fill a batch, and the most conversion invocations running at once.
+QUEUE_BATCH_SIZE = 5
+QUEUE_BATCH_WINDOW_SECONDS = 10
+QUEUE_MAX_CONCURRENCY = 5
+
+# When scheduled table maintenance runs (UTC)
+MAINTENANCE_SCHEDULE = "cron(0 3 * * ? *)"
+
+
+def create_lambda(
+    lambda_role,
+    bucket,
+    ddb_table,
+    conversion_queue,
+    max_attempts,
+    delta_instance_id,
+    delta_server_url,
+):
     """
-    Build and publish the Lambda container image, inject DELTA_INSTANCE_ID
-    and DELTA_SERVER_URL, and grant S3 invoke permissions.
+    Build and publish the conversion container image and the slim API
+    function, inject DELTA_INSTANCE_ID and DELTA_SERVER_URL, and attach the
+    conversion function to the conversion queue.
 
     Returns:
       - repo: AWSX ECR repository
       - image: built image
-      - lambda_func: Lambda Function resource
-      - allow_s3_invoker: Lambda permission resource for S3 invocation
+      - lambda_func: conversion Lambda Function resource
+      - api_func: API Lambda Function resource
+      - queue_mapping: SQS event source mapping for the conversion function
     """
     # 1) ECR repository and image
     repo = awsx.ecr.Repository("ingest-repo")
     image = awsx.ecr.Image(
         "ingest-image",
         repository_url=repo.url,
-        context=os.path.join(os.path.dirname(__file__), "..", "lambda-image"),
+        context=LAMBDA_DIR,
     )
 
+    variables = {
+        "BUCKET_NAME": bucket.bucket,
+        "DDB_TABLE_NAME": ddb_table.name,
+        "DELTA_INSTANCE_ID": delta_instance_id,
+        # provide the Delta-Sharing server endpoint
+        "DELTA_SERVER_URL": delta_server_url.apply(lambda ip: f"http://{ip}:8080"),
+        # must match the queue's maxReceiveCount
+        "CONVERSION_MAX_ATTEMPTS": str(max_attempts),
+        # per-stage timings logged as CloudWatch embedded metrics
+        # (lambda-image/metrics.py); "false" turns them off
+        "METRICS_ENABLED": "true",
+    }
+
     # 2) Lambda function for ingesting/processing data
     lambda_func = aws.lambda_.Function(
         "ingest-fn",
@@ -30,31 +80,77 @@ def create_lambda(lambda_role, bucket, ddb_table, delta_instance_id, delta_serve
         image_uri=image.image_uri,
         role=lambda_role.arn,
         architectures=["arm64"],
-        timeout=300,
+        timeout=CONVERSION_TIMEOUT_SECONDS,
         memory_size=1024,
         environment=aws.lambda_.FunctionEnvironmentArgs(
             variables={
-                "BUCKET_NAME": bucket.bucket,
-                "DDB_TABLE_NAME": ddb_table.name,
-                "DELTA_INSTANCE_ID": delta_instance_id,
-                # provide the Delta-Sharing server endpoint
-                "DELTA_SERVER_URL": delta_server_url.apply(
-                    lambda ip: f"http://{ip}:8080"
-                ),
+                **variables,
+                "CONVERSION_TIMEOUT_SECONDS": str(CONVERSION_TIMEOUT_SECONDS),
             }
         ),
     )
 
-    # 3) Permission to allow S3 to invoke this Lambda
-    allow_s3_invoker = aws.lambda_.Permission(
-        "allow-s3-invoke",
+    # 3) Slim zip-packaged function for the HTTP routes: runtime-provided
+    #    boto3 only, so cold starts skip the container and the data stack
+    api_func = aws.lambda_.Function(
+        "api-fn",
+        runtime="python3.12",
+        handler="api_handler.main",
+        code=pulumi.AssetArchive(
+            {
+                name: pulumi.FileAsset(os.path.join(LAMBDA_DIR, name))
+                for name in API_MODULES
+            }
+        ),
+        role=lambda_role.arn,
+        architectures=["arm64"],
+        timeout=30,
+        memory_size=256,
+        environment=aws.lambda_.FunctionEnvironmentArgs(
+            variables={
+                **variables,
+                # POST /maintain hands the work to the conversion function
+                "CONVERSION_FUNCTION_NAME": lambda_func.name,
+            }
+        ),
+    )
+
+    # 4) Consume the conversion queue in batches, at most
+    #    QUEUE_MAX_CONCURRENCY invocations at a time; failed messages are
+    #    reported individually so the rest of a batch isn't retried
+    queue_mapping = aws.lambda_.EventSourceMapping(
+        "ingest-queue-mapping",
+        event_source_arn=conversion_queue.arn,
+        function_name=lambda_func.arn,
+        batch_size=QUEUE_BATCH_SIZE,
+        maximum_batching_window_in_seconds=QUEUE_BATCH_WINDOW_SECONDS,
+        scaling_config=aws.lambda_.EventSourceMappingScalingConfigArgs(
+            maximum_concurrency=QUEUE_MAX_CONCURRENCY,
+        ),
+        function_response_types=["ReportBatchItemFailures"],
+    )
+
+    # 5) Nightly maintenance of every table (compaction, vacuum, checkpoint);
+    #    the function fans out one async invocation per table
+    maintenance_rule = aws.cloudwatch.EventRule(
+        "maintenance-schedule",
+        schedule_expression=MAINTENANCE_SCHEDULE,
+    )
+    aws.cloudwatch.EventTarget(
+        "maintenance-target",
+        rule=maintenance_rule.name,
+        arn=lambda_func.arn,
+        input=json.dumps({"action": "maintain-all"}),
+    )
+    aws.lambda_.Permission(
+        "allow-maintenance-schedule",
         action="lambda:InvokeFunction",
         function=lambda_func.name,
-        principal="s3.amazonaws.com",
-        source_arn=bucket.arn,
+        principal="events.amazonaws.com",
+        source_arn=maintenance_rule.arn,
     )
 
-    return repo, image, lambda_func, allow_s3_invoker
+    return repo, image, lambda_func, api_func, queue_mapping
 
 
 def create_ec2(ec2_profile):
@@ -0,0 +1,84 @@
+"""
+Check that a Delta Sharing reload drops no requests.
+
+This is a smoke check for the deployed instance, not a local test: the
+reload it drives needs the systemd units and nginx that user-data.sh
+provisions (bench/check_share_reload.py runs the same reload against
+local stand-ins). Run it on the sharing box, e.g. from an SSM session:
+
+    python3 check_reload.py --reloads 3
+
+Keeps several clients requesting the table listing through nginx while the
+reload command runs, then reports every request that failed. Exits non-zero
+if any did.
+"""
+
+import argparse
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+
+def client(url, stop, results, lock):
+    while not stop.is_set():
+        try:
+            with urllib.request.urlopen(url, timeout=10) as resp:
+                resp.read()
+            error = None
+        except Exception as exc:  # refused, reset, truncated, 5xx...
+            error = f"{time.strftime('%H:%M:%S')} {exc}"
+        with lock:
+            if error:
+                results["failed"].append(error)
+            else:
+                results["ok"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--url",
+        default="http://127.0.0.1:8080/shares/my_share/schemas/default/tables",
+    )
+    parser.add_argument(
+        "--reload-cmd", default="sudo /usr/local/bin/delta-sharing-reload"
+    )
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--reloads", type=int, default=3)
+    parser.add_argument(
+        "--settle", type=float, default=5.0, help="seconds of traffic around reloads"
+    )
+    args = parser.parse_args()
+
+    results = {"ok": 0, "failed": []}
+    lock, stop = threading.Lock(), threading.Event()
+    threads = [
+        threading.Thread(target=client, args=(args.url, stop, results, lock))
+        for _ in range(args.clients)
+    ]
+    for t in threads:
+        t.start()
+
+    try:
+        time.sleep(args.settle)
+        for i in range(args.reloads):
+            started = time.time()
+            subprocess.run(args.reload_cmd, shell=True, check=True)
+            print(f"reload {i + 1}/{args.reloads} took {time.time() - started:.1f}s")
+        time.sleep(args.settle)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    print(f"{results['ok']} requests ok, {len(results['failed'])} failed")
+    for error in results["failed"][:20]:
+        print("  " + error)
+    if results["failed"] or not results["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
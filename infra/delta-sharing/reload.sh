@@ -0,0 +1,52 @@
+#!/bin/bash
+# Blue/green reload of the Delta Sharing server.
+#
+# Two server instances (systemd units delta-sharing@8081 / @8082) sit behind
+# nginx on :8080. A reload starts the idle one on the current share.yaml,
+# waits for it to answer, points nginx at it (nginx -s reload lets in-flight
+# requests on the old upstream finish) and only then stops the old one.
+# If the new instance never becomes healthy, traffic stays where it was.
+set -euo pipefail
+
+SHARES_DIR=${SHARES_DIR:-/home/ubuntu/shares}
+SHARE_NAME=${SHARE_NAME:-my_share}
+UPSTREAM_CONF=${UPSTREAM_CONF:-/etc/nginx/delta-sharing-upstream.conf}
+HEALTH_TIMEOUT=${HEALTH_TIMEOUT:-120}
+DRAIN_SECONDS=${DRAIN_SECONDS:-30}
+
+active=$(cat "$SHARES_DIR/active.port" 2>/dev/null || echo 8082)
+if [ "$active" = 8081 ]; then next=8082; else next=8081; fi
+
+# share.yaml is rendered for the public port; each colour gets its own copy
+# bound to loopback on its own port
+mkdir -p "$SHARES_DIR/$next"
+sed -e "s/^port: .*/port: $next/" -e 's/^host: .*/host: "127.0.0.1"/' \
+  "$SHARES_DIR/share.yaml" > "$SHARES_DIR/$next/share.yaml"
+chown -R ubuntu:ubuntu "$SHARES_DIR/$next"
+
+systemctl restart "delta-sharing@$next"
+
+healthy=""
+for _ in $(seq 1 "$HEALTH_TIMEOUT"); do
+  if curl -fsS -o /dev/null \
+    "http://127.0.0.1:$next/shares/$SHARE_NAME/schemas/default/tables"; then
+    healthy=1
+    break
+  fi
+  sleep 1
+done
+if [ -z "$healthy" ]; then
+  systemctl stop "delta-sharing@$next"
+  echo "delta-sharing@$next failed its health check; still serving from $active" >&2
+  exit 1
+fi
+
+echo "server 127.0.0.1:$next;" > "$UPSTREAM_CONF"
+nginx -s reload
+echo "$next" > "$SHARES_DIR/active.port"
+systemctl enable "delta-sharing@$next"
+
+# old workers finish their requests before the old server goes away
+sleep "$DRAIN_SECONDS"
+systemctl disable --now "delta-sharing@$active" || true
+echo "now serving from $next"
@@ -0,0 +1,80 @@
+#!/bin/bash
+# Provision the Delta Sharing box: two server instances behind nginx so
+# configuration changes can be applied blue/green without downtime.
+set -euxo pipefail
+
+DELTA_SHARING_VERSION=1.1.0
+
+apt-get update
+apt-get install -y openjdk-11-jre-headless nginx unzip curl
+
+# server distribution
+cd /opt
+curl -fsSL -o delta-sharing-server.zip \
+  "https://github.com/delta-io/delta-sharing/releases/download/v${DELTA_SHARING_VERSION}/delta-sharing-server-${DELTA_SHARING_VERSION}.zip"
+unzip -q delta-sharing-server.zip
+ln -sfn "/opt/delta-sharing-server-${DELTA_SHARING_VERSION}" /opt/delta-sharing-server
+
+# one unit per colour; %i is the port
+cat > /etc/systemd/system/delta-sharing@.service << 'UNIT'
+[Unit]
+Description=Delta Sharing server on port %i
+After=network-online.target
+
+[Service]
+User=ubuntu
+Environment=JAVA_OPTS=-Xmx512m
+ExecStart=/opt/delta-sharing-server/bin/delta-sharing-server -- --config /home/ubuntu/shares/%i/share.yaml
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+UNIT
+systemctl daemon-reload
+
+# nginx owns the public port and proxies to whichever colour is active
+echo "server 127.0.0.1:8081;" > /etc/nginx/delta-sharing-upstream.conf
+cat > /etc/nginx/sites-available/delta-sharing << 'NGINX'
+upstream delta_sharing {
+    include /etc/nginx/delta-sharing-upstream.conf;
+}
+
+server {
+    listen 8080;
+
+    location / {
+        proxy_pass http://delta_sharing;
+        proxy_http_version 1.1;
+        proxy_set_header Host $host;
+        proxy_read_timeout 300s;
+    }
+}
+NGINX
+rm -f /etc/nginx/sites-enabled/default
+ln -sfn /etc/nginx/sites-available/delta-sharing /etc/nginx/sites-enabled/delta-sharing
+
+cat > /usr/local/bin/delta-sharing-reload << 'RELOAD'
+@RELOAD_SCRIPT@
+RELOAD
+chmod 755 /usr/local/bin/delta-sharing-reload
+
+# start with an empty share; the Lambda fills it in via SSM
+mkdir -p /home/ubuntu/shares/tables.d
+cat > /home/ubuntu/shares/share.yaml << 'YAML'
+version: 1
+
+# server config
+host: "0.0.0.0"
+port: 8080
+endpoint: "/"
+
+shares:
+  - name: my_share
+    schemas:
+      - name: default
+        tables: []
+YAML
+chown -R ubuntu:ubuntu /home/ubuntu/shares
+
+systemctl restart nginx
+/usr/local/bin/delta-sharing-reload
@@ -1,7 +1,19 @@
 # infra/ec2.py
 
+import os
+
 import pulumi_aws as aws
 
+SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), "delta-sharing")
+
+
+def delta_sharing_user_data() -> str:
+    """Boot script that installs the blue/green Delta Sharing setup."""
+    with open(os.path.join(SCRIPTS_DIR, "reload.sh")) as f:
+        reload_script = f.read().rstrip("\n")
+    with open(os.path.join(SCRIPTS_DIR, "user-data.sh")) as f:
+        return f.read().replace("@RELOAD_SCRIPT@", reload_script)
+
 
 def create_ec2(ec2_profile):
     # 1) Lookup the latest Ubuntu 22.04 AMI
@@ -45,19 +57,37 @@ def create_ec2(ec2_profile):
         ],
     )
 
-    # 3) EC2 Instance
+    # 3) EC2 Instance (t3.small: two server JVMs overlap during a reload).
+    #    Changing the boot script replaces the instance; the Elastic IP below
+    #    moves over, but the new box starts with an empty share until
+    #    rebuild-share is run (see README).
     instance = aws.ec2.Instance(
         "delta-sharing-server",
-        instance_type="t3.micro",
+        instance_type="t3.small",
         ami=ubuntu.id,
         key_name="viewer-frontend-key",
         vpc_security_group_ids=[sec_group.id],
         iam_instance_profile=ec2_profile.name,
+        user_data=delta_sharing_user_data(),
+        user_data_replace_on_change=True,
         tags={
             "Name": "delta-sharing-server",
             "SSMEnabled": "true",  # Optional: helps you target by tag later
         },
     )
 
-    # Return the security group, AMI data, and the instance resource
-    return sec_group, ubuntu, instance
+    # 4) Elastic IP, so the server URL handed out in snippets and credentials
+    #    survives the instance being replaced
+    eip = aws.ec2.Eip(
+        "delta-sharing-eip",
+        domain="vpc",
+        tags={"Name": "delta-sharing-server"},
+    )
+    aws.ec2.EipAssociation(
+        "delta-sharing-eip-assoc",
+        instance_id=instance.id,
+        allocation_id=eip.id,
+    )
+
+    # Return the security group, AMI data, the instance and its Elastic IP
+    return sec_group, ubuntu, instance, eip
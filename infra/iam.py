@@ -1,7 +1,7 @@
 import pulumi_aws as aws
 
 
-def create_lambda_role(bucket, ddb_table):
+def create_lambda_role(bucket, ddb_table, conversion_queue):
     # 1) IAM role for the Lambda container
     lambda_role = aws.iam.Role(
         "lambda-role",
@@ -37,7 +37,14 @@ def create_lambda_role(bucket, ddb_table):
                 statements=[
                     {
                         "effect": "Allow",
-                        "actions": ["s3:PutObject", "s3:GetObject", "s3:ListBucket"],
+                        "actions": [
+                            "s3:PutObject",
+                            "s3:GetObject",
+                            "s3:ListBucket",
+                            "s3:AbortMultipartUpload",
+                            # VACUUM and log cleanup in table maintenance
+                            "s3:DeleteObject",
+                        ],
                         "resources": [arn, f"{arn}/*"],
                     }
                 ]
@@ -57,10 +64,34 @@ def create_lambda_role(bucket, ddb_table):
                         "actions": [
                             "dynamodb:PutItem",
                             "dynamodb:UpdateItem",
+                            "dynamodb:DeleteItem",
                             "dynamodb:GetItem",
                             "dynamodb:Query",
                             "dynamodb:Scan",
                         ],
+                        # the GSIs are separate resources for Query
+                        "resources": [arn, f"{arn}/index/*"],
+                    }
+                ]
+            ).json
+        ),
+    )
+
+    # Conversion function consumes the S3 notification queue
+    aws.iam.RolePolicy(
+        "lambda-sqs-policy",
+        role=lambda_role.id,
+        policy=conversion_queue.arn.apply(
+            lambda arn: aws.iam.get_policy_document(
+                statements=[
+                    {
+                        "effect": "Allow",
+                        "actions": [
+                            "sqs:ReceiveMessage",
+                            "sqs:DeleteMessage",
+                            "sqs:ChangeMessageVisibility",
+                            "sqs:GetQueueAttributes",
+                        ],
                         "resources": [arn],
                     }
                 ]
@@ -68,7 +99,8 @@ def create_lambda_role(bucket, ddb_table):
         ),
     )
 
-    # Allow Lambda to send SSM commands to EC2
+    # Allow Lambda to send SSM commands to EC2 and read back their output
+    # (the share manifest's live version is reported in command output)
     aws.iam.RolePolicy(
         "lambda-ssm-send-command",
         role=lambda_role.id,
@@ -76,7 +108,7 @@ def create_lambda_role(bucket, ddb_table):
             statements=[
                 {
                     "effect": "Allow",
-                    "actions": ["ssm:SendCommand"],
+                    "actions": ["ssm:SendCommand", "ssm:GetCommandInvocation"],
                     "resources": ["*"],  # or scope to specific instance ARN if desired
                 }
             ]
@@ -139,3 +171,25 @@ def create_ec2_role(bucket):
     )
 
     return ec2_role, ec2_profile
+
+
+def allow_conversion_invoke(lambda_role, convert_func):
+    """
+    Let the Lambdas invoke the conversion function: the API function hands
+    it POST /maintain runs and the scheduled run fans out to itself.
+    """
+    aws.iam.RolePolicy(
+        "lambda-invoke-conversion",
+        role=lambda_role.id,
+        policy=convert_func.arn.apply(
+            lambda arn: aws.iam.get_policy_document(
+                statements=[
+                    {
+                        "effect": "Allow",
+                        "actions": ["lambda:InvokeFunction"],
+                        "resources": [arn],
+                    }
+                ]
+            ).json
+        ),
+    )
@@ -1,6 +1,10 @@
+import json
+
 import pulumi
 import pulumi_aws as aws
 
+from settings import CONVERSION_TIMEOUT_SECONDS, UPLOAD_FORMATS, UPLOAD_PREFIX
+
 
 def create_storage():
     # 1) S3 bucket that stores raw uploads + Delta tables, with CORS for your frontends
@@ -18,41 +22,127 @@ def create_storage():
                 max_age_seconds=3600,
             )
         ],
+        # multipart uploads the browser (uploads/) or a Delta writer
+        # (datasets/) never completed or aborted
+        lifecycle_rules=[
+            aws.s3.BucketLifecycleRuleArgs(
+                enabled=True,
+                abort_incomplete_multipart_upload_days=1,
+            )
+        ],
     )
 
-    # 2) DynamoDB table for user-based dataset tracking
+    # 2) DynamoDB table for user-based dataset tracking, with keys-only GSIs so
+    #    lookups by tableId (/share, /unshare, /snippet) and by fileKey (S3
+    #    conversion) are single-item queries instead of table scans
     ddb_table = aws.dynamodb.Table(
         "dataset-tracking",
         attributes=[
             {"name": "userId", "type": "S"},
             {"name": "fileKey", "type": "S"},
+            {"name": "tableId", "type": "S"},
         ],
         hash_key="userId",
         range_key="fileKey",
         billing_mode="PAY_PER_REQUEST",
+        global_secondary_indexes=[
+            {
+                "name": "tableId-index",
+                "hash_key": "tableId",
+                "projection_type": "KEYS_ONLY",
+            },
+            {
+                "name": "fileKey-index",
+                "hash_key": "fileKey",
+                "projection_type": "KEYS_ONLY",
+            },
+        ],
     )
 
     return bucket, ddb_table
 
 
+def create_conversion_queue(bucket: aws.s3.Bucket, max_attempts: int):
+    """
+    SQS work queue between S3 and the conversion Lambda, plus its DLQ.
+
+    A bulk upload becomes a backlog the consumer drains at its own pace
+    instead of one concurrent conversion per object. Messages that fail
+    `max_attempts` times are moved to the dead-letter queue.
+    """
+    dlq = aws.sqs.Queue(
+        "conversion-dlq",
+        message_retention_seconds=14 * 24 * 3600,
+    )
+    queue = aws.sqs.Queue(
+        "conversion-queue",
+        # AWS recommends 6x the consumer's timeout so a message isn't
+        # redelivered while a batch is still converting
+        visibility_timeout_seconds=6 * CONVERSION_TIMEOUT_SECONDS,
+        message_retention_seconds=4 * 24 * 3600,
+        redrive_policy=dlq.arn.apply(
+            lambda arn: json.dumps(
+                {"deadLetterTargetArn": arn, "maxReceiveCount": max_attempts}
+            )
+        ),
+    )
+
+    # Allow this bucket's notifications to enqueue
+    queue_policy = aws.sqs.QueuePolicy(
+        "conversion-queue-policy",
+        queue_url=queue.id,
+        policy=pulumi.Output.all(queue.arn, bucket.arn).apply(
+            lambda arns: aws.iam.get_policy_document(
+                statements=[
+                    {
+                        "effect": "Allow",
+                        "principals": [
+                            {"type": "Service", "identifiers": ["s3.amazonaws.com"]}
+                        ],
+                        "actions": ["sqs:SendMessage"],
+                        "resources": [arns[0]],
+                        "conditions": [
+                            {
+                                "test": "ArnEquals",
+                                "variable": "aws:SourceArn",
+                                "values": [arns[1]],
+                            }
+                        ],
+                    }
+                ]
+            ).json
+        ),
+    )
+
+    return queue, dlq, queue_policy
+
+
 def configure_bucket_notification(
     bucket: aws.s3.Bucket,
-    lambda_func: aws.lambda_.Function,
-    lambda_permission: aws.lambda_.Permission,
+    queue: aws.sqs.Queue,
+    queue_policy: aws.sqs.QueuePolicy,
 ):
     """
-    Configure S3 to invoke the given Lambda only for raw CSV uploads.
+    Configure S3 to enqueue only uploads (UPLOAD_FORMATS suffixes under
+    UPLOAD_PREFIX) for conversion: one rule per suffix, as a rule takes a
+    single suffix. The Parquet files of the tables under datasets/ stay out.
     """
     aws.s3.BucketNotification(
         "datasets-notification",
         bucket=bucket.id,
-        lambda_functions=[
-            aws.s3.BucketNotificationLambdaFunctionArgs(
-                lambda_function_arn=lambda_func.arn,
-                events=["s3:ObjectCreated:Put"],
-                filter_prefix="datasets/",
-                filter_suffix=".csv",
+        queues=[
+            aws.s3.BucketNotificationQueueArgs(
+                queue_arn=queue.arn,
+                # multipart uploads (large files) finish with
+                # CompleteMultipartUpload rather than Put
+                events=[
+                    "s3:ObjectCreated:Put",
+                    "s3:ObjectCreated:CompleteMultipartUpload",
+                ],
+                filter_prefix=UPLOAD_PREFIX,
+                filter_suffix=suffix,
             )
+            for suffix in UPLOAD_FORMATS
         ],
-        opts=pulumi.ResourceOptions(depends_on=[lambda_permission]),
+        opts=pulumi.ResourceOptions(depends_on=[queue_policy]),
     )
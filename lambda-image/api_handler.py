@@ -0,0 +1,841 @@
+"""
+Lightweight HTTP API: /presign (+ multipart parts and completion), /share,
+/unshare, /share/status, /datasets, /snippet, /preview, /profile, /updates
+and /maintain.
+
+Deployed as its own small function with nothing but boto3, so cold starts
+don't pay for the conversion stack (see handler.py for that side).
+"""
+
+import json
+import math
+import os
+import uuid
+from datetime import datetime
+
+from common import (
+    BUCKET,
+    CONVERSION_FUNCTION_NAME,
+    DDB_TABLE,
+    DELTA_SERVER_URL,
+    UPLOAD_FORMATS,
+    UPLOAD_PREFIX,
+    build_response,
+    dynamodb,
+    lambda_client,
+    s3,
+    upload_format,
+)
+from metrics import event_operation, traced
+from records import (
+    DATASETS_MAX_PAGE_SIZE,
+    DATASETS_PAGE_SIZE,
+    dataset_update,
+    decode_page_token,
+    encode_page_token,
+    find_dataset_key,
+    get_dataset,
+    get_update,
+    list_updates,
+    put_update,
+    update_dataset,
+    update_update,
+)
+from sharing import (
+    MANIFEST_PK,
+    SHARE_NAME,
+    apply_manifest_changes,
+    manifest_state,
+    share_table,
+)
+
+# Column types a caller may pin through /presign's optional "schema" field.
+# Anything not listed is inferred from the sample.
+SCHEMA_TYPES = (
+    "string",
+    "int32",
+    "int64",
+    "float32",
+    "float64",
+    "bool",
+    "date32",
+    "timestamp[us]",
+)
+
+
+def validate_schema(schema) -> str:
+    """
+    Check a user-supplied {column: type} mapping; return an error or "".
+    """
+    if not isinstance(schema, dict) or not schema:
+        return "schema must be a non-empty object of column: type"
+    for column, type_name in schema.items():
+        if type_name not in SCHEMA_TYPES:
+            return f"Unsupported type {type_name!r} for column {column!r}"
+    return ""
+
+
+# Parquet layout a caller may choose through /presign's optional
+# "writeOptions"; anything left out is picked by convert.py from the upload
+# size. compression is one of WRITE_CODECS, compressionLevel an int in the
+# codec's COMPRESSION_LEVELS range (the other codecs take none), dictionary
+# a bool, rowGroupRows and targetFileMb positive ints and partitionBy a list
+# of (low-cardinality) column names.
+WRITE_CODECS = ("zstd", "snappy", "gzip", "lz4", "uncompressed")
+COMPRESSION_LEVELS = {"zstd": (1, 22), "gzip": (1, 9)}
+WRITE_OPTION_TYPES = {
+    "compression": str,
+    "compressionLevel": int,
+    "dictionary": bool,
+    "rowGroupRows": int,
+    "targetFileMb": int,
+    "partitionBy": list,
+}
+TYPE_LABELS = {str: "a string", int: "an integer", bool: "a boolean", list: "a list"}
+
+
+def validate_write_options(options) -> str:
+    """
+    Check a user-supplied writeOptions object; return an error or "".
+    """
+    if not isinstance(options, dict):
+        return "writeOptions must be an object"
+    for name, value in options.items():
+        expected = WRITE_OPTION_TYPES.get(name)
+        if expected is None:
+            return f"Unknown write option {name!r}"
+        # bool is an int subclass; don't accept True as a size
+        if not isinstance(value, expected) or (
+            expected is int and isinstance(value, bool)
+        ):
+            return f"Write option {name!r} must be {TYPE_LABELS[expected]}"
+        if expected is int and value <= 0:
+            return f"Write option {name!r} must be positive"
+    codec = options.get("compression", "zstd")
+    if codec not in WRITE_CODECS:
+        return f"compression must be one of {', '.join(WRITE_CODECS)}"
+    if "compressionLevel" in options:
+        if codec not in COMPRESSION_LEVELS:
+            return f"compression {codec!r} takes no compressionLevel"
+        low, high = COMPRESSION_LEVELS[codec]
+        if not low <= options["compressionLevel"] <= high:
+            return f"compressionLevel for {codec} must be from {low} to {high}"
+    partition_by = options.get("partitionBy", [])
+    if not all(isinstance(c, str) and c for c in partition_by):
+        return "partitionBy must list column names"
+    if len(partition_by) > 2:
+        return "partitionBy takes at most 2 columns"
+    return ""
+
+
+# Bounds for POST /maintain. Vacuuming with a short retention deletes files
+# consumers on a slightly older snapshot may still be downloading.
+MIN_VACUUM_RETENTION_HOURS = 24
+MAX_ZORDER_COLUMNS = 4
+
+
+def validate_maintenance(body: dict) -> str:
+    """Check a POST /maintain body; return an error or ""."""
+    zorder_by = body.get("zOrderBy")
+    if zorder_by is not None:
+        if not isinstance(zorder_by, list) or not all(
+            isinstance(c, str) and c for c in zorder_by
+        ):
+            return "zOrderBy must list column names"
+        if len(zorder_by) > MAX_ZORDER_COLUMNS:
+            return f"zOrderBy takes at most {MAX_ZORDER_COLUMNS} columns"
+    retention = body.get("retentionHours")
+    if retention is not None and (
+        not isinstance(retention, int)
+        or isinstance(retention, bool)
+        or retention < MIN_VACUUM_RETENTION_HOURS
+    ):
+        return f"retentionHours must be an integer >= {MIN_VACUUM_RETENTION_HOURS}"
+    return ""
+
+
+# The preview of a table is written once, at conversion, so browsers and
+# the dashboard may keep it a while and revalidate cheaply with its ETag.
+PREVIEW_MAX_AGE = int(os.environ.get("PREVIEW_MAX_AGE", "3600"))
+PREVIEW_CACHE_HEADERS = {"Cache-Control": f"public, max-age={PREVIEW_MAX_AGE}"}
+
+
+# ---------------------------------------------------------------------------
+# Multipart uploads
+#
+# A single presigned PUT tops out at 5 GB and one connection. When the
+# client announces a file of MULTIPART_THRESHOLD bytes or more, /presign
+# starts a multipart upload instead and returns one presigned URL per part
+# so the browser can send parts in parallel and retry just the ones that
+# fail. Parts are at least MULTIPART_PART_SIZE and grow so no upload needs
+# more than MULTIPART_MAX_PARTS URLs (which also keeps the response under
+# Lambda's 6 MB); with S3's 5 GiB part limit that caps uploads a little
+# below S3's own 5 TiB. URLs expire after PRESIGN_EXPIRY seconds, and
+# /presign/parts signs the parts a slow upload hasn't sent yet again.
+# ---------------------------------------------------------------------------
+MULTIPART_THRESHOLD = int(os.environ.get("MULTIPART_THRESHOLD", str(64 * 1024**2)))
+MULTIPART_PART_SIZE = int(os.environ.get("MULTIPART_PART_SIZE", str(16 * 1024**2)))
+MULTIPART_MAX_PARTS = 1000
+MAX_PART_BYTES = 5 * 1024**3
+MAX_UPLOAD_BYTES = min(5 * 1024**4, MULTIPART_MAX_PARTS * MAX_PART_BYTES)
+PRESIGN_EXPIRY = int(os.environ.get("PRESIGN_EXPIRY", "3600"))
+
+
+def content_type(s3_key: str) -> str:
+    return UPLOAD_FORMATS[upload_format(s3_key)]
+
+
+def multipart_part_size(size: int) -> int:
+    part_size = max(MULTIPART_PART_SIZE, math.ceil(size / MULTIPART_MAX_PARTS))
+    # round up to whole MiB
+    return -(-part_size // 1024**2) * 1024**2
+
+
+def presign_put(s3_key: str) -> str:
+    return s3.generate_presigned_url(
+        ClientMethod="put_object",
+        Params={"Bucket": BUCKET, "Key": s3_key, "ContentType": content_type(s3_key)},
+        ExpiresIn=PRESIGN_EXPIRY,
+    )
+
+
+def presign_parts(s3_key: str, upload_id: str, part_numbers) -> list:
+    return [
+        {
+            "partNumber": n,
+            "url": s3.generate_presigned_url(
+                ClientMethod="upload_part",
+                Params={
+                    "Bucket": BUCKET,
+                    "Key": s3_key,
+                    "UploadId": upload_id,
+                    "PartNumber": n,
+                },
+                ExpiresIn=PRESIGN_EXPIRY,
+            ),
+        }
+        for n in part_numbers
+    ]
+
+
+def presign_multipart(s3_key: str, size: int) -> dict:
+    upload_id = s3.create_multipart_upload(
+        Bucket=BUCKET, Key=s3_key, ContentType=content_type(s3_key)
+    )["UploadId"]
+    part_size = multipart_part_size(size)
+    parts = presign_parts(s3_key, upload_id, range(1, math.ceil(size / part_size) + 1))
+    return {"uploadId": upload_id, "partSize": part_size, "parts": parts}
+
+
+def pending_upload(body: dict):
+    """
+    (record key, object key, error response) for a multipart completion or
+    abort request. The upload must be the one /presign started, for the
+    table itself or for one of its updates ("updateId").
+    """
+    table_id, upload_id = body.get("tableId"), body.get("uploadId")
+    if not table_id or not upload_id:
+        return None, None, build_response(400, {"error": "Missing tableId or uploadId"})
+    record_key = find_dataset_key(table_id)
+    update_id = body.get("updateId")
+    record = get_dataset(record_key, ["uploadId"]) if record_key else None
+    if record is not None and update_id:
+        entry = get_update(table_id, update_id) or {}
+        if entry.get("uploadId", {}).get("S") == upload_id:
+            return record_key, entry["s3Key"]["S"], None
+    elif record and record.get("uploadId", {}).get("S") == upload_id:
+        return record_key, record_key["fileKey"]["S"], None
+    return None, None, build_response(404, {"error": "Upload not found"})
+
+
+# ---------------------------------------------------------------------------
+# Incremental updates
+#
+# /presign with the tableId of an existing dataset uploads an update CSV
+# instead of a new table: its rows are appended, or merged on mergeKeys
+# (update matching rows, insert the rest), as a new version of the same
+# table, which stays shared under the same name. Each update is tracked as
+# an item of its own (records.put_update).
+# ---------------------------------------------------------------------------
+UPDATE_MODES = ("append", "merge")
+
+
+def validate_update(body: dict) -> str:
+    """Check the update fields of a /presign body; return an error or ""."""
+    mode = body.get("writeMode", "append")
+    if mode not in UPDATE_MODES:
+        return f"writeMode must be one of {', '.join(UPDATE_MODES)}"
+    keys = body.get("mergeKeys")
+    if mode == "merge":
+        if not isinstance(keys, list) or not keys:
+            return "merge needs mergeKeys, a list of key columns"
+        if not all(isinstance(k, str) and k for k in keys):
+            return "mergeKeys must list column names"
+    elif keys is not None:
+        return "mergeKeys only applies to writeMode merge"
+    if body.get("schema") is not None or body.get("writeOptions") is not None:
+        return "updates use the table's schema and writeOptions"
+    return ""
+
+
+# ---------------------------------------------------------------------------
+# Notebook snippets
+#
+# The snippet saved by /share loads the whole table. With fromVersion,
+# /snippet instead reads the table's change data feed from that version on
+# (shared with history, see sharing.py), so refresh jobs only move the rows
+# that changed.
+# ---------------------------------------------------------------------------
+def sharing_profile() -> dict:
+    return {
+        "shareCredentialsVersion": 1,
+        "endpoint": DELTA_SERVER_URL,
+        "bearerToken": "",
+    }
+
+
+def notebook_snippet(table_id: str, from_version: int = None) -> str:
+    table_url = f"share_creds.json#{SHARE_NAME}.default.{table_id}"
+    if from_version is None:
+        load = f"df = delta_sharing.load_as_pandas('{table_url}')\ndf.head()\n"
+    else:
+        load = (
+            "# one row per change: _change_type is insert, update_preimage,\n"
+            "# update_postimage or delete; _commit_version is where it happened\n"
+            "changes = delta_sharing.load_table_changes_as_pandas(\n"
+            f"    '{table_url}', starting_version={from_version}\n"
+            ")\n"
+            "# next refresh: fromVersion = changes['_commit_version'].max() + 1\n"
+            "changes.head()\n"
+        )
+    return (
+        "!pip install delta-sharing\n"
+        "import json\n\n"
+        "profile = " + json.dumps(sharing_profile(), indent=2) + "\n\n"
+        "with open('share_creds.json','w') as f:\n"
+        "    json.dump(profile,f)\n\n"
+        "import delta_sharing\n\n" + load
+    )
+
+
+# ---------------------------------------------------------------------------
+# Share batches
+#
+# /share and /unshare take a "tableId" or a list of "tableIds". Every table
+# in a request changes at one manifest version with one reload; each
+# record's status (and snippet) is written in the same transaction as its
+# manifest entry (sharing.apply_manifest_changes).
+# ---------------------------------------------------------------------------
+MAX_SHARE_BATCH = 100
+
+
+def requested_table_ids(body: dict):
+    """(tableIds, error) from a /share or /unshare body, duplicates dropped."""
+    if "tableIds" in body:
+        table_ids = body["tableIds"]
+        if not isinstance(table_ids, list) or not table_ids:
+            return None, "tableIds must be a non-empty list"
+        if not all(isinstance(t, str) and t for t in table_ids):
+            return None, "tableIds must list tableId strings"
+        if len(table_ids) > MAX_SHARE_BATCH:
+            return None, f"At most {MAX_SHARE_BATCH} tableIds per request"
+        return list(dict.fromkeys(table_ids)), ""
+    if not body.get("tableId"):
+        return None, "Missing tableId"
+    return [body["tableId"]], ""
+
+
+def change_shares(table_ids, op: str):
+    """
+    Share (op "add") or unshare ("remove") tables in one batch. Returns
+    (per-table results, manifest), manifest being None if no table was
+    found. A table a concurrent change overtook is reported "conflicted"
+    and left as it was.
+    """
+    results, changes, record_updates = [], [], {}
+    for table_id in table_ids:
+        record_key = find_dataset_key(table_id)
+        if not record_key:
+            results.append({"tableId": table_id, "error": "Dataset record not found"})
+            continue
+        if op == "add":
+            snippet_text = notebook_snippet(table_id)
+            values = {
+                "status": {"S": "shared"},
+                "notebookSnippet": {"S": snippet_text},
+            }
+            results.append(
+                {
+                    "tableId": table_id,
+                    "status": "shared",
+                    "snippet": {
+                        "tableUrl": f"share://{SHARE_NAME}.default.{table_id}",
+                        "notebookSnippet": snippet_text,
+                    },
+                }
+            )
+        else:
+            values = {"status": {"S": "converted"}}
+            results.append({"tableId": table_id, "status": "converted"})
+        changes.append((table_id, op))
+        record_updates[table_id] = dataset_update(record_key, values)
+
+    manifest = None
+    if changes:
+        manifest = apply_manifest_changes(changes, record_updates)
+        results = [
+            (
+                {
+                    "tableId": r["tableId"],
+                    "status": "conflicted",
+                    "error": "A newer share/unshare of this table took precedence",
+                }
+                if r["tableId"] in manifest["conflicted"]
+                else r
+            )
+            for r in results
+        ]
+    return results, manifest
+
+
+# ---------------------------------------------------------------------------
+# Lambda entrypoint (API function)
+# ---------------------------------------------------------------------------
+def main(event, context):
+    with traced(event_operation(event)) as trace:
+        response = route(event, context)
+        trace.set(statusCode=response.get("statusCode"))
+        return response
+
+
+def route(event, context):
+    # Operator action: rebuild share.yaml from every shared record
+    if event.get("action") == "rebuild-share":
+        return {"statusCode": 200, "commandId": share_table()}
+
+    # HTTP routes
+    http = event.get("requestContext", {}).get("http", {})
+    method, path = http.get("method"), http.get("path")
+
+    # POST /presign
+    if method == "POST" and path == "/presign":
+        body = json.loads(event.get("body", "{}") or "{}")
+        user_id = body.get("userId")
+        filename = body.get("filename")
+        if not user_id or not filename:
+            return build_response(400, {"error": "Missing userId or filename"})
+        if not upload_format(filename):
+            return build_response(
+                400,
+                {"error": f"filename must end in one of {', '.join(UPLOAD_FORMATS)}"},
+            )
+        # optional: bytes the client is about to send; large files go multipart
+        try:
+            size = int(body.get("size") or 0)
+        except (TypeError, ValueError):
+            return build_response(400, {"error": "size must be an integer"})
+        if size > MAX_UPLOAD_BYTES:
+            return build_response(
+                400,
+                {
+                    "error": f"File exceeds the {MAX_UPLOAD_BYTES // 1024**3} GiB "
+                    f"upload limit ({MULTIPART_MAX_PARTS} parts of at most 5 GiB)"
+                },
+            )
+        schema = body.get("schema")
+        if schema is not None:
+            error = validate_schema(schema)
+            if error:
+                return build_response(400, {"error": error})
+        write_options = body.get("writeOptions")
+        if write_options is not None:
+            error = validate_write_options(write_options)
+            if error:
+                return build_response(400, {"error": error})
+
+        # update of an existing table
+        if body.get("tableId"):
+            error = validate_update(body)
+            if error:
+                return build_response(400, {"error": error})
+            table_id = body["tableId"]
+            record_key = find_dataset_key(table_id)
+            record = get_dataset(record_key, ["status"]) if record_key else None
+            if not record or record_key["userId"]["S"] != user_id:
+                return build_response(404, {"error": "Dataset not found"})
+            if record["status"]["S"] not in ("converted", "shared"):
+                return build_response(
+                    409, {"error": "Dataset must be converted before it can be updated"}
+                )
+
+            update_id = uuid.uuid4().hex
+            s3_key = f"{UPLOAD_PREFIX}{table_id}/updates/{update_id}/{filename}"
+            entry = {
+                "s3Key": {"S": s3_key},
+                "filename": {"S": filename},
+                "mode": {"S": body.get("writeMode", "append")},
+                "status": {"S": "pending"},
+                "createdAt": {"S": datetime.utcnow().isoformat()},
+            }
+            if body.get("mergeKeys"):
+                entry["mergeKeys"] = {"S": json.dumps(body["mergeKeys"])}
+            put_update(table_id, update_id, entry)
+
+            result = {
+                "tableId": table_id,
+                "updateId": update_id,
+                "s3Key": s3_key,
+                "contentType": content_type(s3_key),
+            }
+            if size >= MULTIPART_THRESHOLD:
+                result.update(presign_multipart(s3_key, size))
+                update_update(
+                    table_id, update_id, {"uploadId": {"S": result["uploadId"]}}
+                )
+            else:
+                result["url"] = presign_put(s3_key)
+            return build_response(200, result)
+
+        table_id = uuid.uuid4().hex
+        s3_key = f"{UPLOAD_PREFIX}{table_id}/raw/{filename}"
+
+        # record pending
+        item = {
+            "userId": {"S": user_id},
+            "fileKey": {"S": s3_key},
+            "tableId": {"S": table_id},
+            "filename": {"S": filename},
+            "status": {"S": "pending"},
+            "createdAt": {"S": datetime.utcnow().isoformat()},
+        }
+        if schema is not None:
+            item["schema"] = {"S": json.dumps(schema)}
+        if write_options is not None:
+            item["writeOptions"] = {"S": json.dumps(write_options)}
+        dynamodb.put_item(TableName=DDB_TABLE, Item=item)
+
+        result = {
+            "tableId": table_id,
+            "s3Key": s3_key,
+            "contentType": content_type(s3_key),
+        }
+        if size >= MULTIPART_THRESHOLD:
+            result.update(presign_multipart(s3_key, size))
+            update_dataset(
+                {"userId": item["userId"], "fileKey": item["fileKey"]},
+                {"uploadId": {"S": result["uploadId"]}},
+            )
+        else:
+            result["url"] = presign_put(s3_key)
+        return build_response(200, result)
+
+    # POST /presign/complete — assemble the parts of a multipart upload
+    if method == "POST" and path == "/presign/complete":
+        body = json.loads(event.get("body", "{}") or "{}")
+        record_key, s3_key, error = pending_upload(body)
+        if error:
+            return error
+        parts = body.get("parts") or []
+        try:
+            parts = sorted(
+                (
+                    {"PartNumber": int(p["partNumber"]), "ETag": p["etag"]}
+                    for p in parts
+                ),
+                key=lambda p: p["PartNumber"],
+            )
+        except (KeyError, TypeError, ValueError):
+            parts = []
+        if not parts:
+            return build_response(400, {"error": "parts must list partNumber/etag"})
+        try:
+            s3.complete_multipart_upload(
+                Bucket=BUCKET,
+                Key=s3_key,
+                UploadId=body["uploadId"],
+                MultipartUpload={"Parts": parts},
+            )
+        except s3.exceptions.ClientError as e:
+            # e.g. InvalidPart / EntityTooSmall: the client can re-send parts
+            return build_response(
+                400, {"error": e.response["Error"].get("Message", str(e))}
+            )
+        return build_response(200, {"tableId": body["tableId"], "s3Key": s3_key})
+
+    # POST /presign/parts — sign the parts still to send again, once the
+    # URLs from /presign are about to expire
+    if method == "POST" and path == "/presign/parts":
+        body = json.loads(event.get("body", "{}") or "{}")
+        record_key, s3_key, error = pending_upload(body)
+        if error:
+            return error
+        try:
+            numbers = sorted({int(n) for n in body.get("partNumbers") or []})
+        except (TypeError, ValueError):
+            numbers = []
+        if not numbers or numbers[0] < 1 or numbers[-1] > MULTIPART_MAX_PARTS:
+            return build_response(
+                400,
+                {
+                    "error": f"partNumbers must list part numbers 1-{MULTIPART_MAX_PARTS}"
+                },
+            )
+        parts = presign_parts(s3_key, body["uploadId"], numbers)
+        return build_response(200, {"tableId": body["tableId"], "parts": parts})
+
+    # POST /presign/abort — give up on a multipart upload and free its parts
+    if method == "POST" and path == "/presign/abort":
+        body = json.loads(event.get("body", "{}") or "{}")
+        record_key, s3_key, error = pending_upload(body)
+        if error:
+            return error
+        s3.abort_multipart_upload(Bucket=BUCKET, Key=s3_key, UploadId=body["uploadId"])
+        if body.get("updateId"):
+            update_update(
+                body["tableId"], body["updateId"], {"status": {"S": "failed"}}
+            )
+        else:
+            update_dataset(record_key, {"status": {"S": "failed"}})
+        return build_response(200, {"tableId": body["tableId"], "aborted": True})
+
+    # POST /share and POST /unshare — one table, or a batch of them
+    if method == "POST" and path in ("/share", "/unshare"):
+        body = json.loads(event.get("body", "{}") or "{}")
+        table_ids, error = requested_table_ids(body)
+        if error:
+            return build_response(400, {"error": error})
+
+        # mark shared (with the snippet) or back to converted, and add or
+        # drop the tables in the share manifest
+        op = "add" if path == "/share" else "remove"
+        results, manifest = change_shares(table_ids, op)
+        if "tableIds" not in body and "error" in results[0]:
+            # not found, or a concurrent change to the table won
+            return build_response(
+                404 if manifest is None else 409, {"error": results[0]["error"]}
+            )
+
+        response = {}
+        if op == "add":
+            response["profile"] = sharing_profile()
+        if "tableIds" in body:
+            response["results"] = results
+        else:
+            response.update({k: v for k, v in results[0].items() if k != "tableId"})
+        if manifest:
+            response["manifestVersion"] = manifest["manifestVersion"]
+            response["manifestState"] = manifest["state"]
+        return build_response(200, response)
+
+    # POST /maintain — compact/Z-order, vacuum and checkpoint one table in
+    # the conversion function; the metrics land on the record
+    if method == "POST" and path == "/maintain":
+        body = json.loads(event.get("body", "{}") or "{}")
+        table_id = body.get("tableId")
+        if not table_id:
+            return build_response(400, {"error": "Missing tableId"})
+        error = validate_maintenance(body)
+        if error:
+            return build_response(400, {"error": error})
+        if not find_dataset_key(table_id):
+            return build_response(404, {"error": "Dataset not found"})
+        payload = {"action": "maintain", "tableId": table_id, "force": True}
+        for name in ("zOrderBy", "retentionHours"):
+            if body.get(name) is not None:
+                payload[name] = body[name]
+        lambda_client.invoke(
+            FunctionName=CONVERSION_FUNCTION_NAME,
+            InvocationType="Event",
+            Payload=json.dumps(payload),
+        )
+        return build_response(202, {"tableId": table_id, "state": "started"})
+
+    # GET /updates — incremental updates of a table, oldest first
+    if method == "GET" and path == "/updates":
+        table_id = (event.get("queryStringParameters") or {}).get("tableId")
+        if not table_id:
+            return build_response(400, {"error": "Missing tableId"})
+        if not find_dataset_key(table_id):
+            return build_response(404, {"error": "Dataset not found"})
+        updates = []
+        for update_id, entry in list_updates(table_id).items():
+            item = {"updateId": update_id}
+            for name, value in entry.items():
+                if name in ("uploadId", "mergeKeys"):
+                    continue
+                item[name] = int(value["N"]) if "N" in value else value["S"]
+            updates.append(item)
+        updates.sort(key=lambda u: u["createdAt"])
+        return build_response(200, {"tableId": table_id, "updates": updates})
+
+    # GET /maintain — metrics of the table's last maintenance run
+    if method == "GET" and path == "/maintain":
+        table_id = (event.get("queryStringParameters") or {}).get("tableId")
+        if not table_id:
+            return build_response(400, {"error": "Missing tableId"})
+        record_key = find_dataset_key(table_id)
+        record = get_dataset(record_key, ["lastMaintenance"]) if record_key else None
+        if record is None:
+            return build_response(404, {"error": "Dataset not found"})
+        last = record.get("lastMaintenance")
+        return build_response(
+            200,
+            {
+                "tableId": table_id,
+                "lastMaintenance": json.loads(last["S"]) if last else None,
+            },
+        )
+
+    # GET /share/status — has a share/unshare reached the sharing server yet?
+    if method == "GET" and path == "/share/status":
+        params = event.get("queryStringParameters") or {}
+        if params.get("manifestVersion"):
+            try:
+                version = int(params["manifestVersion"])
+            except ValueError:
+                return build_response(400, {"error": "Invalid manifestVersion"})
+        elif params.get("tableId"):
+            entry = dynamodb.get_item(
+                TableName=DDB_TABLE,
+                Key={"userId": {"S": MANIFEST_PK}, "fileKey": {"S": params["tableId"]}},
+            ).get("Item")
+            if not entry:
+                return build_response(404, {"error": "Table not in share manifest"})
+            version = int(entry["version"]["N"])
+        else:
+            return build_response(400, {"error": "Missing tableId or manifestVersion"})
+        return build_response(200, manifest_state(version))
+
+    # GET /snippet — retrieve the saved notebook snippet for a table, or
+    # with fromVersion one that reads only the changes since that version
+    if method == "GET" and path == "/snippet":
+        params = event.get("queryStringParameters") or {}
+        table_id = params.get("tableId")
+        if not table_id:
+            return build_response(400, {"error": "Missing tableId"})
+        from_version = params.get("fromVersion")
+        if from_version is not None:
+            if not from_version.isdigit():
+                return build_response(
+                    400, {"error": "fromVersion must be a table version (0 or more)"}
+                )
+            from_version = int(from_version)
+
+        # find the record through the tableId index, then fetch the snippet
+        record_key = find_dataset_key(table_id)
+        record = get_dataset(record_key, ["notebookSnippet"]) if record_key else None
+        if not record or "notebookSnippet" not in record:
+            return build_response(404, {"error": "Snippet not found"})
+
+        if from_version is None:
+            snippet = record["notebookSnippet"]["S"]
+        else:
+            snippet = notebook_snippet(table_id, from_version)
+        return build_response(
+            200, {"notebookSnippet": snippet, "fromVersion": from_version}
+        )
+
+    # GET /profile — a table's record with its profile (schema, null counts,
+    # min/max, approximate distinct counts) from conversion
+    if method == "GET" and path == "/profile":
+        table_id = (event.get("queryStringParameters") or {}).get("tableId")
+        if not table_id:
+            return build_response(400, {"error": "Missing tableId"})
+        record_key = find_dataset_key(table_id)
+        record = (
+            get_dataset(record_key, ["filename", "status", "createdAt", "profile"])
+            if record_key
+            else None
+        )
+        if record is None:
+            return build_response(404, {"error": "Dataset not found"})
+        profile = record.get("profile")
+        return build_response(
+            200,
+            {
+                "tableId": table_id,
+                "filename": record["filename"]["S"],
+                "status": record["status"]["S"],
+                "createdAt": record.get("createdAt", {}).get("S"),
+                "profile": json.loads(profile["S"]) if profile else None,
+            },
+        )
+
+    # GET /preview — first rows and a sample of a table, saved at conversion
+    if method == "GET" and path == "/preview":
+        table_id = (event.get("queryStringParameters") or {}).get("tableId")
+        if not table_id:
+            return build_response(400, {"error": "Missing tableId"})
+        if not table_id.isalnum():
+            return build_response(404, {"error": "Preview not found"})
+        params = {"Bucket": BUCKET, "Key": f"datasets/{table_id}/preview.json"}
+        etag = (event.get("headers") or {}).get("if-none-match")
+        if etag:
+            params["IfNoneMatch"] = etag
+        try:
+            obj = s3.get_object(**params)
+        except s3.exceptions.NoSuchKey:
+            return build_response(404, {"error": "Preview not found"})
+        except s3.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] != "304":
+                raise
+            return build_response(304, "", {**PREVIEW_CACHE_HEADERS, "ETag": etag})
+        return build_response(
+            200,
+            obj["Body"].read().decode(),
+            {**PREVIEW_CACHE_HEADERS, "ETag": obj["ETag"]},
+        )
+
+    # GET /datasets
+    if method == "GET" and path == "/datasets":
+        params = event.get("queryStringParameters") or {}
+        user_id = params.get("userId")
+        if not user_id:
+            return build_response(400, {"error": "Missing userId"})
+        try:
+            limit = int(params.get("limit") or DATASETS_PAGE_SIZE)
+        except ValueError:
+            return build_response(400, {"error": "limit must be an integer"})
+        limit = max(1, min(limit, DATASETS_MAX_PAGE_SIZE))
+
+        query = {
+            "TableName": DDB_TABLE,
+            "KeyConditionExpression": "userId = :u",
+            "ExpressionAttributeValues": {":u": {"S": user_id}},
+            # only what the listing shows; notebookSnippet stays behind
+            "ProjectionExpression": (
+                "tableId, filename, #s, attempts, lastError, rowCount, sizeBytes"
+            ),
+            "ExpressionAttributeNames": {"#s": "status"},
+            "Limit": limit,
+        }
+        if params.get("nextToken"):
+            start_key = decode_page_token(params["nextToken"])
+            if not start_key or start_key.get("userId") != {"S": user_id}:
+                return build_response(400, {"error": "Invalid nextToken"})
+            query["ExclusiveStartKey"] = start_key
+
+        resp = dynamodb.query(**query)
+        items = []
+        for i in resp.get("Items", []):
+            item = {
+                "tableId": i["tableId"]["S"],
+                "filename": i["filename"]["S"],
+                "status": i["status"]["S"],
+            }
+            # conversion retries ("retrying"/"failed")
+            if "attempts" in i:
+                item["attempts"] = int(i["attempts"]["N"])
+            if "lastError" in i:
+                item["lastError"] = i["lastError"]["S"]
+            # profile counts, once converted
+            for name in ("rowCount", "sizeBytes"):
+                if name in i:
+                    item[name] = int(i[name]["N"])
+            items.append(item)
+        result = {"datasets": items}
+        if "LastEvaluatedKey" in resp:
+            result["nextToken"] = encode_page_token(resp["LastEvaluatedKey"])
+        return build_response(200, result)
+
+    return build_response(404, {"error": "Route not found"})
@@ -0,0 +1,88 @@
+"""
+Configuration, AWS clients and response helpers shared by the API and
+conversion functions.
+"""
+
+import json
+import os
+import threading
+
+import boto3
+
+from metrics import instrument_client
+from settings import UPLOAD_FORMATS, UPLOAD_PREFIX
+
+# ---------------------------------------------------------------------------
+# Environment and clients
+# ---------------------------------------------------------------------------
+BUCKET = os.environ["BUCKET_NAME"]
+DDB_TABLE = os.environ["DDB_TABLE_NAME"]
+ALLOWED_ORIGIN = os.environ.get("ALLOWED_ORIGIN", "http://localhost:3000")
+DELTA_INSTANCE_ID = os.environ["DELTA_INSTANCE_ID"]
+DELTA_SERVER_URL = os.environ["DELTA_SERVER_URL"]
+# conversion function, for work the API function hands off (maintenance)
+CONVERSION_FUNCTION_NAME = os.environ.get("CONVERSION_FUNCTION_NAME", "")
+# GSIs created alongside the table in infra/storage.py (keys only)
+TABLE_ID_INDEX = os.environ.get("DDB_TABLE_ID_INDEX", "tableId-index")
+FILE_KEY_INDEX = os.environ.get("DDB_FILE_KEY_INDEX", "fileKey-index")
+
+
+class LazyClient:
+    """
+    A boto3 client created on first use.
+
+    Building a client loads its service model, which is a large share of a
+    cold start; this way each function only pays for the services a request
+    actually touches.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, service: str):
+        self._service = service
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            # the default boto3 session isn't safe to share across threads
+            # while creating clients
+            with self._lock:
+                if self._client is None:
+                    self._client = instrument_client(boto3.client(self._service))
+        return getattr(self._client, name)
+
+
+s3 = LazyClient("s3")
+dynamodb = LazyClient("dynamodb")
+ssm = LazyClient("ssm")
+lambda_client = LazyClient("lambda")
+
+
+# ---------------------------------------------------------------------------
+# Upload formats (UPLOAD_FORMATS and UPLOAD_PREFIX live in settings.py,
+# which infra/ reads too)
+# ---------------------------------------------------------------------------
+def upload_format(filename: str):
+    """The UPLOAD_FORMATS suffix `filename` ends with, or None."""
+    name = filename.lower()
+    for suffix in sorted(UPLOAD_FORMATS, key=len, reverse=True):
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Helper: standard HTTP response
+# ---------------------------------------------------------------------------
+def build_response(status_code: int, body, headers: dict = None):
+    """`body` is serialized unless it is already a JSON string."""
+    return {
+        "statusCode": status_code,
+        "headers": {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": ALLOWED_ORIGIN,
+            "Access-Control-Allow-Headers": "Content-Type",
+            **(headers or {}),
+        },
+        "body": body if isinstance(body, str) else json.dumps(body),
+    }
@@ -0,0 +1,1630 @@
+"""
+CSV → Delta conversion. Only the conversion function imports this module;
+it pulls in pyarrow/deltalake (lazily) and is kept out of the API package.
+"""
+
+import io
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import defaultdict
+from datetime import date, datetime
+
+from common import BUCKET, s3, upload_format
+from metrics import set_properties, stage
+from records import (
+    claim_conversion,
+    complete_conversion,
+    find_dataset_key,
+    find_dataset_key_by_file,
+    get_dataset,
+    get_update,
+    release_conversion,
+    settle_dataset_status,
+    update_dataset,
+    update_update,
+)
+
+# ---------------------------------------------------------------------------
+# Conversion settings
+# ---------------------------------------------------------------------------
+# "streaming" reads the upload from S3 in record batches so peak memory is
+# bounded by the block size, not the file size; "arrow" parses the whole
+# object with the multithreaded Arrow reader, which is fastest when it fits
+# in memory; "parallel" fetches, parses and encodes line-aligned ranges of
+# the object concurrently (see write_csv_ranges) and falls back to
+# streaming where it can't; "pandas" is the original read_csv path, kept
+# for comparison. "auto" picks arrow up to ARROW_MAX_BYTES and parallel
+# above it.
+CONVERSION_MODE = os.environ.get("CONVERSION_MODE", "auto")
+ARROW_MAX_BYTES = int(os.environ.get("ARROW_MAX_BYTES", str(128 * 1024 * 1024)))
+# Column types are inferred once from this many leading bytes and then
+# pinned for the whole file, so later blocks can't disagree with the first.
+SCHEMA_SAMPLE_BYTES = int(os.environ.get("SCHEMA_SAMPLE_BYTES", str(1024 * 1024)))
+# Blocks above glibc's mmap threshold end up fragmenting the heap and RSS
+# creeps with file size, so keep this modest.
+STREAM_BLOCK_SIZE = int(os.environ.get("STREAM_BLOCK_SIZE", str(4 * 1024 * 1024)))
+# "direct" commits the Delta table in place on S3; "staged" writes it under
+# /tmp first and uploads the files with UPLOAD_WORKERS threads (arrow,
+# pandas and streaming modes; the others always write directly).
+DELTA_WRITE_MODE = os.environ.get("DELTA_WRITE_MODE", "direct")
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "16"))
+# Memory one upload's conversion may take; the batch handler runs as many
+# conversions at once as fit the function's memory.
+CONVERSION_MEMORY_MB = int(os.environ.get("CONVERSION_MEMORY_MB", "512"))
+
+# ---------------------------------------------------------------------------
+# Parquet layout
+#
+# Per-dataset writeOptions from /presign (validated in api_handler) win;
+# the rest is picked from the upload size. Consumers pay for bytes
+# downloaded, so the default codec is zstd rather than delta-rs' snappy.
+# Large uploads get bigger target files to keep the file count, and the
+# Delta log, in check.
+# ---------------------------------------------------------------------------
+DEFAULT_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")
+LARGE_UPLOAD_BYTES = 1024**3
+SMALL_TARGET_FILE_MB = 32
+LARGE_TARGET_FILE_MB = 128
+
+
+def resolve_write_options(options: dict = None, size: int = 0) -> dict:
+    resolved = {
+        "compression": DEFAULT_COMPRESSION,
+        "dictionary": True,
+        "targetFileMb": (
+            SMALL_TARGET_FILE_MB if size < LARGE_UPLOAD_BYTES else LARGE_TARGET_FILE_MB
+        ),
+        "partitionBy": [],
+    }
+    resolved.update(options or {})
+    return resolved
+
+
+def writer_properties(options: dict):
+    """Parquet WriterProperties for resolved write options."""
+    from deltalake import ColumnProperties, WriterProperties
+
+    codec = options["compression"].upper()
+    return WriterProperties(
+        compression=codec,
+        # snappy/lz4/uncompressed take no level
+        compression_level=(
+            options.get("compressionLevel") if codec in ("ZSTD", "GZIP") else None
+        ),
+        max_row_group_size=options.get("rowGroupRows"),
+        default_column_properties=ColumnProperties(
+            dictionary_enabled=options["dictionary"]
+        ),
+    )
+
+
+def delta_write_kwargs(options: dict, columns) -> dict:
+    """write_deltalake() arguments for resolved write options."""
+    missing = [c for c in options["partitionBy"] if c not in columns]
+    if missing:
+        raise ValueError(f"partitionBy columns not in the CSV: {', '.join(missing)}")
+
+    return {
+        "writer_properties": writer_properties(options),
+        "target_file_size": options["targetFileMb"] * 1024**2,
+        "partition_by": options["partitionBy"] or None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Table properties
+#
+# Set on every converted table. The change data feed makes merges also write
+# row-level changes under _change_data/, so a consumer can read only what
+# changed since a version (delta_sharing.load_table_changes_as_pandas)
+# instead of downloading the whole table again.
+# ---------------------------------------------------------------------------
+TABLE_CONFIGURATION = {"delta.enableChangeDataFeed": "true"}
+
+
+def ensure_table_configuration(dt):
+    """Bring a table converted before a property was introduced up to date."""
+    current = dt.metadata().configuration
+    missing = {k: v for k, v in TABLE_CONFIGURATION.items() if current.get(k) != v}
+    if missing:
+        dt.alter.set_table_properties(missing)
+
+
+def delta_table_uri(table_id: str) -> str:
+    return f"s3://{BUCKET}/datasets/{table_id}/delta"
+
+
+def existing_table(table_id: str):
+    """The table's DeltaTable, or None if nothing was committed yet."""
+    from deltalake import DeltaTable
+    from deltalake.exceptions import TableNotFoundError
+
+    try:
+        return DeltaTable(
+            delta_table_uri(table_id), storage_options=delta_storage_options()
+        )
+    except TableNotFoundError:
+        return None
+
+
+def delta_storage_options() -> dict:
+    """
+    Storage options for deltalake's S3 backend.
+
+    Credentials come from the Lambda environment. Commits rely on S3
+    conditional writes, so no external lock table is needed.
+    """
+    options = {"AWS_REGION": os.environ.get("AWS_REGION", "us-east-1")}
+    endpoint = os.environ.get("AWS_ENDPOINT_URL")
+    if endpoint:
+        # local S3 stand-ins
+        options["AWS_ENDPOINT_URL"] = endpoint
+        options["AWS_ALLOW_HTTP"] = "true"
+    return options
+
+
+def upload_directory(
+    local_dir: str, bucket: str, prefix: str, workers: int = UPLOAD_WORKERS
+):
+    """
+    Upload a staged Delta table concurrently.
+
+    Data files go first and the _delta_log last, so a reader never sees a
+    commit that references a Parquet file that isn't there yet.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    data_files, log_files = [], []
+    for root, _, files in os.walk(local_dir):
+        for fname in files:
+            full = os.path.join(root, fname)
+            rel = os.path.relpath(full, local_dir)
+            target = log_files if rel.startswith("_delta_log") else data_files
+            target.append((full, f"{prefix}/{rel}"))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in (data_files, sorted(log_files)):
+            # list() re-raises the first failed upload
+            list(pool.map(lambda f: s3.upload_file(f[0], bucket, f[1]), batch))
+
+
+def resolve_conversion_mode(size: int) -> str:
+    if CONVERSION_MODE != "auto":
+        return CONVERSION_MODE
+    return "arrow" if size <= ARROW_MAX_BYTES else "parallel"
+
+
+def get_s3_object(bucket: str, key: str, etag: str = None, **kwargs) -> dict:
+    """get_object, pinned to one version of the object when `etag` is given."""
+    if etag:
+        kwargs["IfMatch"] = f'"{etag}"'
+    return s3.get_object(Bucket=bucket, Key=key, **kwargs)
+
+
+def read_s3_sample(bucket: str, key: str, etag: str = None, lines: bool = True):
+    """
+    Fetch the first SCHEMA_SAMPLE_BYTES of an object.
+
+    Returns (sample, total_size). With `lines` (text uploads; compressed
+    bytes are cut after decompressing) the sample is cut back to the last
+    full line unless it already covers the whole object.
+    """
+    resp = get_s3_object(bucket, key, etag, Range=f"bytes=0-{SCHEMA_SAMPLE_BYTES - 1}")
+    sample = resp["Body"].read()
+    # "bytes 0-1048575/52428800"
+    total = int(resp.get("ContentRange", f"/{len(sample)}").rsplit("/", 1)[1])
+    if lines and total > len(sample):
+        sample = sample[: sample.rfind(b"\n") + 1]
+    return sample, total
+
+
+def infer_csv_schema(sample: bytes, overrides: dict = None):
+    """
+    Infer an Arrow schema from a CSV sample, then apply user overrides.
+
+    Columns that are empty in the sample become strings rather than the
+    null type, which would reject every later value. Returns None when the
+    sample can't be parsed on its own (e.g. a quoted field spans the cut),
+    leaving inference to the reader.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    try:
+        inferred = pv.read_csv(io.BytesIO(sample)).schema
+    except pa.ArrowInvalid:
+        return None
+    return _with_overrides(inferred, overrides)
+
+
+def _with_overrides(inferred, overrides: dict = None):
+    """`inferred` with the user's column types, and strings for null columns."""
+    import pyarrow as pa
+
+    overrides = overrides or {}
+    fields = []
+    for field in inferred:
+        if field.name in overrides:
+            field = field.with_type(pa.type_for_alias(overrides[field.name]))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def csv_options(schema, use_threads: bool, block_size: int = None):
+    import pyarrow.csv as pv
+
+    read_options = pv.ReadOptions(use_threads=use_threads)
+    if block_size:
+        read_options.block_size = block_size
+    convert_options = pv.ConvertOptions(
+        column_types={f.name: f.type for f in schema} if schema else None
+    )
+    return {"read_options": read_options, "convert_options": convert_options}
+
+
+def open_csv_stream(source, schema=None):
+    """
+    Open a CSV stream as an Arrow record batch reader.
+
+    Only one block of STREAM_BLOCK_SIZE bytes (plus the batch parsed from
+    it) is held at once, whatever the size of the source.
+    """
+    import pyarrow.csv as pv
+
+    return pv.open_csv(
+        source, **csv_options(schema, use_threads=True, block_size=STREAM_BLOCK_SIZE)
+    )
+
+
+def read_csv_table(source, schema=None):
+    """
+    Parse a whole CSV into an Arrow table, blocks decoded in parallel.
+    """
+    import pyarrow.csv as pv
+
+    return pv.read_csv(source, **csv_options(schema, use_threads=True))
+
+
+def read_csv_pandas(source):
+    import pandas as pd
+
+    return pd.read_csv(source)
+
+
+def data_columns(data) -> list:
+    """Column names of an Arrow table/reader or a pandas frame."""
+    if hasattr(data, "schema"):
+        return data.schema.names
+    return list(data.columns)
+
+
+# ---------------------------------------------------------------------------
+# Other upload formats (see UPLOAD_FORMATS in settings.py)
+#
+# Compressed CSV is decompressed as it streams; JSON Lines streams through
+# Arrow's JSON reader with the schema of its first SCHEMA_SAMPLE_BYTES (a
+# field first seen later fails the conversion, as a mistyped CSV value
+# does). Parquet is read by row group with ranged GETs, never parsed as
+# text, and when no layout was asked for its file is committed to Delta as
+# it is (convert_object).
+# ---------------------------------------------------------------------------
+CSV_CODECS = {".csv.gz": "gzip", ".csv.zst": "zstd"}
+DECOMPRESS_READ_BYTES = 16 * 1024
+
+
+class S3ObjectFile(io.RawIOBase):
+    """A seekable read-only file over one S3 object version, via ranged GETs."""
+
+    def __init__(self, bucket: str, key: str, etag: str = None, size: int = None):
+        self._bucket, self._key, self._etag = bucket, key, etag
+        if size is None:
+            size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}
+        self._pos = base[whence] + offset
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        end = min(self._pos + len(buffer), self.size)
+        if end <= self._pos:
+            return 0
+        body = get_s3_object(
+            self._bucket, self._key, self._etag, Range=f"bytes={self._pos}-{end - 1}"
+        )["Body"].read()
+        buffer[: len(body)] = body
+        self._pos += len(body)
+        return len(body)
+
+
+def decompress_sample(sample: bytes, codec: str) -> bytes:
+    """
+    Decompress the start of a compressed upload, cut to its last full line.
+
+    The sample usually stops mid-stream, which fails the read that gets
+    there; the small reads keep nearly everything decompressed before it
+    (zstd only ever gives out whole blocks of up to 128 KB).
+    """
+    import pyarrow as pa
+
+    stream = pa.CompressedInputStream(pa.BufferReader(sample), codec)
+    chunks, total = [], 0
+    try:
+        while total < SCHEMA_SAMPLE_BYTES:
+            chunk = stream.read(DECOMPRESS_READ_BYTES)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+            total += len(chunk)
+    except OSError:
+        pass  # the sample ends mid-stream
+    data = b"".join(chunks)
+    return data[: data.rfind(b"\n") + 1]
+
+
+def infer_json_schema(sample: bytes, overrides: dict = None):
+    """infer_csv_schema for JSON Lines."""
+    import pyarrow.json as pj
+
+    return _with_overrides(pj.read_json(io.BytesIO(sample)).schema, overrides)
+
+
+def upload_schema(fmt: str, sample: bytes, overrides: dict = None):
+    """Schema of a CSV/JSON Lines upload from its first bytes."""
+    if fmt == ".jsonl":
+        return infer_json_schema(sample, overrides)
+    if fmt in CSV_CODECS:
+        sample = decompress_sample(sample, CSV_CODECS[fmt])
+    return infer_csv_schema(sample, overrides)
+
+
+def open_upload_stream(bucket: str, key: str, etag: str, fmt: str, schema=None):
+    """
+    A record batch reader over an upload in any format, parsed with
+    `schema` (for Parquet: cast to it) when one is given.
+    """
+    import pyarrow as pa
+
+    if fmt == ".parquet":
+        import pyarrow.parquet as pq
+
+        source = pq.ParquetFile(S3ObjectFile(bucket, key, etag), pre_buffer=True)
+        batches = source.iter_batches()
+        if schema is None:
+            return pa.RecordBatchReader.from_batches(source.schema_arrow, batches)
+        return pa.RecordBatchReader.from_batches(
+            schema, (b.select(schema.names).cast(schema) for b in batches)
+        )
+
+    body = get_s3_object(bucket, key, etag)["Body"]
+    if fmt == ".jsonl":
+        import pyarrow.json as pj
+
+        return pj.open_json(
+            body,
+            read_options=pj.ReadOptions(block_size=STREAM_BLOCK_SIZE),
+            parse_options=pj.ParseOptions(
+                explicit_schema=schema, unexpected_field_behavior="error"
+            ),
+        )
+    if fmt in CSV_CODECS:
+        body = pa.CompressedInputStream(pa.PythonFile(body, mode="r"), CSV_CODECS[fmt])
+    return open_csv_stream(body, schema)
+
+
+def delta_native(type_) -> bool:
+    """Whether Parquet data of this Arrow type is valid in Delta as stored."""
+    import pyarrow as pa
+
+    t = pa.types
+    if t.is_timestamp(type_):
+        return type_.unit == "us"
+    if t.is_list(type_) or t.is_large_list(type_):
+        return delta_native(type_.value_type)
+    if t.is_map(type_):
+        return delta_native(type_.key_type) and delta_native(type_.item_type)
+    if t.is_struct(type_):
+        return all(delta_native(f.type) for f in type_)
+    return (
+        t.is_boolean(type_)
+        or t.is_signed_integer(type_)
+        or (t.is_floating(type_) and not t.is_float16(type_))
+        or t.is_decimal128(type_)
+        or t.is_date32(type_)
+        or t.is_string(type_)
+        or t.is_large_string(type_)
+        or t.is_binary(type_)
+        or t.is_large_binary(type_)
+    )
+
+
+def _stats_value(value):
+    """A Parquet min/max as Delta file statistics hold it; None to leave out."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, str)):
+        return value
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return value.isoformat()
+    # floats (NaN), timestamps and decimals: no bounds rather than wrong ones
+    return None
+
+
+def parquet_file_stats(metadata) -> str:
+    """
+    Delta statistics for a Parquet file, from its footer: the row count,
+    null counts of top-level columns and min/max where they carry over
+    exactly.
+    """
+    names = set(metadata.schema.to_arrow_schema().names)
+    nulls, low, high = {}, {}, {}
+    for g in range(metadata.num_row_groups):
+        group = metadata.row_group(g)
+        for c in range(group.num_columns):
+            chunk = group.column(c)
+            name, stats = chunk.path_in_schema, chunk.statistics
+            if name not in names:
+                continue  # a nested column
+            if stats is None or not stats.has_null_count:
+                nulls[name] = None
+            elif nulls.get(name, 0) is not None:
+                nulls[name] = nulls.get(name, 0) + stats.null_count
+            bounds = (None, None)
+            if stats is not None and stats.has_min_max:
+                bounds = (_stats_value(stats.min), _stats_value(stats.max))
+            if None in bounds or low.get(name, bounds[0]) is None:
+                low[name] = high[name] = None
+                continue
+            low[name] = min(low.get(name, bounds[0]), bounds[0])
+            high[name] = max(high.get(name, bounds[1]), bounds[1])
+    return json.dumps(
+        {
+            "numRecords": metadata.num_rows,
+            "nullCount": {k: v for k, v in nulls.items() if v is not None},
+            "minValues": {k: v for k, v in low.items() if v is not None},
+            "maxValues": {k: v for k, v in high.items() if v is not None},
+        }
+    )
+
+
+def commit_data_files(table_id: str, schema, files, attempt: str):
+    """
+    Commit Parquet files already in the table directory, [(name, size,
+    stats)], as the table's whole content: a new table, or an overwrite
+    that removes the current version's files. The commit carries
+    `attempt` as an app transaction, see committed().
+    """
+    import time
+
+    from deltalake import CommitProperties, Schema, Transaction
+    from deltalake.transaction import AddAction, create_table_with_add_actions
+
+    now = int(time.time() * 1000)
+    adds = [AddAction(name, size, {}, now, True, stats) for name, size, stats in files]
+    commit = CommitProperties(app_transactions=[Transaction(attempt, 1)])
+    schema = Schema.from_arrow(schema)
+    dt = existing_table(table_id)
+    if dt is not None:
+        dt.create_write_transaction(adds, "overwrite", schema, commit_properties=commit)
+    else:
+        create_table_with_add_actions(
+            delta_table_uri(table_id),
+            schema,
+            adds,
+            configuration=TABLE_CONFIGURATION,
+            storage_options=delta_storage_options(),
+            commit_properties=commit,
+        )
+
+
+def committed(table_id: str, attempt: str) -> bool:
+    """Whether commit_data_files landed for `attempt`, e.g. before a timeout."""
+    dt = existing_table(table_id)
+    return dt is not None and dt.transaction_version(attempt) is not None
+
+
+def commit_parquet_as_is(bucket: str, key: str, etag: str, size: int, table_id: str):
+    """
+    Make an uploaded Parquet file the table's content without rewriting
+    it: copy it into the table (server side) under a name of its own and
+    commit it, replacing the current version's files on a re-upload. The
+    copy is removed again if the commit doesn't land.
+    """
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_metadata(S3ObjectFile(bucket, key, etag, size))
+    attempt = uuid.uuid4().hex
+    name = f"part-00000-{attempt}.parquet"
+    target = f"datasets/{table_id}/delta/{name}"
+    extra = {"CopySourceIfMatch": f'"{etag}"'} if etag else None
+    s3.copy({"Bucket": bucket, "Key": key}, bucket, target, ExtraArgs=extra)
+    try:
+        commit_data_files(
+            table_id,
+            metadata.schema.to_arrow_schema(),
+            [(name, size, parquet_file_stats(metadata))],
+            attempt,
+        )
+    except BaseException:
+        if not committed(table_id, attempt):
+            s3.delete_object(Bucket=bucket, Key=target)
+        raise
+
+
+# ---------------------------------------------------------------------------
+# Parallel ranged ingestion ("parallel" mode)
+#
+# A large plain CSV is cut into ranges; a range holds the lines that start
+# in it. PARALLEL_WORKERS threads each fetch one range with a ranged GET
+# (reading on to the end of its last line), parse it against the schema
+# from the sample and encode it as its own Parquet file in the table
+# directory, so download, parse and encode all overlap. One commit adds
+# every file (replacing an existing table's, for a re-upload, as the other
+# modes' overwrite does). Only as many ranges as fit one upload's
+# CONVERSION_MEMORY_MB are in flight at once, counting those waiting for
+# the preview/profile pass.
+#
+# Files come out one per range, so a range is sized for the table's
+# targetFileMb: the sample is encoded with the table's Parquet options and
+# a range is the CSV bytes that compress to the target at that ratio. A
+# range is capped so two fit the memory budget; past that files come out
+# smaller than the target (the automatic 128 MB one for a large upload
+# usually is) and scheduled maintenance compacts them to it later, which
+# keeps the download/parse/encode overlap that makes this mode fast. A
+# targetFileMb of its own that doesn't fit, or a partitioned table, goes
+# through "streaming" instead, which rolls files at the exact size.
+#
+# Like Arrow's own block splitting, this assumes no quoted value spans
+# lines. A file where one does fails to parse and goes through "streaming"
+# instead.
+# ---------------------------------------------------------------------------
+# fixed range size in bytes, overriding the one sized from targetFileMb
+PARALLEL_RANGE_BYTES = int(os.environ.get("PARALLEL_RANGE_BYTES", "0"))
+PARALLEL_WORKERS = int(os.environ.get("PARALLEL_WORKERS", "0")) or max(
+    2, os.cpu_count() or 1
+)
+# a range in flight holds its bytes, the parsed table and its Parquet
+# encoding: about this many times its size
+RANGE_MEMORY_FACTOR = 4
+LINE_PROBE_BYTES = 64 * 1024
+PARQUET_CODECS = {"uncompressed": "none"}
+
+
+def parallel_schema(sample: bytes, overrides: dict = None):
+    """
+    The sample's schema with timestamps in microseconds, as Delta stores
+    them; None when the files couldn't be committed as written.
+    """
+    import pyarrow as pa
+
+    schema = infer_csv_schema(sample, overrides)
+    if schema is None:
+        return None
+    schema = pa.schema(
+        (
+            f.with_type(pa.timestamp("us", f.type.tz))
+            if pa.types.is_timestamp(f.type)
+            else f
+        )
+        for f in schema
+    )
+    return schema if all(delta_native(f.type) for f in schema) else None
+
+
+def fetch_lines(bucket: str, key: str, etag: str, start: int, end: int, size: int):
+    """
+    The lines that start in [start, end) of the object, as a buffer (None
+    if no line starts there). A line starts after a newline, so the GET
+    begins one byte early and runs LINE_PROBE_BYTES past `end` to finish
+    the last line, fetching more only for a line longer than that.
+    """
+    import pyarrow as pa
+
+    base = start - 1
+    data = get_s3_object(
+        bucket, key, etag, Range=f"bytes={base}-{min(end + LINE_PROBE_BYTES, size) - 1}"
+    )["Body"].read()
+    first = data.find(b"\n") + 1
+    if not first or base + first >= end:
+        return None
+    last = data.find(b"\n", end - 1 - base)
+    while last < 0 and base + len(data) < size:
+        more = min(base + len(data) + LINE_PROBE_BYTES, size) - 1
+        data += get_s3_object(
+            bucket, key, etag, Range=f"bytes={base + len(data)}-{more}"
+        )["Body"].read()
+        last = data.find(b"\n", end - 1 - base)
+    last = len(data) if last < 0 else last + 1
+    return pa.py_buffer(data).slice(first, last - first)
+
+
+def parquet_write_options(options: dict) -> dict:
+    """pyarrow.parquet.write_table() arguments for resolved write options."""
+    codec = options["compression"]
+    return {
+        "compression": PARQUET_CODECS.get(codec, codec),
+        "compression_level": (
+            options.get("compressionLevel") if codec in ("zstd", "gzip") else None
+        ),
+        "use_dictionary": options["dictionary"],
+        "row_group_size": options.get("rowGroupRows"),
+    }
+
+
+def target_range_bytes(sample: bytes, schema, options: dict) -> int:
+    """
+    CSV bytes whose Parquet file comes to about options["targetFileMb"],
+    going by how the sample compresses with the table's write options.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    table = pv.read_csv(
+        pa.py_buffer(sample),
+        read_options=pv.ReadOptions(column_names=schema.names, skip_rows=1),
+        convert_options=pv.ConvertOptions(
+            column_types={f.name: f.type for f in schema}
+        ),
+    )
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, **parquet_write_options(options))
+    ratio = len(sample) / sink.getvalue().size
+    return int(options["targetFileMb"] * 1024**2 * ratio)
+
+
+def max_range_bytes() -> int:
+    """The largest range of which two fit one upload's memory budget."""
+    return CONVERSION_MEMORY_MB * 1024**2 // (2 * RANGE_MEMORY_FACTOR)
+
+
+def parallel_ranges_in_flight(range_bytes: int) -> int:
+    """Ranges converted at once, within one upload's memory budget."""
+    fits = CONVERSION_MEMORY_MB * 1024**2 // (RANGE_MEMORY_FACTOR * range_bytes)
+    return max(1, min(PARALLEL_WORKERS, fits))
+
+
+def ordered_window(pool, fn, items, window: int):
+    """pool.map with at most `window` calls ahead of the consumer."""
+    from collections import deque
+
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) > window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def write_csv_ranges(
+    bucket: str,
+    key: str,
+    etag: str,
+    size: int,
+    sample: bytes,
+    schema,
+    table_id: str,
+    options: dict,
+    range_bytes: int,
+    observers=(),
+):
+    """
+    Convert a CSV in ranges of `range_bytes` into one Delta commit; each
+    parsed range is handed to the observers' add() in file order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    read_options = pv.ReadOptions(column_names=schema.names, use_threads=False)
+    convert_options = pv.ConvertOptions(column_types={f.name: f.type for f in schema})
+    parquet_options = parquet_write_options(options)
+    # Names are unique per attempt: a retry or a re-upload never touches
+    # files a committed version references. Files of an attempt that died
+    # before committing are left to VACUUM.
+    attempt = uuid.uuid4().hex
+    written = []  # (name, size, stats)
+
+    def convert_range(item):
+        index, start = item
+        end = min(start + range_bytes, size)
+        lines = fetch_lines(bucket, key, etag, start, end, size)
+        if lines is None:
+            return None
+        table = pv.read_csv(
+            lines, read_options=read_options, convert_options=convert_options
+        )
+        if table.num_rows:
+            name = f"part-{index:05d}-{attempt}.parquet"
+            sink = pa.BufferOutputStream()
+            pq.write_table(table, sink, **parquet_options)
+            encoded = sink.getvalue()
+            s3.put_object(
+                Bucket=bucket,
+                Key=f"datasets/{table_id}/delta/{name}",
+                Body=pa.BufferReader(encoded),
+            )
+            stats = parquet_file_stats(pq.read_metadata(pa.BufferReader(encoded)))
+            written.append((name, encoded.size, stats))
+        return table
+
+    header_end = sample.find(b"\n") + 1
+    starts = range(header_end, size, range_bytes)
+    in_flight = parallel_ranges_in_flight(range_bytes)
+    try:
+        with ThreadPoolExecutor(max_workers=in_flight) as pool:
+            # the range the observers are on is in flight too
+            window = ordered_window(
+                pool, convert_range, enumerate(starts), in_flight - 1
+            )
+            for table in window:
+                for observer in observers if table is not None else ():
+                    observer.add(table)
+        commit_data_files(table_id, schema, sorted(written), attempt)
+    except BaseException:
+        if not committed(table_id, attempt):
+            for name, _, _ in written:
+                s3.delete_object(Bucket=bucket, Key=f"datasets/{table_id}/delta/{name}")
+        raise
+    return len(starts)
+
+
+def write_delta(table_uri: str, data, storage_options=None, write_options=None):
+    from deltalake import write_deltalake
+
+    write_options = write_options or resolve_write_options()
+    # A record batch reader is drained batch by batch, rolling Parquet files
+    # as it goes; either way the table lands in a single Delta commit.
+    write_deltalake(
+        table_uri,
+        data,
+        mode="overwrite",
+        storage_options=storage_options,
+        configuration=TABLE_CONFIGURATION,
+        **delta_write_kwargs(write_options, data_columns(data)),
+    )
+
+
+def parse_upload_key(key: str):
+    """
+    (tableId, updateId) for an uploaded object. Initial uploads live at
+    uploads/{tableId}/raw/{filename} (updateId None), incremental ones at
+    uploads/{tableId}/updates/{updateId}/{filename}; before UPLOAD_PREFIX
+    they were under datasets/ the same way.
+    """
+    parts = key.split("/")
+    if len(parts) > 4 and parts[2] == "updates":
+        return parts[1], parts[3]
+    return parts[1], None
+
+
+def is_upload_key(key: str) -> bool:
+    """Whether `key` is an upload, rather than a file of the table itself."""
+    parts = key.split("/")
+    return len(parts) > 3 and (
+        parts[2] == "raw" or (parts[2] == "updates" and len(parts) > 4)
+    )
+
+
+# ---------------------------------------------------------------------------
+# Incremental updates: append or merge an update CSV into an existing table
+#
+# Only the update file is read, parsed with the table's own schema so the
+# types line up, and committed as a new version of the same table; the
+# share entry and snippet keep pointing at it.
+# ---------------------------------------------------------------------------
+# one update per table at a time within an invocation; commits from other
+# invocations are reconciled by Delta's optimistic concurrency (or retried)
+_table_locks = defaultdict(threading.Lock)
+
+
+def merge_predicate(keys) -> str:
+    return " AND ".join(f't."{k}" = s."{k}"' for k in keys)
+
+
+def apply_update(
+    bucket: str, key: str, table_id: str, update_id: str, etag: str = None
+) -> dict:
+    import pyarrow as pa
+    from deltalake import CommitProperties, DeltaTable, Transaction, write_deltalake
+
+    set_properties(tableId=table_id, updateId=update_id)
+    with stage("record"):
+        record_key = find_dataset_key(table_id)
+        if not record_key:
+            raise ValueError(f"Unknown tableId {table_id}")
+        record = get_dataset(record_key, ["writeOptions", "profile"])
+        update = get_update(table_id, update_id)
+    if update is None:
+        raise ValueError(f"Unknown update {update_id} for table {table_id}")
+    mode = update["mode"]["S"]
+    set_properties(writeMode=mode)
+    user_write_options = None
+    if "writeOptions" in record:
+        user_write_options = json.loads(record["writeOptions"]["S"])
+
+    with _table_locks[table_id]:
+        with stage("openTable"):
+            dt = DeltaTable(
+                delta_table_uri(table_id), storage_options=delta_storage_options()
+            )
+        # The commit carries the updateId as a Delta app transaction, so an
+        # update whose commit landed but whose bookkeeping didn't (a crash,
+        # a lost lease) is never applied twice.
+        if dt.transaction_version(update_id) is not None:
+            update_update(table_id, update_id, {"status": {"S": "applied"}})
+            return {"tableId": table_id, "updateId": update_id, "committed": True}
+        commit = CommitProperties(app_transactions=[Transaction(update_id, 1)])
+
+        # changes are only recorded from the version that enables the feed
+        ensure_table_configuration(dt)
+        schema = pa.schema(dt.schema().to_arrow())
+        base_version = dt.version()
+
+        with stage("sample") as s:
+            _, size = read_s3_sample(bucket, key, etag)
+            s.record(bytes=size)
+        fmt = upload_format(key) or ".csv"
+        streaming = fmt != ".csv" or resolve_conversion_mode(size) in (
+            "streaming",
+            "parallel",
+        )
+        set_properties(format=fmt, mode="streaming" if streaming else "arrow")
+        if streaming:
+            data = open_upload_stream(bucket, key, etag, fmt, schema)
+        else:
+            body = get_s3_object(bucket, key, etag)["Body"]
+            with stage("parse") as s:
+                data = read_csv_table(body, schema)
+                s.record(rows=data.num_rows, bytes=size)
+
+        options = resolve_write_options(user_write_options, size)
+        if mode == "merge":
+            keys = json.loads(update["mergeKeys"]["S"])
+            missing = [k for k in keys if k not in schema.names]
+            if missing:
+                raise ValueError(f"mergeKeys not in the table: {', '.join(missing)}")
+            with stage("merge") as s:
+                metrics = (
+                    dt.merge(
+                        source=data,
+                        predicate=merge_predicate(keys),
+                        source_alias="s",
+                        target_alias="t",
+                        writer_properties=writer_properties(options),
+                        commit_properties=commit,
+                    )
+                    .when_matched_update_all()
+                    .when_not_matched_insert_all()
+                    .execute()
+                )
+                rows = {
+                    "rowsInserted": metrics["num_target_rows_inserted"],
+                    "rowsUpdated": metrics["num_target_rows_updated"],
+                }
+                s.record(rows=metrics["num_source_rows"])
+        else:
+            # an append is profiled on top of the stored profile on its way
+            # to the writer
+            sampler = PreviewSampler()
+            profiler = stored_profiler(
+                bucket, table_id, record.get("profile"), base_version, schema
+            )
+            with stage("append") as s:
+                observers = (sampler, profiler) if profiler else (sampler,)
+                write_deltalake(
+                    dt,
+                    observed_batches(data, *observers),
+                    mode="append",
+                    writer_properties=writer_properties(options),
+                    target_file_size=options["targetFileMb"] * 1024**2,
+                    commit_properties=commit,
+                )
+                rows = {"rowsInserted": sampler.rows}
+                s.record(rows=sampler.rows)
+            if dt.version() != base_version + 1:
+                profiler = None  # another commit landed in between
+
+        with stage("profile"):
+            if mode == "merge" or profiler is None:
+                sampler = profiler = None
+            profile = summarize_table(bucket, table_id, dt, sampler, profiler)
+
+        with stage("markApplied"):
+            values = {
+                "status": {"S": "applied"},
+                "version": {"N": str(dt.version())},
+                **{name: {"N": str(count)} for name, count in rows.items()},
+            }
+            update_update(table_id, update_id, values)
+            update_dataset(record_key, profile_values(profile))
+        return {
+            "tableId": table_id,
+            "updateId": update_id,
+            "version": dt.version(),
+            **rows,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Preview: the first rows plus a sample spread over the whole upload, saved
+# next to the table as datasets/<tableId>/preview.json and served as-is by
+# GET /preview, so a look at a table needs no Delta Sharing read.
+#
+# Collected while the batches go by on their way to the writer: every batch
+# is a stratum that contributes a couple of random rows. When too many have
+# piled up, every other stratum is dropped and only every other batch is
+# sampled from then on, so the sample stays even over the file in bounded
+# memory.
+# ---------------------------------------------------------------------------
+PREVIEW_HEAD_ROWS = int(os.environ.get("PREVIEW_HEAD_ROWS", "20"))
+PREVIEW_SAMPLE_ROWS = int(os.environ.get("PREVIEW_SAMPLE_ROWS", "50"))
+PREVIEW_ROWS_PER_BATCH = 2
+
+
+def preview_key(table_id: str) -> str:
+    return f"datasets/{table_id}/preview.json"
+
+
+def _spread(rows: list, n: int) -> list:
+    """n of `rows`, evenly spaced (all of them if there are no more)."""
+    if n <= 0:
+        return []
+    if len(rows) <= n:
+        return rows
+    step = len(rows) / n
+    return [rows[int(i * step)] for i in range(n)]
+
+
+class PreviewSampler:
+    def __init__(self, seed: int = 0):
+        import random
+
+        self._rng = random.Random(seed)
+        self._batches = 0
+        self._stride = 1
+        self.rows = 0
+        self.head = []
+        self.strata = []  # (batch number, rows)
+        self.schema = None
+
+    def add(self, batch):
+        self.schema = batch.schema
+        self.rows += batch.num_rows
+        if len(self.head) < PREVIEW_HEAD_ROWS:
+            self.head += batch.slice(0, PREVIEW_HEAD_ROWS - len(self.head)).to_pylist()
+        number, self._batches = self._batches, self._batches + 1
+        if number % self._stride or not batch.num_rows:
+            return
+        picks = self._rng.sample(
+            range(batch.num_rows), min(PREVIEW_ROWS_PER_BATCH, batch.num_rows)
+        )
+        self.strata.append((number, batch.take(sorted(picks)).to_pylist()))
+        if len(self.strata) * PREVIEW_ROWS_PER_BATCH > 4 * PREVIEW_SAMPLE_ROWS:
+            self._stride *= 2
+            self.strata = [s for s in self.strata if s[0] % self._stride == 0]
+
+    def sample(self) -> list:
+        rows = [row for _, stratum in self.strata for row in stratum]
+        return _spread(rows, PREVIEW_SAMPLE_ROWS)
+
+    def document(self, table_id: str) -> dict:
+        return {
+            "tableId": table_id,
+            "columns": [
+                {"name": field.name, "type": str(field.type)}
+                for field in self.schema or []
+            ],
+            "rowCount": self.rows,
+            "head": self.head,
+            "sample": self.sample(),
+            "createdAt": datetime.utcnow().isoformat(),
+        }
+
+
+def write_preview(bucket: str, table_id: str, document: dict):
+    # dates, timestamps and decimals go out as their string form
+    s3.put_object(
+        Bucket=bucket,
+        Key=preview_key(table_id),
+        Body=json.dumps(document, default=str).encode(),
+        ContentType="application/json",
+    )
+
+
+def read_preview(bucket: str, table_id: str):
+    """The stored preview document, or None if there isn't one."""
+    try:
+        body = s3.get_object(Bucket=bucket, Key=preview_key(table_id))["Body"]
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(body.read())
+
+
+def append_preview(stored: dict, update: dict) -> dict:
+    """
+    The preview after an append: the stored head topped up from the
+    update's, and a sample drawn from both in proportion to their rows.
+    """
+    rows = stored["rowCount"] + update["rowCount"]
+    kept = round(PREVIEW_SAMPLE_ROWS * stored["rowCount"] / rows) if rows else 0
+    # a small update may not have its share of rows to give
+    kept = max(kept, PREVIEW_SAMPLE_ROWS - len(update["sample"]))
+    return {
+        **stored,
+        "rowCount": rows,
+        "head": (stored["head"] + update["head"])[:PREVIEW_HEAD_ROWS],
+        "sample": _spread(stored["sample"], kept)
+        + _spread(update["sample"], PREVIEW_SAMPLE_ROWS - kept),
+        "createdAt": update["createdAt"],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Profile: row count, size on disk, schema and per-column null count,
+# min/max and approximate distinct count, stored on the record as JSON and
+# returned by GET /datasets (counts) and GET /profile (everything).
+#
+# Computed with Arrow compute kernels on the same batches the writer gets
+# (or the in-memory table); only a merge reads the table back. Distinct
+# counts come from a K-minimum-values sketch: the PROFILE_SKETCH_SIZE
+# smallest 64-bit hashes of a column's values; exact below that many
+# values, within a few percent above. Columns of other types (structs,
+# lists, binary) get no min/max or sketch and report approxDistinct null.
+# ---------------------------------------------------------------------------
+PROFILE_SKETCH_SIZE = 1024
+PROFILE_MAX_TEXT = 64  # characters of string min/max kept
+# keeps the record well under DynamoDB's 400 KB item limit
+PROFILE_MAX_COLUMNS = 1000
+
+
+def _orderable(type_) -> bool:
+    import pyarrow as pa
+
+    return (
+        pa.types.is_integer(type_)
+        or pa.types.is_floating(type_)
+        or pa.types.is_decimal(type_)
+        or pa.types.is_temporal(type_)
+        or pa.types.is_string(type_)
+        or pa.types.is_large_string(type_)
+        or pa.types.is_boolean(type_)
+    )
+
+
+def _profile_value(value):
+    if isinstance(value, str):
+        return value[:PROFILE_MAX_TEXT]
+    if isinstance(value, float) and value != value:
+        return None  # NaN isn't JSON
+    return value
+
+
+def _stored_value(value, type_):
+    """A min/max read back from a stored profile, as its column's type."""
+    import pyarrow as pa
+
+    text = pa.types.is_string(type_) or pa.types.is_large_string(type_)
+    if text or not isinstance(value, str):
+        return value
+    # dates, timestamps and decimals were stored in their string form
+    try:
+        return pa.array([value]).cast(type_)[0].as_py()
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as exc:
+        raise ValueError(f"can't read {value!r} back as {type_}") from exc
+
+
+def _merge_sketch(sketch, hashes):
+    """The PROFILE_SKETCH_SIZE smallest distinct values of sketch + hashes."""
+    import numpy as np
+
+    k = PROFILE_SKETCH_SIZE
+    if len(sketch) == k:
+        hashes = hashes[hashes < sketch[-1]]
+    if len(hashes) > 4 * k:
+        # Only small hashes can make it: dedupe those under a cut that
+        # about 4k values pass. If that leaves fewer than k, the cut was
+        # too low (many repeats), so dedupe them all.
+        cut = np.uint64(4 * k / len(hashes) * 2.0**64)
+        merged = np.union1d(sketch, hashes[hashes < cut])
+        if len(merged) >= k:
+            return merged[:k]
+    return np.union1d(sketch, hashes)[:k]
+
+
+class ColumnProfiler:
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}
+
+    def add(self, data):
+        """Fold a record batch or table into the profile."""
+        import numpy as np
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        self.rows += data.num_rows
+        for field, column in zip(data.schema, data.columns):
+            profile = self.columns.setdefault(
+                field.name,
+                {
+                    "type": str(field.type),
+                    "nulls": 0,
+                    "min": None,
+                    "max": None,
+                    "sketch": (
+                        np.empty(0, dtype=np.uint64) if _orderable(field.type) else None
+                    ),
+                },
+            )
+            profile["nulls"] += column.null_count
+            if column.null_count == len(column) or not _orderable(field.type):
+                continue
+            bounds = pc.min_max(column)
+            low, high = bounds["min"].as_py(), bounds["max"].as_py()
+            if low is not None:
+                if profile["min"] is None or low < profile["min"]:
+                    profile["min"] = low
+                if profile["max"] is None or high > profile["max"]:
+                    profile["max"] = high
+
+            # strings repeat a lot and are dear to hash: dedupe them first
+            values = column
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                values = pc.unique(column)
+            values = pc.drop_null(values).to_numpy(zero_copy_only=False)
+            profile["sketch"] = _merge_sketch(
+                profile["sketch"], pd.util.hash_array(values, categorize=False)
+            )
+
+    def distinct(self, sketch):
+        if sketch is None:
+            return None  # a type the sketch doesn't hash
+        if len(sketch) < PROFILE_SKETCH_SIZE:
+            return len(sketch)
+        return round((PROFILE_SKETCH_SIZE - 1) * 2**64 / float(sketch[-1]))
+
+    def restore(self, document: dict, sketches: dict, schema):
+        """
+        Start from a stored profile (document()) and its sketches, so an
+        append only needs its own batches added. Raises ValueError for a
+        column that can't be restored.
+        """
+        stored = {column["name"]: column for column in document["columns"]}
+        self.rows = document["rowCount"]
+        for field in schema:
+            column = stored.get(field.name)
+            hashed = _orderable(field.type)
+            if column is None or (hashed and field.name not in sketches):
+                raise ValueError(f"no stored profile for column {field.name}")
+            self.columns[field.name] = {
+                "type": str(field.type),
+                "nulls": column["nullCount"],
+                "min": _stored_value(column["min"], field.type),
+                "max": _stored_value(column["max"], field.type),
+                "sketch": sketches[field.name] if hashed else None,
+            }
+
+    def document(self, size_bytes: int, version: int) -> dict:
+        columns = list(self.columns.items())
+        return {
+            "rowCount": self.rows,
+            "sizeBytes": size_bytes,
+            "version": version,
+            "columnCount": len(columns),
+            "columns": [
+                {
+                    "name": name,
+                    "type": p["type"],
+                    "nullCount": p["nulls"],
+                    "min": _profile_value(p["min"]),
+                    "max": _profile_value(p["max"]),
+                    "approxDistinct": self.distinct(p["sketch"]),
+                }
+                for name, p in columns[:PROFILE_MAX_COLUMNS]
+            ],
+        }
+
+
+def sketches_key(table_id: str) -> str:
+    return f"datasets/{table_id}/profile-sketches.parquet"
+
+
+def write_sketches(bucket: str, table_id: str, profiler: ColumnProfiler):
+    """Keep the distinct-count sketches, for folding in later appends."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    names = [n for n, p in profiler.columns.items() if p["sketch"] is not None]
+    sketches = pa.table(
+        {
+            "column": pa.array(names, pa.string()),
+            "sketch": pa.array(
+                [profiler.columns[n]["sketch"] for n in names], pa.list_(pa.uint64())
+            ),
+        }
+    )
+    sink = pa.BufferOutputStream()
+    pq.write_table(sketches, sink, compression="none")  # hashes don't compress
+    s3.put_object(
+        Bucket=bucket,
+        Key=sketches_key(table_id),
+        Body=pa.BufferReader(sink.getvalue()),
+    )
+
+
+def read_sketches(bucket: str, table_id: str):
+    """{column: sketch} saved by write_sketches, or None if there are none."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    try:
+        body = s3.get_object(Bucket=bucket, Key=sketches_key(table_id))["Body"]
+    except s3.exceptions.NoSuchKey:
+        return None
+    sketches = pq.read_table(pa.BufferReader(body.read()))
+    return {
+        name: sketch.values.to_numpy()
+        for name, sketch in zip(
+            sketches.column("column").to_pylist(),
+            sketches.column("sketch").combine_chunks(),
+        )
+    }
+
+
+def table_size_bytes(dt) -> int:
+    """Bytes of the Parquet files in the table's current version."""
+    import pyarrow as pa
+
+    return sum(
+        pa.table(dt.get_add_actions(flatten=True)).column("size_bytes").to_pylist()
+    )
+
+
+def table_row_count(dt):
+    """Rows in the table's current version, None if a file has no stats."""
+    import pyarrow as pa
+
+    counts = pa.table(dt.get_add_actions(flatten=True)).column("num_records")
+    return None if counts.null_count else sum(counts.to_pylist())
+
+
+def observed_batches(data, *observers):
+    """Stream `data` (table or reader) past each observer's add()."""
+    import pyarrow as pa
+
+    source = data
+    if isinstance(data, pa.Table):
+        # small enough batches that every part of the table is a stratum
+        source = data.to_batches(max_chunksize=max(1, len(data) // PREVIEW_SAMPLE_ROWS))
+
+    def batches():
+        for batch in source:
+            for observer in observers:
+                observer.add(batch)
+            yield batch
+
+    return pa.RecordBatchReader.from_batches(data.schema, batches())
+
+
+# ---------------------------------------------------------------------------
+# Preview and profile after an update
+#
+# An append is folded into what was stored for the version it lands on:
+# the profile (with its sketches, kept next to the table as
+# profile-sketches.parquet) and the preview. A merge can change any row,
+# so after one the table is read back and both are taken again; so is a
+# table whose stored profile is missing, describes another version or
+# can't be restored.
+# ---------------------------------------------------------------------------
+READ_BACK_BATCH_ROWS = 128 * 1024
+
+
+def stored_profiler(bucket: str, table_id: str, profile, version: int, schema):
+    """
+    A ColumnProfiler holding the stored profile of `version` of the table,
+    or None if there's none to start from.
+    """
+    profile = json.loads(profile["S"]) if profile else None
+    if not profile or profile.get("version") != version:
+        return None
+    sketches = read_sketches(bucket, table_id)
+    if sketches is None:
+        return None
+    profiler = ColumnProfiler()
+    try:
+        profiler.restore(profile, sketches, schema)
+    except ValueError as exc:
+        print(f"Profiling {table_id} from its data instead: {exc}")
+        return None
+    return profiler
+
+
+def summarize_table(bucket: str, table_id: str, dt, sampler=None, profiler=None):
+    """
+    Write the preview and sketches of the table's current version and
+    return its profile. `sampler` and `profiler` have seen an append's
+    batches, the profiler on top of the stored profile; without them the
+    table is read back.
+    """
+    preview = read_preview(bucket, table_id) if profiler else None
+    rows = table_row_count(dt)
+    if preview is None:
+        sampler, profiler = PreviewSampler(), ColumnProfiler()
+        # small enough batches that every part of the table is a stratum
+        chunk = max(1, min(READ_BACK_BATCH_ROWS, (rows or 0) // PREVIEW_SAMPLE_ROWS))
+        for batch in dt.to_pyarrow_dataset().to_batches(batch_size=chunk):
+            sampler.add(batch)
+            profiler.add(batch)
+        document = sampler.document(table_id)
+    else:
+        document = append_preview(preview, sampler.document(table_id))
+    if rows is not None:
+        document["rowCount"] = profiler.rows = rows
+    write_preview(bucket, table_id, document)
+    write_sketches(bucket, table_id, profiler)
+    return profiler.document(table_size_bytes(dt), dt.version())
+
+
+def profile_values(profile: dict) -> dict:
+    """Record attributes for a profile: its counts and the whole document."""
+    return {
+        "rowCount": {"N": str(profile["rowCount"])},
+        "sizeBytes": {"N": str(profile["sizeBytes"])},
+        "profile": {"S": json.dumps(profile, default=str)},
+    }
+
+
+# ---------------------------------------------------------------------------
+# Convert CSV → Delta & mark 'converted'
+#
+# Each step runs in a metrics stage (see metrics.py): record lookup, schema
+# sample, parse (arrow/pandas; streaming parses inside the write), Delta
+# write, staged upload, preview, profile and the status update.
+# ---------------------------------------------------------------------------
+def convert_object(bucket: str, key: str, etag: str = None) -> dict:
+    table_id, update_id = parse_upload_key(key)
+    if update_id:
+        return apply_update(bucket, key, table_id, update_id, etag)
+    set_properties(tableId=table_id)
+
+    with stage("record"):
+        record_key = find_dataset_key_by_file(key)
+        record = (
+            get_dataset(record_key, ["schema", "writeOptions"]) if record_key else None
+        )
+    record = record or {}
+    user_schema = None
+    if "schema" in record:
+        user_schema = json.loads(record["schema"]["S"])
+    user_write_options = None
+    if "writeOptions" in record:
+        user_write_options = json.loads(record["writeOptions"]["S"])
+
+    fmt = upload_format(key) or ".csv"
+    with stage("sample") as s:
+        sample, size = read_s3_sample(
+            bucket, key, etag, lines=fmt in (".csv", ".jsonl")
+        )
+        s.record(bytes=size)
+    write_options = resolve_write_options(user_write_options, size)
+    if fmt == ".csv":
+        mode = resolve_conversion_mode(size)
+    elif fmt == ".parquet" and user_write_options is None:
+        mode = "parquet"  # the upload becomes the table's data file
+    else:
+        mode = "streaming"
+    set_properties(format=fmt, mode=mode)
+    sampler, profiler = PreviewSampler(), ColumnProfiler()
+
+    if mode == "parquet":
+        import pyarrow.parquet as pq
+
+        # types Delta doesn't store that way (nanosecond timestamps, unsigned
+        # ints, ...) are rewritten through Arrow instead
+        stored = pq.read_schema(S3ObjectFile(bucket, key, etag, size))
+        if not all(delta_native(field.type) for field in stored):
+            mode = "streaming"
+            set_properties(mode=mode)
+    if mode == "parquet":
+        with stage("write"):
+            commit_parquet_as_is(bucket, key, etag, size, table_id)
+        with stage("profile") as s:
+            reader = open_upload_stream(bucket, key, etag, fmt)
+            for _ in observed_batches(reader, sampler, profiler):
+                pass
+            s.record(rows=sampler.rows, bytes=size)
+
+    if mode == "parallel":
+        schema = parallel_schema(sample, user_schema)
+        range_bytes = PARALLEL_RANGE_BYTES
+        if schema is not None and not range_bytes:
+            range_bytes = target_range_bytes(sample, schema, write_options)
+            if range_bytes > max_range_bytes():
+                # only "streaming" keeps to a targetFileMb of the table's own
+                own_target = "targetFileMb" in (user_write_options or {})
+                range_bytes = 0 if own_target else max_range_bytes()
+        if schema is None or write_options["partitionBy"] or not range_bytes:
+            mode = "streaming"
+            set_properties(mode=mode)
+    if mode == "parallel":
+        import pyarrow as pa
+
+        try:
+            with stage("write") as s:
+                ranges = write_csv_ranges(
+                    bucket,
+                    key,
+                    etag,
+                    size,
+                    sample,
+                    schema,
+                    table_id,
+                    write_options,
+                    range_bytes,
+                    (sampler, profiler),
+                )
+                s.record(rows=sampler.rows, bytes=size, ranges=ranges)
+        except pa.ArrowInvalid as exc:
+            # most likely a quoted value spanning lines
+            print(f"Streaming {key} instead: {exc}")
+            mode = "streaming"
+            set_properties(mode=mode)
+            sampler, profiler = PreviewSampler(), ColumnProfiler()
+
+    if mode == "streaming":
+        schema = None
+        if fmt != ".parquet":
+            schema = upload_schema(fmt, sample, user_schema)
+        # preview and profile are taken on the way to the writer
+        data = observed_batches(
+            open_upload_stream(bucket, key, etag, fmt, schema), sampler, profiler
+        )
+    elif mode in ("arrow", "pandas"):
+        body = get_s3_object(bucket, key, etag)["Body"]
+        with stage("parse") as s:
+            if mode == "pandas":
+                data = read_csv_pandas(body)
+            else:
+                data = read_csv_table(body, infer_csv_schema(sample, user_schema))
+            s.record(rows=len(data), bytes=size)
+
+    # parquet and parallel conversions put their data files on S3
+    # themselves, so there is nothing to stage
+    staged = DELTA_WRITE_MODE == "staged" and mode in ("arrow", "pandas", "streaming")
+    if DELTA_WRITE_MODE == "staged" and not staged:
+        print(
+            f"DELTA_WRITE_MODE=staged doesn't apply to {mode} mode, "
+            f"wrote {key} directly"
+        )
+    set_properties(deltaWriteMode="staged" if staged else "direct")
+    delta_dir = f"/tmp/{uuid.uuid4().hex}" if staged else None
+    try:
+        if mode in ("arrow", "pandas", "streaming"):
+            with stage("write") as s:
+                if staged:
+                    write_delta(delta_dir, data, write_options=write_options)
+                else:
+                    write_delta(
+                        delta_table_uri(table_id),
+                        data,
+                        delta_storage_options(),
+                        write_options,
+                    )
+                if mode == "streaming":
+                    s.record(rows=sampler.rows, bytes=size)
+        if staged:
+            with stage("upload"):
+                upload_directory(delta_dir, bucket, f"datasets/{table_id}/delta")
+    finally:
+        # warm containers reuse /tmp, so don't leave tables behind
+        if staged:
+            shutil.rmtree(delta_dir, ignore_errors=True)
+
+    if mode in ("arrow", "pandas"):
+        import pyarrow as pa
+
+        if mode == "pandas":
+            data = pa.Table.from_pandas(data, preserve_index=False)
+        with stage("profile"):
+            profiler.add(data)
+        with stage("preview"):
+            # small enough batches that every part of the table is a stratum
+            chunk = max(1, len(data) // PREVIEW_SAMPLE_ROWS)
+            for batch in data.to_batches(max_chunksize=chunk):
+                sampler.add(batch)
+    with stage("preview"):
+        write_preview(bucket, table_id, sampler.document(table_id))
+    with stage("profile"):
+        from deltalake import DeltaTable
+
+        dt = DeltaTable(
+            delta_table_uri(table_id), storage_options=delta_storage_options()
+        )
+        write_sketches(bucket, table_id, profiler)
+        profile = profiler.document(table_size_bytes(dt), dt.version())
+
+    # mark converted, with the profile
+    if record_key:
+        with stage("markConverted"):
+            update_dataset(
+                record_key, {"status": {"S": "converted"}, **profile_values(profile)}
+            )
+    return {"tableId": table_id, "status": "converted"}
+
+
+# ---------------------------------------------------------------------------
+# Idempotent conversion
+#
+# S3 delivers events at least once, the queue redelivers after a lost ack,
+# and /process can be called again for an object already converted. Each
+# object version (key + ETag) is claimed with a conditional write first:
+# - done already: return the stored result without reading the CSV;
+# - converting elsewhere: return too, the holder finishes it (and if it
+#   dies, its own delivery is retried once the lease runs out);
+# - a failed conversion releases its claim so a retry can take it.
+# The lease must outlast a conversion, which the function's timeout cuts off
+# (CONVERSION_TIMEOUT_SECONDS from settings.py, set by infra/compute.py;
+# Lambda's 15-minute maximum otherwise), plus a little for clock skew. Any
+# longer and a crashed invocation holds up redeliveries for nothing.
+# ---------------------------------------------------------------------------
+CONVERSION_TIMEOUT_SECONDS = int(os.environ.get("CONVERSION_TIMEOUT_SECONDS", "900"))
+CONVERSION_LEASE_SECONDS = int(
+    os.environ.get("CONVERSION_LEASE_SECONDS", str(CONVERSION_TIMEOUT_SECONDS + 30))
+)
+
+
+def settle_duplicate(key: str, result: dict):
+    """
+    Put back the outcome of a finished conversion: a redelivery marks the
+    record retrying before it finds the conversion already done.
+    """
+    table_id, update_id = parse_upload_key(key)
+    if update_id:
+        update_update(table_id, update_id, {"status": {"S": "applied"}})
+    else:
+        record_key = find_dataset_key_by_file(key)
+        if record_key:
+            settle_dataset_status(record_key, result.get("status", "converted"))
+
+
+def process_s3_object(bucket: str, key: str) -> dict:
+    with stage("claim"):
+        etag = s3.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+        owner = uuid.uuid4().hex
+        claim = claim_conversion(key, etag, owner, CONVERSION_LEASE_SECONDS)
+    if claim is not None:
+        set_properties(duplicate=claim.get("state", {}).get("S", "converting"))
+        if claim.get("state", {}).get("S") == "done":
+            result = json.loads(claim["result"]["S"])
+            settle_duplicate(key, result)
+            return {**result, "duplicate": "done"}
+        return {"s3Key": key, "duplicate": "converting"}
+
+    try:
+        result = convert_object(bucket, key, etag)
+    except BaseException:
+        release_conversion(key, etag, owner)
+        raise
+    complete_conversion(key, etag, owner, result)
+    return result
@@ -1,326 +1,228 @@
-import json
-import os
-import uuid
-import boto3
-from datetime import datetime
-
-# ---------------------------------------------------------------------------
-# Environment and clients
-# ---------------------------------------------------------------------------
-BUCKET = os.environ["BUCKET_NAME"]
-DDB_TABLE = os.environ["DDB_TABLE_NAME"]
-ALLOWED_ORIGIN = os.environ.get("ALLOWED_ORIGIN", "http://localhost:3000")
-DELTA_INSTANCE_ID = os.environ["DELTA_INSTANCE_ID"]
-DELTA_SERVER_URL = os.environ["DELTA_SERVER_URL"]
-
-s3 = boto3.client("s3")
-dynamodb = boto3.client("dynamodb")
-ssm = boto3.client("ssm")
-
+"""
+Conversion function: queued S3 upload events, direct S3 events,
+POST /process and Delta table maintenance runs.
 
-# ---------------------------------------------------------------------------
-# Helper: standard HTTP response
-# ---------------------------------------------------------------------------
-def build_response(status_code: int, body: dict):
-    return {
-        "statusCode": status_code,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": ALLOWED_ORIGIN,
-            "Access-Control-Allow-Headers": "Content-Type",
-        },
-        "body": json.dumps(body),
-    }
+This is the heavy side of the deployment (pandas/pyarrow/deltalake). Any
+other HTTP route is handed to api_handler, so a single-function deployment
+keeps working.
+"""
 
+import json
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
+import api_handler
+from common import BUCKET, build_response, dynamodb, lambda_client
+from convert import (
+    CONVERSION_MEMORY_MB,
+    is_upload_key,
+    parse_upload_key,
+    process_s3_object,
+)
+from maintenance import maintain_table, maintainable_tables
+from metrics import event_operation, traced
+from records import (
+    find_dataset_key_by_file,
+    update_dataset,
+    update_update,
+)
 
 # ---------------------------------------------------------------------------
-# Convert CSV → Delta & mark 'converted'
+# Batch conversion
+#
+# Records in one S3 event are converted concurrently on threads: the Arrow
+# CSV reader and the Delta writer release the GIL, and Lambda has no
+# /dev/shm for process pools. Workers are capped by vCPUs and by how many
+# CONVERSION_MEMORY_MB budgets fit in the function's memory.
 # ---------------------------------------------------------------------------
-def process_s3_object(bucket: str, key: str):
-    import pandas as pd
-    from deltalake.writer import write_deltalake
-    import os
-
-    table_id = key.split("/")[1]
-    local_csv = f"/tmp/{uuid.uuid4().hex}.csv"
-    s3.download_file(bucket, key, local_csv)
-
-    df = pd.read_csv(local_csv)
-    delta_dir = f"/tmp/{uuid.uuid4().hex}"
-    write_deltalake(delta_dir, df, mode="overwrite")
-
-    # upload back
-    for root, _, files in os.walk(delta_dir):
-        for fname in files:
-            full = os.path.join(root, fname)
-            rel = os.path.relpath(full, delta_dir)
-            out = f"datasets/{table_id}/delta/{rel}"
-            s3.upload_file(full, bucket, out)
-
-    # mark converted
-    resp = dynamodb.scan(
-        TableName=DDB_TABLE,
-        FilterExpression="fileKey = :fk",
-        ExpressionAttributeValues={":fk": {"S": key}},
-        ProjectionExpression="userId",
-    )
-    for item in resp.get("Items", []):
-        dynamodb.update_item(
-            TableName=DDB_TABLE,
-            Key={
-                "userId": {"S": item["userId"]["S"]},
-                "fileKey": {"S": key},
-            },
-            UpdateExpression="SET #s = :c",
-            ExpressionAttributeNames={"#s": "status"},
-            ExpressionAttributeValues={":c": {"S": "converted"}},
-        )
+MAX_CONVERSION_WORKERS = int(os.environ.get("MAX_CONVERSION_WORKERS", "0"))
+
+
+def conversion_workers(record_count: int) -> int:
+    memory_mb = int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "1024"))
+    workers = min(os.cpu_count() or 1, memory_mb // CONVERSION_MEMORY_MB)
+    if MAX_CONVERSION_WORKERS:
+        workers = min(workers, MAX_CONVERSION_WORKERS)
+    return max(1, min(workers, record_count))
+
+
+def convert_record(bucket: str, key: str) -> dict:
+    """Convert one object; failures are reported, not raised."""
+    try:
+        # one trace per object, on whichever thread converts it
+        with traced("convert", s3Key=key):
+            result = process_s3_object(bucket, key)
+    except Exception as exc:
+        traceback.print_exc()
+        return {"s3Key": key, "status": "failed", "error": str(exc)}
+    if "duplicate" in result:
+        # already converted, or being converted by another invocation
+        return {"s3Key": key, "status": "converted", "duplicate": result["duplicate"]}
+    return {"s3Key": key, "status": "converted"}
+
+
+def s3_objects(records) -> list:
+    """
+    (bucket, key) for each upload in S3 event records; keys arrive
+    URL-encoded. Anything else that reaches here (e.g. through a
+    notification rule without the upload prefix) is skipped.
+    """
+    objects = []
+    for r in records:
+        key = unquote_plus(r["s3"]["object"]["key"])
+        if is_upload_key(key):
+            objects.append((r["s3"]["bucket"]["name"], key))
+    return objects
+
+
+def convert_objects(objects) -> list:
+    """Convert every (bucket, key); results are in the order of `objects`."""
+    if len(objects) <= 1:
+        return [convert_record(*o) for o in objects]
+    with ThreadPoolExecutor(max_workers=conversion_workers(len(objects))) as pool:
+        return list(pool.map(lambda o: convert_record(*o), objects))
 
 
 # ---------------------------------------------------------------------------
-# Re-generate share.yaml with *all* shared tables
+# Queue consumption
+#
+# S3 notifications land on an SQS queue (infra/storage.py) and reach this
+# function in batches through an event source mapping with a concurrency
+# cap. Failed messages are reported individually (ReportBatchItemFailures)
+# and redelivered until CONVERSION_MAX_ATTEMPTS receives, after which SQS
+# moves them to the dead-letter queue. The dataset record follows along:
+# "retrying" with the attempt count and last error, then "failed".
 # ---------------------------------------------------------------------------
-def share_table():
-    # 1) fetch all shared tableIds
-    resp = dynamodb.scan(
-        TableName=DDB_TABLE,
-        FilterExpression="#s = :sh",
-        ExpressionAttributeNames={"#s": "status"},
-        ExpressionAttributeValues={":sh": {"S": "shared"}},
-        ProjectionExpression="tableId",
-    )
-    table_ids = [i["tableId"]["S"] for i in resp.get("Items", [])]
-
-    # 2) build YAML content
-    lines = [
-        "version: 1",
-        "",
-        "# server config",
-        'host: "0.0.0.0"',
-        "port: 8080",
-        'endpoint: "/"',
-        "",
-        "shares:",
-        "  - name: my_share",
-        "    schemas:",
-        "      - name: default",
-        "        tables:",
-    ]
-    for tid in table_ids:
-        lines.append(f"          - name: {tid}")
-        lines.append(f"            location: s3a://{BUCKET}/datasets/{tid}/delta")
-    yaml_body = "\n".join(lines)
-
-    # 3) send to instance (overwrites file)
-    script = f"""cat << 'EOF' > /home/ubuntu/shares/share.yaml
-{yaml_body}
-EOF
-
-sudo systemctl restart delta-sharing
-"""
-    cmd = ssm.send_command(
-        InstanceIds=[DELTA_INSTANCE_ID],
-        DocumentName="AWS-RunShellScript",
-        Parameters={"commands": [script]},
-    )
-    return cmd["Command"]["CommandId"]
+CONVERSION_MAX_ATTEMPTS = int(os.environ.get("CONVERSION_MAX_ATTEMPTS", "3"))
+
+
+def mark_attempt(key: str, attempt: int, error: str = None):
+    """
+    Reflect a retry or a failed attempt on the dataset record, or on the
+    update's entry for an incremental upload (the table itself stays
+    converted/shared).
+
+    Best effort: a record or updates entry that can't be written (e.g. an
+    update whose entry is gone) is skipped, so one object's bookkeeping
+    never fails the other messages of its batch.
+    """
+    table_id, update_id = parse_upload_key(key)
+    if not update_id:
+        record_key = find_dataset_key_by_file(key)
+        if not record_key:
+            return
+    values = {"attempts": {"N": str(attempt)}}
+    if error is None:
+        values["status"] = {"S": "retrying"}
+    else:
+        final = attempt >= CONVERSION_MAX_ATTEMPTS
+        values["status"] = {"S": "failed" if final else "retrying"}
+        values["lastError"] = {"S": error[:1000]}
+    try:
+        if update_id:
+            update_update(table_id, update_id, values)
+        else:
+            update_dataset(record_key, values)
+    except dynamodb.exceptions.ClientError as exc:
+        print(f"Couldn't record attempt {attempt} of {key}: {exc}")
+
+
+def process_queue_batch(messages) -> dict:
+    jobs = []  # (messageId, attempt, bucket, key)
+    for message in messages:
+        try:
+            body = json.loads(message["body"])
+        except ValueError:
+            # nothing a retry could fix
+            print(f"Dropping malformed message {message['messageId']}")
+            continue
+        attempt = int(message["attributes"]["ApproximateReceiveCount"])
+        # the s3:TestEvent sent when the notification is set up has no Records
+        for bucket, key in s3_objects(body.get("Records", [])):
+            jobs.append((message["messageId"], attempt, bucket, key))
+
+    for _, attempt, _, key in jobs:
+        if attempt > 1:
+            mark_attempt(key, attempt)
+
+    results = convert_objects([(bucket, key) for _, _, bucket, key in jobs])
+
+    failed = []
+    for (message_id, attempt, _, key), result in zip(jobs, results):
+        if result["status"] == "failed":
+            mark_attempt(key, attempt, result["error"])
+            if message_id not in failed:
+                failed.append(message_id)
+    return {"batchItemFailures": [{"itemIdentifier": m} for m in failed]}
 
 
 # ---------------------------------------------------------------------------
-# Lambda entrypoint
+# Lambda entrypoint (conversion function)
 # ---------------------------------------------------------------------------
 def main(event, context):
-    # 1) S3-triggered conversion
-    if "Records" in event and event["Records"][0].get("eventSource") == "aws:s3":
-        for r in event["Records"]:
-            process_s3_object(r["s3"]["bucket"]["name"], r["s3"]["object"]["key"])
-        return {"statusCode": 200}
+    with traced(event_operation(event)) as trace:
+        response = dispatch(event, context)
+        if "statusCode" in response:
+            trace.set(statusCode=response["statusCode"])
+        return response
+
+
+def dispatch(event, context):
+    # Maintenance: one table (POST /maintain), or all of them on the
+    # schedule, fanned out as one async invocation per table
+    if event.get("action") == "maintain":
+        return maintain_table(
+            event["tableId"],
+            zorder_by=event.get("zOrderBy"),
+            retention_hours=event.get("retentionHours"),
+            force=event.get("force", False),
+        )
+    if event.get("action") == "maintain-all":
+        table_ids = maintainable_tables()
+        for table_id in table_ids:
+            lambda_client.invoke(
+                FunctionName=context.function_name,
+                InvocationType="Event",
+                Payload=json.dumps({"action": "maintain", "tableId": table_id}),
+            )
+        return {"statusCode": 202, "tables": len(table_ids)}
+
+    records = event.get("Records") or [{}]
+    # 1) queued S3 notifications
+    if records[0].get("eventSource") == "aws:sqs":
+        return process_queue_batch(records)
+
+    # 2) direct S3 invocation
+    if records[0].get("eventSource") == "aws:s3":
+        results = convert_objects(s3_objects(records))
+        failed = sum(r["status"] == "failed" for r in results)
+        return {"statusCode": 207 if failed else 200, "records": results}
 
-    # 2) HTTP routes
     http = event.get("requestContext", {}).get("http", {})
     method, path = http.get("method"), http.get("path")
 
-    # POST /presign
-    if method == "POST" and path == "/presign":
-        body = json.loads(event.get("body", "{}") or "{}")
-        user_id = body.get("userId")
-        filename = body.get("filename")
-        if not user_id or not filename:
-            return build_response(400, {"error": "Missing userId or filename"})
-
-        table_id = uuid.uuid4().hex
-        s3_key = f"datasets/{table_id}/raw/{filename}"
-
-        # record pending
-        dynamodb.put_item(
-            TableName=DDB_TABLE,
-            Item={
-                "userId": {"S": user_id},
-                "fileKey": {"S": s3_key},
-                "tableId": {"S": table_id},
-                "filename": {"S": filename},
-                "status": {"S": "pending"},
-                "createdAt": {"S": datetime.utcnow().isoformat()},
-            },
-        )
-
-        url = s3.generate_presigned_url(
-            ClientMethod="put_object",
-            Params={"Bucket": BUCKET, "Key": s3_key, "ContentType": "text/csv"},
-            ExpiresIn=3600,
-        )
-        return build_response(200, {"url": url, "tableId": table_id, "s3Key": s3_key})
-
     # POST /process
     if method == "POST" and path == "/process":
         body = json.loads(event.get("body", "{}") or "{}")
         key = body.get("s3Key") or body.get("s3_key")
         if not key:
             return build_response(400, {"error": "Missing s3Key"})
-        process_s3_object(BUCKET, key)
-        return build_response(200, {"message": "Delta table written", "s3Key": key})
-
-    # POST /share
-    if method == "POST" and path == "/share":
-        body = json.loads(event.get("body", "{}") or "{}")
-        table_id = body.get("tableId")
-        if not table_id:
-            return build_response(400, {"error": "Missing tableId"})
-
-        # mark shared in DynamoDB
-        scan = dynamodb.scan(
-            TableName=DDB_TABLE,
-            FilterExpression="tableId = :t",
-            ExpressionAttributeValues={":t": {"S": table_id}},
-            ProjectionExpression="userId,fileKey",
-        )
-        items = scan.get("Items", [])
-        if not items:
-            return build_response(404, {"error": "Dataset record not found"})
-        user_id, file_key = items[0]["userId"]["S"], items[0]["fileKey"]["S"]
-
-        dynamodb.update_item(
-            TableName=DDB_TABLE,
-            Key={"userId": {"S": user_id}, "fileKey": {"S": file_key}},
-            UpdateExpression="SET #s = :sh",
-            ExpressionAttributeNames={"#s": "status"},
-            ExpressionAttributeValues={":sh": {"S": "shared"}},
-        )
-
-        # regenerate share.yaml
-        cmd_id = share_table()
-
-        # build profile + snippet
-        profile = {
-            "shareCredentialsVersion": 1,
-            "endpoint": DELTA_SERVER_URL,
-            "bearerToken": "",
-        }
-        snippet_text = (
-            "!pip install delta-sharing\n"
-            "import json\n\n"
-            "profile = " + json.dumps(profile, indent=2) + "\n\n"
-            "with open('share_creds.json','w') as f:\n"
-            "    json.dump(profile,f)\n\n"
-            "import delta_sharing\n\n"
-            f"df = delta_sharing.load_as_pandas('share_creds.json#my_share.default.{table_id}')\n"
-            "df.head()\n"
-        )
-
-        # save snippet
-        dynamodb.update_item(
-            TableName=DDB_TABLE,
-            Key={"userId": {"S": user_id}, "fileKey": {"S": file_key}},
-            UpdateExpression="SET notebookSnippet = :ns",
-            ExpressionAttributeValues={":ns": {"S": snippet_text}},
-        )
-
-        return build_response(
-            200,
-            {
-                "profile": profile,
-                "snippet": {
-                    "tableUrl": f"share://my_share.default.{table_id}",
-                    "notebookSnippet": snippet_text,
+        result = process_s3_object(BUCKET, key)
+        if "duplicate" in result:
+            return build_response(
+                200,
+                {
+                    "message": (
+                        "Already converted"
+                        if result["duplicate"] == "done"
+                        else "Conversion in progress"
+                    ),
+                    "s3Key": key,
+                    "duplicate": result["duplicate"],
                 },
-                "status": "shared",
-            },
-        )
-
-    # POST /unshare — revoke sharing of a table
-    if method == "POST" and path == "/unshare":
-        body = json.loads(event.get("body", "{}") or "{}")
-        table_id = body.get("tableId")
-        if not table_id:
-            return build_response(400, {"error": "Missing tableId"})
-
-        # 1) Find the record in DynamoDB
-        resp = dynamodb.scan(
-            TableName=DDB_TABLE,
-            FilterExpression="tableId = :t",
-            ExpressionAttributeValues={":t": {"S": table_id}},
-            ProjectionExpression="userId,fileKey",
-        )
-        items = resp.get("Items", [])
-        if not items:
-            return build_response(404, {"error": "Dataset record not found"})
-        user_id, file_key = items[0]["userId"]["S"], items[0]["fileKey"]["S"]
-
-        # 2) Update status back to 'converted'
-        dynamodb.update_item(
-            TableName=DDB_TABLE,
-            Key={"userId": {"S": user_id}, "fileKey": {"S": file_key}},
-            UpdateExpression="SET #s = :c",
-            ExpressionAttributeNames={"#s": "status"},
-            ExpressionAttributeValues={":c": {"S": "converted"}},
-        )
-
-        # 3) Regenerate share.yaml (will drop this table)
-        share_table()
-
-        # 4) Return success
-        return build_response(200, {"status": "converted"})
-
-    # GET /snippet — retrieve the saved notebook snippet for a table
-    if method == "GET" and path == "/snippet":
-        params = event.get("queryStringParameters") or {}
-        table_id = params.get("tableId")
-        if not table_id:
-            return build_response(400, {"error": "Missing tableId"})
-
-        # find the record (we scan because our primary key is userId+fileKey)
-        resp = dynamodb.scan(
-            TableName=DDB_TABLE,
-            FilterExpression="tableId = :t",
-            ExpressionAttributeValues={":t": {"S": table_id}},
-            ProjectionExpression="notebookSnippet",
-        )
-        items = resp.get("Items", [])
-        if not items or "notebookSnippet" not in items[0]:
-            return build_response(404, {"error": "Snippet not found"})
-
-        snippet = items[0]["notebookSnippet"]["S"]
-        return build_response(200, {"notebookSnippet": snippet})
-
-    # GET /datasets
-    if method == "GET" and path == "/datasets":
-        params = event.get("queryStringParameters") or {}
-        user_id = params.get("userId")
-        if not user_id:
-            return build_response(400, {"error": "Missing userId"})
-        resp = dynamodb.query(
-            TableName=DDB_TABLE,
-            KeyConditionExpression="userId = :u",
-            ExpressionAttributeValues={":u": {"S": user_id}},
-        )
-        items = [
-            {
-                "tableId": i["tableId"]["S"],
-                "filename": i["filename"]["S"],
-                "status": i["status"]["S"],
-            }
-            for i in resp.get("Items", [])
-        ]
-        return build_response(200, {"datasets": items})
+            )
+        return build_response(200, {"message": "Delta table written", "s3Key": key})
 
-    return build_response(404, {"error": "Route not found"})
+    return api_handler.route(event, context)
@@ -0,0 +1,159 @@
+"""
+Delta table maintenance: compaction (optionally Z-ordered), VACUUM and log
+checkpoints. Runs in the conversion function, on a schedule for every
+table or on demand for one (POST /maintain).
+"""
+
+import json
+import os
+import time
+
+from common import BUCKET, DDB_TABLE, dynamodb, s3
+from convert import (
+    delta_storage_options,
+    delta_table_uri,
+    resolve_write_options,
+    table_size_bytes,
+    writer_properties,
+)
+from metrics import set_properties, stage
+from records import find_dataset_key, get_dataset, update_dataset
+
+# ---------------------------------------------------------------------------
+# Maintenance settings
+# ---------------------------------------------------------------------------
+# Files no longer referenced by the table are only deleted once they are
+# this old, so consumers reading a recent version (and Delta Sharing's
+# history reads) keep working. 7 days is Delta's own default.
+VACUUM_RETENTION_HOURS = int(os.environ.get("VACUUM_RETENTION_HOURS", "168"))
+
+
+def stored_files(table_id: str) -> dict:
+    """Data objects under the table's prefix, log excluded: {path: bytes}."""
+    prefix = f"datasets/{table_id}/delta/"
+    pages = s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET, Prefix=prefix)
+    return {
+        obj["Key"][len(prefix) :]: obj["Size"]
+        for page in pages
+        for obj in page.get("Contents", [])
+        if not obj["Key"].startswith(prefix + "_delta_log/")
+    }
+
+
+def maintain_table(
+    table_id: str,
+    zorder_by=None,
+    retention_hours: int = None,
+    force: bool = False,
+) -> dict:
+    """
+    Compact (or Z-order by `zorder_by`), vacuum and checkpoint one table,
+    then store the run's metrics on its record as "lastMaintenance".
+
+    A table that hasn't changed since its last run is skipped unless
+    `force` is set. Z-order columns given here are remembered on the
+    record for later scheduled runs.
+    """
+    from deltalake import DeltaTable
+
+    set_properties(tableId=table_id)
+    record_key = find_dataset_key(table_id)
+    if not record_key:
+        raise ValueError(f"Unknown tableId {table_id}")
+    record = get_dataset(
+        record_key, ["writeOptions", "zOrderBy", "maintainedVersion", "profile"]
+    )
+    if zorder_by is None and "zOrderBy" in record:
+        zorder_by = json.loads(record["zOrderBy"]["S"])
+    if retention_hours is None:
+        retention_hours = VACUUM_RETENTION_HOURS
+
+    dt = DeltaTable(delta_table_uri(table_id), storage_options=delta_storage_options())
+    if not force and str(dt.version()) == record.get("maintainedVersion", {}).get("N"):
+        return {"tableId": table_id, "skipped": "unchanged since last run"}
+
+    started = time.time()
+    version_before = dt.version()
+    active_before = len(dt.file_uris())
+    stored_before = stored_files(table_id)
+
+    # 1) rewrite small files into target-size ones with the table's layout
+    options = resolve_write_options(
+        json.loads(record["writeOptions"]["S"]) if "writeOptions" in record else None
+    )
+    optimize_args = {
+        "target_size": options["targetFileMb"] * 1024**2,
+        "writer_properties": writer_properties(options),
+    }
+    with stage("optimize"):
+        if zorder_by:
+            optimized = dt.optimize.z_order(zorder_by, **optimize_args)
+        else:
+            optimized = dt.optimize.compact(**optimize_args)
+
+    # 2) delete files dropped from the table more than retention_hours ago,
+    #    and ones never committed (a conversion that died before its commit)
+    with stage("vacuum"):
+        vacuumed = dt.vacuum(
+            retention_hours=retention_hours,
+            dry_run=False,
+            enforce_retention_duration=retention_hours >= VACUUM_RETENTION_HOURS,
+            full=True,
+        )
+
+    # 3) checkpoint so readers don't replay every JSON commit, and drop log
+    #    entries past the table's log retention
+    with stage("checkpoint"):
+        dt.create_checkpoint()
+        dt.cleanup_metadata()
+
+    stored_after = stored_files(table_id)
+    metrics = {
+        "at": int(started),
+        "seconds": round(time.time() - started, 2),
+        "version": dt.version(),
+        "zOrderBy": zorder_by or [],
+        "activeFilesBefore": active_before,
+        "activeFilesAfter": len(dt.file_uris()),
+        "filesAdded": optimized.get("numFilesAdded", 0),
+        "filesRemoved": optimized.get("numFilesRemoved", 0),
+        "filesVacuumed": len(vacuumed),
+        "storedFilesBefore": len(stored_before),
+        "storedFilesAfter": len(stored_after),
+        "bytesBefore": sum(stored_before.values()),
+        "bytesAfter": sum(stored_after.values()),
+        # vacuum reports paths relative to the table root
+        "bytesReclaimed": sum(stored_before.get(p, 0) for p in vacuumed),
+        "retentionHours": retention_hours,
+    }
+
+    values = {
+        "lastMaintenance": {"S": json.dumps(metrics)},
+        "maintainedVersion": {"N": str(dt.version())},
+    }
+    if zorder_by:
+        values["zOrderBy"] = {"S": json.dumps(zorder_by)}
+    # compaction rewrites the files but not the rows, so a profile of the
+    # version before it still holds, bar the size
+    size = table_size_bytes(dt)
+    values["sizeBytes"] = {"N": str(size)}
+    if "profile" in record:
+        profile = json.loads(record["profile"]["S"])
+        profile["sizeBytes"] = size
+        if profile.get("version") == version_before:
+            profile["version"] = dt.version()
+        values["profile"] = {"S": json.dumps(profile)}
+    update_dataset(record_key, values)
+    return {"tableId": table_id, **metrics}
+
+
+def maintainable_tables() -> list:
+    """tableIds of every converted or shared dataset."""
+    pages = dynamodb.get_paginator("scan").paginate(
+        TableName=DDB_TABLE,
+        FilterExpression="#s IN (:c, :sh)",
+        ExpressionAttributeNames={"#s": "status"},
+        ExpressionAttributeValues={":c": {"S": "converted"}, ":sh": {"S": "shared"}},
+        ProjectionExpression="tableId",
+    )
+    return [i["tableId"]["S"] for page in pages for i in page.get("Items", [])]
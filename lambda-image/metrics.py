@@ -0,0 +1,224 @@
+"""
+Per-request tracing: wall time, bytes, rows and peak RSS per stage, plus
+time spent in AWS API calls, logged as one CloudWatch Embedded Metric
+Format line per request (or per converted object).
+
+    with traced("convert", s3Key=key):
+        with stage("parse") as s:
+            table = read_csv_table(body, schema)
+            s.record(rows=table.num_rows, bytes=size)
+
+Traces are per thread, so objects converted concurrently each get their
+own. With METRICS_ENABLED off, traced() and stage() hand back shared no-op
+objects and clients are never instrumented.
+"""
+
+import json
+import os
+import resource
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "DeltaBridge")
+
+_current = threading.local()
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def event_operation(event: dict) -> str:
+    """Name of the operation a Lambda event asks for, as a metric dimension."""
+    if event.get("action"):
+        return event["action"]
+    source = (event.get("Records") or [{}])[0].get("eventSource")
+    if source == "aws:sqs":
+        return "queue-batch"
+    if source == "aws:s3":
+        return "s3-event"
+    http = event.get("requestContext", {}).get("http", {})
+    if http.get("method"):
+        return f"{http['method']} {http.get('path')}"
+    return "unknown"
+
+
+# ---------------------------------------------------------------------------
+# Traces and stages
+# ---------------------------------------------------------------------------
+class Stage:
+    def __init__(self, trace, name: str):
+        self._trace = trace
+        self.name = name
+        self.fields = {}
+
+    def record(self, **fields):
+        """Attach counts (rows=, bytes=, ...) to the stage."""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self._start) * 1000
+        self._trace.stages.append(
+            {
+                "stage": self.name,
+                "ms": round(ms, 1),
+                "peakRssMb": peak_rss_mb(),
+                **({"error": exc_type.__name__} if exc_type else {}),
+                **self.fields,
+            }
+        )
+
+
+class Trace:
+    def __init__(self, operation: str, properties: dict):
+        self.operation = operation
+        self.properties = dict(properties)
+        self.stages = []
+        self.aws_calls = {}
+        self._start = time.perf_counter()
+
+    def stage(self, name: str) -> Stage:
+        return Stage(self, name)
+
+    def set(self, **properties):
+        self.properties.update(properties)
+
+    def aws_call(self, name: str, ms: float):
+        calls = self.aws_calls.setdefault(name, {"count": 0, "ms": 0.0})
+        calls["count"] += 1
+        calls["ms"] = round(calls["ms"] + ms, 1)
+
+    def document(self, error: str = None) -> dict:
+        """The EMF log document: metrics first, the breakdown as properties."""
+        metrics = {
+            "DurationMs": round((time.perf_counter() - self._start) * 1000, 1),
+            "PeakRssMb": peak_rss_mb(),
+            "AwsCallMs": round(sum(c["ms"] for c in self.aws_calls.values()), 1),
+        }
+        for s in self.stages:
+            name = f"{s['stage']}Ms"
+            metrics[name] = round(metrics.get(name, 0) + s["ms"], 1)
+        for field in ("bytes", "rows"):
+            counts = [s[field] for s in self.stages if field in s]
+            if counts:
+                metrics[field.capitalize()] = max(counts)
+        units = {"PeakRssMb": "Megabytes", "Bytes": "Bytes", "Rows": "Count"}
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["Operation"]],
+                        "Metrics": [
+                            {"Name": name, "Unit": units.get(name, "Milliseconds")}
+                            for name in metrics
+                        ],
+                    }
+                ],
+            },
+            "Operation": self.operation,
+            **metrics,
+            **self.properties,
+            **({"error": error} if error else {}),
+            "stages": self.stages,
+            "awsCalls": self.aws_calls,
+        }
+
+
+class _NoopStage:
+    def record(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NoopTrace(_NoopStage):
+    def stage(self, name: str):
+        return _NOOP_STAGE
+
+    def set(self, **properties):
+        pass
+
+
+_NOOP_STAGE = _NoopStage()
+_NOOP_TRACE = _NoopTrace()
+
+
+class traced:
+    """
+    Context manager tracing everything inside it on this thread; the EMF
+    line is printed on exit. Nested traces stack: the inner one is logged
+    on its own and the outer one resumes.
+    """
+
+    def __new__(cls, operation: str, **properties):
+        if not METRICS_ENABLED:
+            return _NOOP_TRACE
+        return super().__new__(cls)
+
+    def __init__(self, operation: str, **properties):
+        self._trace = Trace(operation, properties)
+
+    def __enter__(self) -> Trace:
+        self._outer = getattr(_current, "trace", None)
+        _current.trace = self._trace
+        return self._trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.trace = self._outer
+        error = f"{exc_type.__name__}: {exc}"[:500] if exc_type else None
+        print(json.dumps(self._trace.document(error), default=str))
+        return False
+
+
+def stage(name: str):
+    """A stage of the current thread's trace (a no-op outside one)."""
+    trace = getattr(_current, "trace", None) if METRICS_ENABLED else None
+    return trace.stage(name) if trace else _NOOP_STAGE
+
+
+def set_properties(**properties):
+    """Add properties (tableId, mode, ...) to the current trace."""
+    trace = getattr(_current, "trace", None) if METRICS_ENABLED else None
+    if trace:
+        trace.set(**properties)
+
+
+# ---------------------------------------------------------------------------
+# AWS API calls: botocore hooks time every call made on a traced thread
+# ---------------------------------------------------------------------------
+def _before_call(model, context, **kwargs):
+    name = f"{model.service_model.service_name}.{model.name}"
+    context["metrics_call"] = (name, time.perf_counter())
+
+
+def _after_call(context, **kwargs):
+    trace = getattr(_current, "trace", None)
+    if trace and "metrics_call" in context:
+        name, start = context["metrics_call"]
+        trace.aws_call(name, (time.perf_counter() - start) * 1000)
+
+
+def instrument_client(client):
+    """Hook a boto3 client's calls into the tracing (once, at creation)."""
+    if METRICS_ENABLED:
+        events = client.meta.events
+        events.register("before-call", _before_call)
+        events.register("after-call", _after_call)
+        events.register("after-call-error", _after_call)
+    return client
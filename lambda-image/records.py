@@ -0,0 +1,251 @@
+"""
+Dataset records in the tracking table.
+"""
+
+import base64
+import json
+import os
+import time
+
+from common import DDB_TABLE, FILE_KEY_INDEX, TABLE_ID_INDEX, dynamodb
+
+# ---------------------------------------------------------------------------
+# Pagination tokens: opaque wrappers around DynamoDB's LastEvaluatedKey
+# ---------------------------------------------------------------------------
+DATASETS_PAGE_SIZE = int(os.environ.get("DATASETS_PAGE_SIZE", "50"))
+DATASETS_MAX_PAGE_SIZE = 100
+
+
+def encode_page_token(last_key: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+
+def decode_page_token(token: str):
+    """Inverse of encode_page_token; None for anything malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        return None
+    return key if isinstance(key, dict) else None
+
+
+# ---------------------------------------------------------------------------
+# Dataset records: key lookups through the GSIs instead of table scans
+# ---------------------------------------------------------------------------
+def _first_key(index_name: str, attribute: str, value: str):
+    resp = dynamodb.query(
+        TableName=DDB_TABLE,
+        IndexName=index_name,
+        KeyConditionExpression="#k = :v",
+        ExpressionAttributeNames={"#k": attribute},
+        ExpressionAttributeValues={":v": {"S": value}},
+        Limit=1,
+    )
+    items = resp.get("Items", [])
+    if not items:
+        return None
+    return {"userId": items[0]["userId"], "fileKey": items[0]["fileKey"]}
+
+
+def find_dataset_key(table_id: str):
+    """Primary key of the dataset record for a tableId, or None."""
+    return _first_key(TABLE_ID_INDEX, "tableId", table_id)
+
+
+def find_dataset_key_by_file(file_key: str):
+    """Primary key of the dataset record for an uploaded object, or None."""
+    return _first_key(FILE_KEY_INDEX, "fileKey", file_key)
+
+
+def get_dataset(key: dict, attributes=None):
+    """Fetch a dataset record by primary key, optionally projected."""
+    params = {"TableName": DDB_TABLE, "Key": key}
+    if attributes:
+        names = {f"#p{i}": a for i, a in enumerate(attributes)}
+        params["ProjectionExpression"] = ",".join(names)
+        params["ExpressionAttributeNames"] = names
+    return dynamodb.get_item(**params).get("Item")
+
+
+def dataset_update(key: dict, values: dict) -> dict:
+    """
+    update_item parameters that SET each attribute in `values` (already
+    typed, e.g. {"S": "shared"}); also usable as a TransactWriteItems Update.
+    """
+    names = {f"#a{i}": name for i, name in enumerate(values)}
+    return {
+        "TableName": DDB_TABLE,
+        "Key": key,
+        "UpdateExpression": "SET " + ", ".join(f"{n} = :v{n[2:]}" for n in names),
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": {
+            f":v{i}": value for i, value in enumerate(values.values())
+        },
+    }
+
+
+def update_dataset(key: dict, values: dict):
+    """SET each attribute in `values` (already typed, e.g. {"S": "shared"})."""
+    dynamodb.update_item(**dataset_update(key, values))
+
+
+# ---------------------------------------------------------------------------
+# Incremental updates: one item per update upload, keyed by the upload's id
+# under a partition of the table's own, so a table takes any number of
+# updates without its dataset record nearing DynamoDB's 400 KB item limit.
+#
+# Like the conversion claims they carry no tableId, and their statuses
+# (pending/retrying/applied/failed) never match the dataset scans'. In the
+# fileKey index their fileKey is the updateId, never an object key.
+# ---------------------------------------------------------------------------
+UPDATE_PREFIX = "__update__#"
+
+
+def _update_key(table_id: str, update_id: str) -> dict:
+    return {"userId": {"S": UPDATE_PREFIX + table_id}, "fileKey": {"S": update_id}}
+
+
+def put_update(table_id: str, update_id: str, entry: dict):
+    """Store an update's entry (typed attribute values)."""
+    dynamodb.put_item(
+        TableName=DDB_TABLE, Item={**entry, **_update_key(table_id, update_id)}
+    )
+
+
+def get_update(table_id: str, update_id: str):
+    """An update's entry (typed attribute values), or None."""
+    item = dynamodb.get_item(
+        TableName=DDB_TABLE, Key=_update_key(table_id, update_id)
+    ).get("Item")
+    if item is None:
+        return None
+    return {k: v for k, v in item.items() if k not in ("userId", "fileKey")}
+
+
+def list_updates(table_id: str) -> dict:
+    """Every update of a table: {updateId: entry}."""
+    pages = dynamodb.get_paginator("query").paginate(
+        TableName=DDB_TABLE,
+        KeyConditionExpression="userId = :u",
+        ExpressionAttributeValues={":u": {"S": UPDATE_PREFIX + table_id}},
+    )
+    return {
+        item.pop("fileKey")["S"]: {k: v for k, v in item.items() if k != "userId"}
+        for page in pages
+        for item in page.get("Items", [])
+    }
+
+
+def update_update(table_id: str, update_id: str, values: dict):
+    """
+    SET fields of an existing update's entry (values already typed); a
+    ConditionalCheckFailedException if there is no such update.
+    """
+    dynamodb.update_item(
+        **dataset_update(_update_key(table_id, update_id), values),
+        ConditionExpression="attribute_exists(fileKey)",
+    )
+
+
+# ---------------------------------------------------------------------------
+# Conversion claims: one item per uploaded object version (S3 key + ETag)
+#
+# Kept in the tracking table under their own partition, like the share
+# manifest, and without status/tableId attributes so dataset scans and the
+# tableId index never see them. They do show up in the fileKey index, with
+# the ETag as fileKey, where a lookup by an uploaded object's key can't
+# match them.
+# ---------------------------------------------------------------------------
+CLAIM_PREFIX = "__conversion__#"
+
+
+def _claim_key(s3_key: str, etag: str) -> dict:
+    return {"userId": {"S": CLAIM_PREFIX + s3_key}, "fileKey": {"S": etag}}
+
+
+def claim_conversion(s3_key: str, etag: str, owner: str, lease_seconds: int):
+    """
+    Take the conversion of an object version for `lease_seconds`.
+
+    Returns None when the claim was taken, otherwise the existing claim
+    item: state "done" (with the stored result) or a live "converting"
+    lease held by someone else. An expired lease is taken over.
+    """
+    now = int(time.time())
+    try:
+        dynamodb.put_item(
+            TableName=DDB_TABLE,
+            Item={
+                **_claim_key(s3_key, etag),
+                "state": {"S": "converting"},
+                "owner": {"S": owner},
+                "leaseUntil": {"N": str(now + lease_seconds)},
+            },
+            ConditionExpression=(
+                "attribute_not_exists(fileKey) OR (#s = :c AND leaseUntil < :now)"
+            ),
+            ExpressionAttributeNames={"#s": "state"},
+            ExpressionAttributeValues={
+                ":c": {"S": "converting"},
+                ":now": {"N": str(now)},
+            },
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException as exc:
+        return exc.response.get("Item", {})
+    return None
+
+
+def complete_conversion(s3_key: str, etag: str, owner: str, result: dict):
+    """Mark a claim done with its result, if `owner` still holds it."""
+    try:
+        dynamodb.update_item(
+            TableName=DDB_TABLE,
+            Key=_claim_key(s3_key, etag),
+            UpdateExpression="SET #s = :d, #r = :r REMOVE leaseUntil",
+            ConditionExpression="#o = :o",
+            ExpressionAttributeNames={"#s": "state", "#r": "result", "#o": "owner"},
+            ExpressionAttributeValues={
+                ":d": {"S": "done"},
+                ":r": {"S": json.dumps(result)},
+                ":o": {"S": owner},
+            },
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def release_conversion(s3_key: str, etag: str, owner: str):
+    """Drop a claim after a failed conversion so a retry can take it."""
+    try:
+        dynamodb.delete_item(
+            TableName=DDB_TABLE,
+            Key=_claim_key(s3_key, etag),
+            ConditionExpression="#o = :o",
+            ExpressionAttributeNames={"#o": "owner"},
+            ExpressionAttributeValues={":o": {"S": owner}},
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def settle_dataset_status(key: dict, status: str):
+    """
+    Set the record's status back to `status` if a redelivery left it
+    retrying/failed; a status that moved on (e.g. shared) is kept.
+    """
+    try:
+        dynamodb.update_item(
+            TableName=DDB_TABLE,
+            Key=key,
+            UpdateExpression="SET #s = :s",
+            ConditionExpression="#s IN (:r, :f)",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={
+                ":s": {"S": status},
+                ":r": {"S": "retrying"},
+                ":f": {"S": "failed"},
+            },
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
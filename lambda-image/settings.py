@@ -0,0 +1,25 @@
+"""
+Settings the functions and the infrastructure (infra/) must agree on. Kept
+free of imports so infra/ can load it without the functions' dependencies.
+"""
+
+# ---------------------------------------------------------------------------
+# Uploads: file suffix -> content type the upload is signed for. The bucket
+# notification (infra/storage.py) fires on the same suffixes, under
+# UPLOAD_PREFIX only, so the tables' own files under datasets/ don't.
+# ---------------------------------------------------------------------------
+UPLOAD_PREFIX = "uploads/"
+UPLOAD_FORMATS = {
+    ".csv": "text/csv",
+    ".csv.gz": "application/gzip",
+    ".csv.zst": "application/zstd",
+    ".jsonl": "application/x-ndjson",
+    ".parquet": "application/vnd.apache.parquet",
+}
+
+# ---------------------------------------------------------------------------
+# Conversion function timeout. The conversion queue's visibility timeout
+# (infra/storage.py) is derived from it, and the function gets it in its
+# environment for the conversion claim lease (convert.py).
+# ---------------------------------------------------------------------------
+CONVERSION_TIMEOUT_SECONDS = 300
@@ -0,0 +1,397 @@
+"""
+Share manifest and Delta Sharing server configuration.
+"""
+
+import os
+
+from common import BUCKET, DDB_TABLE, DELTA_INSTANCE_ID, dynamodb, ssm
+
+# ---------------------------------------------------------------------------
+# Share manifest
+#
+# The set of shared tables is materialized in DynamoDB under one partition of
+# the tracking table: a version counter plus one entry per table recording the
+# last add/remove and the manifest version it happened at. /share and /unshare
+# bump the version, write one entry per changed table and send only that diff
+# to the instance, which keeps one fragment file per table under tables.d/ and
+# renders share.yaml from them. Lambda-side cost is the same with 10 shared
+# tables or 100,000.
+# ---------------------------------------------------------------------------
+SHARE_NAME = "my_share"
+SHARES_DIR = "/home/ubuntu/shares"
+MANIFEST_PK = f"__share_manifest__#{SHARE_NAME}"
+MANIFEST_VERSION_SK = "__version__"
+# Changes arriving within this many seconds of each other share one reload;
+# a steady stream still reloads at least every SHARE_RELOAD_MAX_DELAY.
+SHARE_RELOAD_WINDOW = int(os.environ.get("SHARE_RELOAD_WINDOW_SECONDS", "30"))
+SHARE_RELOAD_MAX_DELAY = int(os.environ.get("SHARE_RELOAD_MAX_DELAY_SECONDS", "300"))
+# A "remove" fragment stays behind as a tombstone so an older "add" landing
+# late can't bring the table back; it is dropped once its version is live
+# and it is older than any command still in flight (SSM gives up delivering
+# after SHARE_COMMAND_TIMEOUT).
+SHARE_COMMAND_TIMEOUT = 600
+SHARE_TOMBSTONE_MINUTES = 60
+# "bluegreen" swaps between two server instances behind nginx with no
+# downtime (provisioned by infra/delta-sharing/user-data.sh); "restart" is
+# for hand-provisioned boxes with a single delta-sharing unit.
+SHARE_RELOAD_MODE = os.environ.get("SHARE_RELOAD_MODE", "bluegreen")
+SHARE_RELOAD_COMMANDS = {
+    "bluegreen": "sudo /usr/local/bin/delta-sharing-reload",
+    "restart": "sudo systemctl restart delta-sharing",
+}
+
+SHARE_YAML_HEADER = "\n".join(
+    [
+        "version: 1",
+        "",
+        "# server config",
+        'host: "0.0.0.0"',
+        "port: 8080",
+        'endpoint: "/"',
+        "",
+        "shares:",
+        f"  - name: {SHARE_NAME}",
+        "    schemas:",
+        "      - name: default",
+        "        tables:",
+    ]
+)
+
+# Renders the table list from `find tables.d -printf '%T@ %f\n'` (mtime,
+# tableId) in one pass, however many fragments there are, and writes the
+# tombstones due for collection to tombstones.gc.
+SHARE_YAML_AWK = f"""
+{{ f = "tables.d/" $2; v = 0; op = ""; getline v < f; getline op < f; close(f) }}
+op == "add" {{
+  print "          - name: " $2
+  print "            location: s3a://{BUCKET}/datasets/" $2 "/delta"
+  print "            historyShared: true"
+}}
+op == "remove" && v + 0 <= live + 0 && now - $1 > {SHARE_TOMBSTONE_MINUTES * 60} {{
+  print $2 > "tombstones.gc"
+}}
+"""
+
+
+def bump_manifest_version() -> int:
+    resp = dynamodb.update_item(
+        TableName=DDB_TABLE,
+        Key={"userId": {"S": MANIFEST_PK}, "fileKey": {"S": MANIFEST_VERSION_SK}},
+        UpdateExpression="ADD #v :one",
+        ExpressionAttributeNames={"#v": "version"},
+        ExpressionAttributeValues={":one": {"N": "1"}},
+        ReturnValues="UPDATED_NEW",
+    )
+    return int(resp["Attributes"]["version"]["N"])
+
+
+def manifest_entry(table_id: str, op: str, version: int) -> dict:
+    """
+    put_item parameters recording the latest op for a table; an older
+    version never overwrites a newer one if two changes to the same table
+    race.
+    """
+    return {
+        "TableName": DDB_TABLE,
+        "Item": {
+            "userId": {"S": MANIFEST_PK},
+            "fileKey": {"S": table_id},
+            "op": {"S": op},
+            "version": {"N": str(version)},
+        },
+        "ConditionExpression": "attribute_not_exists(#v) OR #v < :v",
+        "ExpressionAttributeNames": {"#v": "version"},
+        "ExpressionAttributeValues": {":v": {"N": str(version)}},
+    }
+
+
+def put_manifest_entry(table_id: str, op: str, version: int):
+    try:
+        dynamodb.put_item(**manifest_entry(table_id, op, version))
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def manifest_apply_script(
+    changes, version: int, replace: bool = False, window: int = None
+) -> str:
+    """
+    Shell that applies `changes` [(tableId, op)] to the instance's tables.d/
+    and schedules a debounced reload of the sharing server.
+
+    Each fragment stores the version it was written at and is only replaced by
+    a newer one, so an SSM command that lands out of order never undoes a
+    newer change. It can still land after a newer command has reloaded the
+    server (live >= its version) with a change that isn't loaded yet, so such
+    a command skips the debounce and reloads right away. With replace=True
+    the fragment set is rebuilt from scratch.
+
+    Reloads are trailing-edge debounced on the instance: after writing its
+    fragment a command waits `window` seconds and only reloads if no newer
+    change arrived meanwhile, or if the oldest pending change has waited
+    SHARE_RELOAD_MAX_DELAY seconds. A burst of changes therefore costs one
+    reload. Every command ends by printing "live=<version>", the newest
+    manifest version the running server has loaded.
+    """
+    window = SHARE_RELOAD_WINDOW if window is None else window
+    lines = [
+        "set -e",
+        f"cd {SHARES_DIR}",
+        "mkdir -p tables.d",
+        "exec 9> .manifest.lock",
+        "flock 9",
+        "live=$(cat live.version 2>/dev/null || echo 0)",
+        'stale=""',
+    ]
+    if replace:
+        lines.append("find tables.d -mindepth 1 -delete")
+    for table_id, op in changes:
+        lines += [
+            "current=0",
+            f"[ ! -e tables.d/{table_id} ] || read -r current < tables.d/{table_id}",
+            f'if [ {version} -gt "$current" ]; then',
+            f"  printf '%s\\n%s\\n' {version} {op} > tables.d/{table_id}",
+            f'  if [ {version} -le "$live" ]; then stale=1; fi',
+            "fi",
+        ]
+    lines += [
+        "requested=$(cat requested.version 2>/dev/null || echo 0)",
+        f'if [ {version} -gt "$requested" ]; then echo {version} > requested.version; fi',
+        "[ -e pending.since ] || date +%s > pending.since",
+        # a change older than the live version: reload without waiting
+        '[ -z "$stale" ] || touch reload.forced',
+        "flock -u 9",
+        "",
+        f'[ -n "$stale" ] || sleep {window}',
+        "",
+        "flock 9",
+        "requested=$(cat requested.version)",
+        "live=$(cat live.version 2>/dev/null || echo 0)",
+        "since=$(cat pending.since 2>/dev/null || date +%s)",
+        "waited=$(( $(date +%s) - since ))",
+        'if [ "$live" -lt "$requested" ] || [ -e reload.forced ]; then',
+        f'  if [ -n "$stale" ] || [ "$requested" -eq {version} ]'
+        f' || [ "$waited" -ge {SHARE_RELOAD_MAX_DELAY} ]; then',
+        "    {",
+        "    cat << 'EOF'",
+        SHARE_YAML_HEADER,
+        "EOF",
+        "    rm -f tombstones.gc",
+        "    find tables.d -type f -printf '%T@ %f\\n' | sort -k 2 |",
+        '      awk -v live="$live" -v now="$(date +%s)" \'' + SHARE_YAML_AWK + "'",
+        "    } > share.yaml.tmp",
+        "    mv share.yaml.tmp share.yaml",
+        f"    {SHARE_RELOAD_COMMANDS[SHARE_RELOAD_MODE]}",
+        '    echo "$requested" > live.version',
+        "    rm -f pending.since reload.forced",
+        "    if [ -e tombstones.gc ]; then",
+        "      (cd tables.d && xargs -r rm -f -- < ../tombstones.gc)",
+        "      rm -f tombstones.gc",
+        "    fi",
+        "  fi",
+        "fi",
+        'echo "live=$(cat live.version 2>/dev/null || echo 0)"',
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def send_manifest_script(script: str) -> str:
+    cmd = ssm.send_command(
+        InstanceIds=[DELTA_INSTANCE_ID],
+        DocumentName="AWS-RunShellScript",
+        Parameters={"commands": [script]},
+        TimeoutSeconds=SHARE_COMMAND_TIMEOUT,
+    )
+    return cmd["Command"]["CommandId"]
+
+
+def remember_manifest_command(command_id: str, version: int):
+    """
+    Keep the newest command on the counter item; its output is what
+    manifest_state() reads to learn the live version.
+    """
+    try:
+        dynamodb.update_item(
+            TableName=DDB_TABLE,
+            Key={"userId": {"S": MANIFEST_PK}, "fileKey": {"S": MANIFEST_VERSION_SK}},
+            UpdateExpression="SET lastCommandId = :c, lastCommandVersion = :v",
+            ConditionExpression=(
+                "attribute_not_exists(lastCommandVersion) OR lastCommandVersion < :v"
+            ),
+            ExpressionAttributeValues={
+                ":c": {"S": command_id},
+                ":v": {"N": str(version)},
+            },
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Applying changes
+#
+# /share and /unshare take one table or a list: one manifest version for
+# the whole batch, each table's record update written in the same DynamoDB
+# transaction as its manifest entry, and a single SSM command (so a single
+# reload) carrying the whole diff.
+# ---------------------------------------------------------------------------
+MAX_TRANSACT_ITEMS = 100  # DynamoDB's TransactWriteItems limit
+
+
+def _write_transaction(groups) -> list:
+    """
+    TransactWriteItems for [(tableId, items)], retried without the tables
+    whose manifest entry lost to a newer version (the same outcome
+    put_manifest_entry gives). Such a table is dropped whole, record update
+    included, so its record never disagrees with the manifest. Returns the
+    dropped tableIds.
+    """
+    dropped = []
+    while groups:
+        try:
+            dynamodb.transact_write_items(
+                TransactItems=[item for _, items in groups for item in items]
+            )
+            return dropped
+        except dynamodb.exceptions.TransactionCanceledException as exc:
+            reasons = exc.response.get("CancellationReasons", [])
+            keep, offset = [], 0
+            for table_id, items in groups:
+                codes = [r.get("Code") for r in reasons[offset : offset + len(items)]]
+                offset += len(items)
+                lost = any(
+                    "Put" in item and code == "ConditionalCheckFailed"
+                    for item, code in zip(items, codes)
+                )
+                if lost:
+                    dropped.append(table_id)
+                else:
+                    keep.append((table_id, items))
+            if len(keep) == len(groups):
+                raise
+            groups = keep
+    return dropped
+
+
+def apply_manifest_changes(changes, record_updates: dict = None) -> dict:
+    """
+    Apply `changes` [(tableId, op)] at one manifest version and push them
+    to the instance in one command. `record_updates` maps a tableId to the
+    update_item parameters for its dataset record (records.dataset_update),
+    committed atomically with that table's manifest entry.
+
+    Tables that lost to a newer change of their own are left out of the
+    command and listed under "conflicted".
+    """
+    record_updates = record_updates or {}
+    version = bump_manifest_version()
+
+    per_table = [
+        (tid, [{"Update": record_updates[tid]}] if tid in record_updates else [])
+        for tid, _ in changes
+    ]
+    for (tid, op), (_, items) in zip(changes, per_table):
+        items.append({"Put": manifest_entry(tid, op, version)})
+    conflicted, batch, batch_items = [], [], 0
+    for tid, items in per_table:
+        # a table's items never straddle two transactions
+        if batch_items + len(items) > MAX_TRANSACT_ITEMS:
+            conflicted += _write_transaction(batch)
+            batch, batch_items = [], 0
+        batch.append((tid, items))
+        batch_items += len(items)
+    conflicted += _write_transaction(batch)
+
+    applied = [(tid, op) for tid, op in changes if tid not in conflicted]
+    command_id = None
+    if applied:
+        command_id = send_manifest_script(manifest_apply_script(applied, version))
+        remember_manifest_command(command_id, version)
+    return {
+        "manifestVersion": version,
+        "commandId": command_id,
+        "state": "pending",
+        "conflicted": conflicted,
+    }
+
+
+def manifest_state(version: int) -> dict:
+    """
+    Whether manifest `version` is live on the sharing server yet.
+
+    The live version is cached on the counter item; on a miss the newest
+    SSM command is asked for its "live=" line and the cache is advanced.
+    """
+    counter = dynamodb.get_item(
+        TableName=DDB_TABLE,
+        Key={"userId": {"S": MANIFEST_PK}, "fileKey": {"S": MANIFEST_VERSION_SK}},
+    ).get("Item", {})
+    live = int(counter.get("liveVersion", {}).get("N", "0"))
+
+    if live < version and "lastCommandId" in counter:
+        try:
+            inv = ssm.get_command_invocation(
+                CommandId=counter["lastCommandId"]["S"],
+                InstanceId=DELTA_INSTANCE_ID,
+            )
+        except ssm.exceptions.InvocationDoesNotExist:
+            inv = {}
+        reported = [
+            int(line[len("live=") :])
+            for line in inv.get("StandardOutputContent", "").splitlines()
+            if line.startswith("live=")
+        ]
+        if reported and reported[-1] > live:
+            live = reported[-1]
+            try:
+                dynamodb.update_item(
+                    TableName=DDB_TABLE,
+                    Key={
+                        "userId": {"S": MANIFEST_PK},
+                        "fileKey": {"S": MANIFEST_VERSION_SK},
+                    },
+                    UpdateExpression="SET liveVersion = :l",
+                    ConditionExpression=(
+                        "attribute_not_exists(liveVersion) OR liveVersion < :l"
+                    ),
+                    ExpressionAttributeValues={":l": {"N": str(live)}},
+                )
+            except dynamodb.exceptions.ConditionalCheckFailedException:
+                pass
+
+    return {
+        "manifestVersion": version,
+        "liveVersion": live,
+        "state": "live" if live >= version else "pending",
+    }
+
+
+# ---------------------------------------------------------------------------
+# Re-generate share.yaml with *all* shared tables
+#
+# Full rebuild for recovery (e.g. a replaced instance) or to seed the
+# manifest from existing records; invoked with {"action": "rebuild-share"}.
+# ---------------------------------------------------------------------------
+def share_table():
+    # 1) fetch all shared tableIds, following LastEvaluatedKey past 1 MB pages
+    pages = dynamodb.get_paginator("scan").paginate(
+        TableName=DDB_TABLE,
+        FilterExpression="#s = :sh",
+        ExpressionAttributeNames={"#s": "status"},
+        ExpressionAttributeValues={":sh": {"S": "shared"}},
+        ProjectionExpression="tableId",
+    )
+    table_ids = [i["tableId"]["S"] for page in pages for i in page.get("Items", [])]
+
+    # 2) re-seed the manifest at a single new version
+    version = bump_manifest_version()
+    for tid in table_ids:
+        put_manifest_entry(tid, "add", version)
+
+    # 3) send to instance (replaces every fragment)
+    script = manifest_apply_script(
+        [(tid, "add") for tid in table_ids], version, replace=True, window=0
+    )
+    command_id = send_manifest_script(script)
+    remember_manifest_command(command_id, version)
+    return command_id
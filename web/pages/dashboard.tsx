@@ -5,12 +5,15 @@ import { useRouter } from "next/router";
 import { auth } from "@/utils/firebase";
 import { onAuthStateChanged } from "firebase/auth";
 import { toUtf8Blob } from "@/utils/encoding";
+import { uploadMultipart } from "@/utils/upload";
 import ShareActions from "@/components/ShareActions";
 
 interface Dataset {
   tableId: string;
   filename: string;
-  status: "pending" | "converted" | "shared";
+  status: "pending" | "retrying" | "failed" | "converted" | "shared";
+  attempts?: number;
+  lastError?: string;
 }
 
 export default function DashboardPage() {
@@ -46,13 +49,20 @@ export default function DashboardPage() {
 
     async function fetchDatasets() {
       try {
-        const res = await fetch(
-          `${process.env.NEXT_PUBLIC_API_URL}/datasets?userId=${userId}`,
-          { credentials: "include" }
-        );
-        const json = await res.json();
+        // /datasets is paginated; follow nextToken until the list is complete
+        const all: Dataset[] = [];
+        let nextToken: string | undefined;
+        do {
+          const url = new URL(`${process.env.NEXT_PUBLIC_API_URL}/datasets`);
+          url.searchParams.set("userId", userId as string);
+          if (nextToken) url.searchParams.set("nextToken", nextToken);
+          const res = await fetch(url.toString(), { credentials: "include" });
+          const json = await res.json();
+          all.push(...(json.datasets || []));
+          nextToken = json.nextToken;
+        } while (nextToken && !cancelled);
         if (!cancelled) {
-          setDatasets(json.datasets || []);
+          setDatasets(all);
           setLoading(false);
         }
       } catch {
@@ -74,7 +84,7 @@ export default function DashboardPage() {
     setSelectedFile(file);
   };
 
-  // Upload CSV to S3 via presigned URL
+  // Upload the file to S3 via presigned URL
   const handleUpload = async () => {
     if (!userId || !selectedFile) {
       setStatusMessage("Please select a file and ensure you’re signed in.");
@@ -87,10 +97,38 @@ export default function DashboardPage() {
       {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ userId, filename: selectedFile.name }),
+        body: JSON.stringify({
+          userId,
+          filename: selectedFile.name,
+          size: selectedFile.size,
+        }),
       }
     );
     const presignData = await presignRes.json();
+
+    // Large files come back as a multipart upload: parts go up in parallel
+    // and are sent as-is (re-encoding would mean reading the whole file
+    // into memory), so they must already be UTF-8
+    if (presignData.uploadId) {
+      setStatusMessage("Uploading file…");
+      try {
+        await uploadMultipart(
+          process.env.NEXT_PUBLIC_API_URL as string,
+          selectedFile,
+          presignData,
+          (done, total) =>
+            setStatusMessage(`Uploading file… ${Math.floor((100 * done) / total)}%`)
+        );
+      } catch {
+        setStatusMessage("Upload failed. Please try again.");
+        return;
+      }
+      setStatusMessage("Upload complete! Processing will start shortly.");
+      setSelectedFile(null);
+      setLoading(true); // trigger refresh of dataset list
+      return;
+    }
+
     const url = presignData.url as string;
     if (!url) {
       setStatusMessage("Failed to obtain upload URL.");
@@ -98,11 +136,14 @@ export default function DashboardPage() {
     }
 
     setStatusMessage("Uploading file…");
-    const safeBlob = await toUtf8Blob(selectedFile);
+    // only plain CSV is text; compressed CSV, JSON Lines and Parquet go as-is
+    const contentType = presignData.contentType as string;
+    const body =
+      contentType === "text/csv" ? await toUtf8Blob(selectedFile) : selectedFile;
     const uploadRes = await fetch(url, {
       method: "PUT",
-      headers: { "Content-Type": "text/csv" },
-      body: safeBlob,
+      headers: { "Content-Type": contentType },
+      body,
     });
 
     if (uploadRes.ok) {
@@ -130,9 +171,10 @@ export default function DashboardPage() {
         </h2>
         <ul className="list-disc list-inside space-y-2 text-gray-700">
           <li>
-            <strong>Upload a CSV:</strong> Select a CSV file to upload. Then
-            click the “Upload New Dataset” button. This may take a minute or two
-            as the file is processed.
+            <strong>Upload a dataset:</strong> Select a CSV (plain, .gz or
+            .zst), JSON Lines or Parquet file to upload. Then click the “Upload
+            New Dataset” button. This may take a minute or two as the file is
+            processed.
           </li>
           <li>
             <strong>Share or Unshare:</strong> Use the “Share” button to
@@ -205,13 +247,16 @@ export default function DashboardPage() {
                   d="M7 16V4h10v12m-5-5l5 5H7l5-5z"
                 />
               </svg>
-              <span className="text-sm">Click to select a CSV</span>
+              <span className="text-sm">
+                Click to select a CSV, .csv.gz, .csv.zst, JSON Lines or Parquet
+                file
+              </span>
             </>
           )}
           <input
             id="file-upload"
             type="file"
-            accept=".csv"
+            accept=".csv,.gz,.zst,.jsonl,.parquet"
             onChange={handleFileChange}
             className="hidden"
             disabled={!authReady}
@@ -253,7 +298,13 @@ export default function DashboardPage() {
                   <h2 className="text-lg font-semibold text-white">
                     {ds.filename}
                   </h2>
-                  <p className="text-gray-400 text-sm">Status: {ds.status}</p>
+                  <p className="text-gray-400 text-sm">
+                    Status: {ds.status}
+                    {ds.attempts ? ` (attempt ${ds.attempts})` : ""}
+                  </p>
+                  {ds.lastError && ds.status !== "converted" && (
+                    <p className="text-red-400 text-xs">{ds.lastError}</p>
+                  )}
                 </div>
                 <ShareActions
                   tableId={ds.tableId}
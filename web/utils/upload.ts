@@ -0,0 +1,117 @@
+// utils/upload.ts
+
+export interface MultipartPresign {
+  tableId: string;
+  updateId?: string;
+  uploadId: string;
+  partSize: number;
+  parts: { partNumber: number; url: string }[];
+}
+
+// Browsers allow ~6 connections per host over HTTP/1.1, which S3 speaks
+const PART_CONCURRENCY = 6;
+const PART_RETRIES = 4;
+
+const sleep = (ms: number) => new Promise((r) => setTimeout(r, ms));
+
+/**
+ * PUT one part, retrying with backoff; resolves to its ETag. A 403 most
+ * likely means the presigned URL expired, so the URLs are renewed first.
+ */
+async function uploadPart(
+  url: () => string,
+  body: Blob,
+  renewUrls: () => Promise<void>
+): Promise<string> {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      const res = await fetch(url(), { method: "PUT", body });
+      const etag = res.headers.get("ETag");
+      if (res.ok && etag) return etag;
+      if (res.status === 403) await renewUrls();
+      throw new Error(`part upload failed (${res.status})`);
+    } catch (err) {
+      if (attempt >= PART_RETRIES) throw err;
+      await sleep(500 * 2 ** attempt);
+    }
+  }
+}
+
+/**
+ * Upload a file through the presigned part URLs from /presign, a few parts
+ * at a time, then complete it (or abort it if a part keeps failing).
+ */
+export async function uploadMultipart(
+  apiUrl: string,
+  file: Blob,
+  presign: MultipartPresign,
+  onProgress?: (done: number, total: number) => void
+): Promise<void> {
+  const { tableId, updateId, uploadId, partSize, parts } = presign;
+  const ids = { tableId, updateId, uploadId };
+  const urls = new Map(parts.map((p) => [p.partNumber, p.url]));
+  const etags: { partNumber: number; etag: string }[] = [];
+  const sent = new Set<number>();
+  let renewing: Promise<void> | null = null;
+  let next = 0;
+
+  // Sign every part not sent yet again; workers that hit an expired URL at
+  // the same time share one request.
+  function renewUrls(): Promise<void> {
+    if (!renewing) {
+      renewing = (async () => {
+        const res = await fetch(`${apiUrl}/presign/parts`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({
+            ...ids,
+            partNumbers: parts
+              .map((p) => p.partNumber)
+              .filter((n) => !sent.has(n)),
+          }),
+        });
+        if (!res.ok) throw new Error("renewing the part URLs failed");
+        const renewed: MultipartPresign["parts"] = (await res.json()).parts;
+        for (const p of renewed) urls.set(p.partNumber, p.url);
+      })().finally(() => {
+        renewing = null;
+      });
+    }
+    return renewing;
+  }
+
+  async function worker() {
+    while (next < parts.length) {
+      const { partNumber } = parts[next++];
+      const start = (partNumber - 1) * partSize;
+      const etag = await uploadPart(
+        () => urls.get(partNumber) as string,
+        file.slice(start, start + partSize),
+        renewUrls
+      );
+      sent.add(partNumber);
+      etags.push({ partNumber, etag });
+      onProgress?.(etags.length, parts.length);
+    }
+  }
+
+  try {
+    await Promise.all(
+      Array.from({ length: Math.min(PART_CONCURRENCY, parts.length) }, worker)
+    );
+  } catch (err) {
+    await fetch(`${apiUrl}/presign/abort`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(ids),
+    }).catch(() => undefined);
+    throw err;
+  }
+
+  const res = await fetch(`${apiUrl}/presign/complete`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ ...ids, parts: etags }),
+  });
+  if (!res.ok) throw new Error("completing the upload failed");
+}